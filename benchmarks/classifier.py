@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Compares the classifier registry in analyse_and_decrement with the former
+# loop over two separately compiled regexes, on synthetic keys of every log
+# format the registry knows plus keys of no format at all. The registry is run
+# both one key at a time and in bulk. --other sets the share of keys of no
+# format, which is most keys in a fleet-wide backfill. Bulk throughput is
+# compared with --target, which keys that really are logs do not reach; the
+# figures measured are in the Benchmarks section of the README.
+#
+#   python3 benchmarks/classifier.py --keys 1000000 --other 0.9
+#
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+
+from analyse_and_decrement.classifier import REGISTRY, CLOUDFRONT, ELB
+
+
+SAMPLES = {
+    'cloudfront': 'cf-logs/E2EXAMPLE1ABCD.2024-03-01-12.A1B2C3D4E5.gz',
+    'elb_test_file': 'lb-logs/AWSLogs/123456789012/ELBAccessLogTestFile',
+    'alb': 'AWSLogs/123456789012/elasticloadbalancing/eu-north-1/2024/03/01/'
+           '123456789012_elasticloadbalancing_eu-north-1_app.my-alb.1234567890abcdef_20240301T1200Z_10.0.0.1_5x9kq2lp.log.gz',
+    'nlb': 'AWSLogs/123456789012/elasticloadbalancing/eu-north-1/2024/03/01/'
+           '123456789012_elasticloadbalancing_eu-north-1_net.my-nlb.1234567890abcdef_20240301T1200Z_2a46f1b3.log.gz',
+    'classic_elb': 'AWSLogs/123456789012/elasticloadbalancing/eu-north-1/2024/03/01/'
+                   '123456789012_elasticloadbalancing_eu-north-1_my-elb_20240301T1200Z_10.0.0.1_20sg8hgm.log',
+    'vpc_flow': 'AWSLogs/123456789012/vpcflowlogs/eu-north-1/2024/03/01/'
+                '123456789012_vpcflowlogs_eu-north-1_fl-1234abcd_20240301T1200Z_fe123456.log.gz',
+    'cloudtrail': 'AWSLogs/123456789012/CloudTrail/eu-north-1/2024/03/01/'
+                  '123456789012_CloudTrail_eu-north-1_20240301T1200Z_Mu0KsOhtH1ar15ZZ.json.gz',
+    'waf': 'AWSLogs/123456789012/WAFLogs/eu-north-1/my-acl/2024/03/01/12/00/'
+           '123456789012_waflogs_eu-north-1_my-acl_20240301T1200Z_abcd1234.log.gz',
+    's3_access': 'access-logs/2024-03-01-12-34-56-0123456789ABCDEF',
+    None: 'uploads/2024/03/invoice-0001.pdf',
+}
+
+
+OTHER_EXTENSIONS = ['pdf', 'csv', 'json', 'parquet', 'png']
+
+
+def synthetic_keys(count, seed=42, other=None):
+    # With other=None all samples are equally likely, otherwise that share of
+    # the keys are other files
+    rng = random.Random(seed)
+    templates = list(SAMPLES.items())
+    keys = []
+    for i in range(count):
+        if other is not None and rng.random() < other:
+            keys.append(f"data/{i:08d}/report-{rng.randrange(10 ** 6)}.{rng.choice(OTHER_EXTENSIONS)}")
+            continue
+        name, key = templates[rng.randrange(len(templates))]
+        # Vary the keys so that nothing can be cached on identity
+        keys.append(f"{i:08d}/{key}" if name != 'cloudfront' else key.replace('2024-03-01-12', f"2024-03-{i % 28 + 1:02d}-12"))
+    return keys
+
+
+def two_regex_loop(keys):
+    p_cf = re.compile(r'.+[A-Z0-9]{8,}\.\d{4}-\d{2}-\d{2}-\d{2}\.[A-Z0-9]{8,}\.gz$')
+    p_elb = re.compile(r'.*ELBAccessLogTestFile$|.*AWSLogs.+elasticloadbalancing.+\.log\.gz$')
+    cloudfront_logs = elb_logs = other_files = 0
+    for file in keys:
+        if p_cf.match(file):
+            cloudfront_logs += 1
+        elif p_elb.match(file):
+            elb_logs += 1
+        else:
+            other_files += 1
+    return cloudfront_logs, elb_logs
+
+
+def registry_per_key(keys):
+    # How the registry counted keys before bulk classification
+    counts = dict.fromkeys(REGISTRY.names, 0)
+    for key in keys:
+        name = REGISTRY.classify(key)
+        if name:
+            counts[name] += 1
+    families = REGISTRY.family_counts(counts)
+    return families.get(CLOUDFRONT, 0), families.get(ELB, 0)
+
+
+def registry_bulk(keys):
+    summary = REGISTRY.summarise(keys)
+    return summary['cloudfront_logs'], summary['elb_logs']
+
+
+def timed(function, keys):
+    started = time.perf_counter()
+    result = function(keys)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=1_000_000, help='Number of synthetic keys')
+    parser.add_argument('--other', type=float, help='Share of keys of no log format (default: one in ten)')
+    parser.add_argument('--target', type=int, default=1_000_000, help='Bulk keys per second aimed for')
+    args = parser.parse_args()
+
+    keys = synthetic_keys(args.keys, other=args.other)
+    for name, sample in SAMPLES.items():
+        assert REGISTRY.classify(sample) == name, (name, REGISTRY.classify(sample))
+
+    classifiers = [
+        ('two regexes', two_regex_loop, 2),
+        ('registry', registry_per_key, len(REGISTRY.names)),
+        ('registry bulk', registry_bulk, len(REGISTRY.names)),
+    ]
+    print(f"{'classifier':<16}{'formats':>8}{'seconds':>10}{'keys/s':>14}")
+    results = set()
+    for name, function, formats in classifiers:
+        result, elapsed = timed(function, keys)
+        print(f"{name:<16}{formats:>8}{elapsed:>10.3f}{int(len(keys) / elapsed):>14,}   cloudfront, elb = {result}")
+        if function is not two_regex_loop:
+            results.add(result)
+    throughput = int(len(keys) / elapsed)
+    print(f"Bulk classification {'meets' if throughput >= args.target else 'does NOT meet'} the target of {args.target:,} keys/s.")
+
+    if len(results) != 1:
+        print("Per-key and bulk classification disagree!")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+#
+# Cold-start profile of every handler under functions/. Each handler is
+# imported in fresh interpreters under -X importtime, then invoked against the
+# local AWS stand-ins: once cold, then repeatedly warm. Medians are printed and
+# written as JSON; given an earlier JSON file as the baseline, the run fails
+# when a handler's cold start has regressed by more than the tolerance.
+#
+# Given a git revision with --against, the handlers of that revision are also
+# compared with those of the working tree: the time to import each one and
+# then create an STS client, which every cross-account call starts with. This
+# compares eager and lazy client creation without invoking the handlers, which
+# older revisions can't do against the stand-ins.
+#
+#   python3 benchmarks/cold_start.py --runs 10 --output cold_start.json
+#   python3 benchmarks/cold_start.py --baseline cold_start.json --tolerance 0.25
+#   python3 benchmarks/cold_start.py --against v1.2.9
+#
+
+import os
+import re
+import sys
+import glob
+import json
+import tarfile
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+FUNCTIONS = os.path.join(ROOT, 'functions')
+
+ACCOUNT_ID = '222222222222'
+REGION = 'eu-north-1'
+
+# What the template passes to the functions, plus fake credentials. The state
+# table is left out so that the functions use the SQLite stand-in.
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': REGION,
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'CROSS_ACCOUNT_ROLE': 'AWSControlTowerExecution',
+    'LOG_ARCHIVE_ACCOUNT_ID': '111111111111',
+    'LOG_ARCHIVE_ACCOUNT_iD': '111111111111',
+    'STATE_MACHINE_ARN': f'arn:aws:states:{REGION}:{ACCOUNT_ID}:stateMachine:MonitorBucketForLogs',
+    'REPLICATION_ROLE_NAME': 'replication-role',
+    'CLOUDFRONT_LOGS_BUCKET_NAME': 'cloudfront-logs',
+    'LOAD_BALANCER_LOGS_BUCKET_NAME': 'load-balancer-logs',
+}
+
+# Keys put in the buckets the handlers list, newest last
+ALB_KEY = (
+    f'AWSLogs/{ACCOUNT_ID}/elasticloadbalancing/{REGION}/2024/03/01/'
+    f'{ACCOUNT_ID}_elasticloadbalancing_{REGION}_app.my-alb.1234567890abcdef_20240301T1200Z_10.0.0.1_{{:08d}}.log.gz'
+)
+OBJECTS_PER_BUCKET = 200
+
+# Ignore regressions smaller than this, which are noise
+NOISE_MS = 5.0
+
+# Written to stderr by the child around the handler's import and first call
+MARKERS = ['cold-start: import', 'cold-start: imported', 'cold-start: call', 'cold-start: called']
+
+
+def event_for(handler, i):
+    # A typical event for the handler, about a bucket of its own for each call
+    # so that warm calls do the same work as the cold one
+    from local.events import lifecycle_event, object_created_event
+    bucket = {'region': REGION, 'account_id': ACCOUNT_ID, 'bucket_name': f'bucket-{i}'}
+    if handler == 'lifecycle_event':
+        return lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, bucket['bucket_name'])
+    if handler == 'object_created':
+        return object_created_event(ACCOUNT_ID, REGION, bucket['bucket_name'], ALB_KEY.format(0))
+    if handler == 'analyse_and_decrement':
+        return {**bucket, 'counter': 200, 'listing': {'files': [ALB_KEY.format(n) for n in range(10)]}}
+    if handler in ('activate_replication', 'create_incident'):
+        return {**bucket, 'verdict': 'elb'}
+    if handler == 'pending_buckets':
+        return {'action': 'collect'}
+    return bucket
+
+
+def child(handler, calls):
+    # Runs in the fresh interpreter. Only the handler's own import is timed;
+    # the stand-ins are imported after it.
+    import time
+    import importlib
+    sys.path[:0] = [FUNCTIONS, ROOT]
+
+    print(MARKERS[0], file=sys.stderr, flush=True)
+    started = time.perf_counter()
+    module = importlib.import_module(f'{handler}.app')
+    imported = time.perf_counter()
+    print(MARKERS[1], file=sys.stderr, flush=True)
+
+    from local.aws import AWS
+    aws = AWS().install()
+    for i in range(calls):
+        aws.s3.create_bucket(Bucket=f'bucket-{i}')
+        for n in range(OBJECTS_PER_BUCKET):
+            aws.s3.put_object(Bucket=f'bucket-{i}', Key=ALB_KEY.format(n))
+    events = [event_for(handler, i) for i in range(calls)]
+
+    timings = []
+    for event in events:
+        if not timings:
+            print(MARKERS[2], file=sys.stderr, flush=True)
+        called = time.perf_counter()
+        module.lambda_handler(event, None)
+        timings.append((time.perf_counter() - called) * 1000)
+        if len(timings) == 1:
+            print(MARKERS[3], file=sys.stderr, flush=True)
+
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'first_call_ms': timings[0],
+        'warm_call_ms': statistics.median(timings[1:]),
+        'modules': len(sys.modules),
+    }))
+
+
+def client_child(handler):
+    # Runs in the fresh interpreter, with the tree compared on the path
+    import time
+    import importlib
+    started = time.perf_counter()
+    importlib.import_module(f'{handler}.app')
+    imported = time.perf_counter()
+    try:
+        from common import clients
+        clients.client('sts')
+    except ImportError:
+        import boto3
+        boto3.client('sts')
+    done = time.perf_counter()
+    print(json.dumps({'import_ms': (imported - started) * 1000, 'first_client_ms': (done - imported) * 1000}))
+
+
+def top_level_imports(stderr, start, end):
+    # -X importtime prints one line per module imported, indented by depth;
+    # the unindented ones between the markers are those imported directly
+    cumulative = {}
+    lines = stderr.splitlines()
+    for line in lines[lines.index(start) + 1:lines.index(end)]:
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)', line)
+        if match and not match.group(3):
+            cumulative[match.group(4)] = int(match.group(2)) / 1000
+    return cumulative
+
+
+def heaviest(imports, count=5):
+    return dict(sorted(imports.items(), key=lambda i: -i[1])[:count])
+
+
+def measure(handler, runs, calls):
+    env = dict(os.environ, **ENVIRONMENT)
+    samples = []
+    for _run in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', __file__, '--child', handler, '--calls', str(calls)],
+            cwd=ROOT, env=env, check=True, capture_output=True, text=True
+        )
+        sample = json.loads(result.stdout.splitlines()[-1])
+        sample['imports'] = top_level_imports(result.stderr, *MARKERS[:2])
+        sample['call_imports'] = top_level_imports(result.stderr, *MARKERS[2:])
+        samples.append(sample)
+
+    measured = {key: statistics.median(s[key] for s in samples) for key in ('import_ms', 'first_call_ms', 'warm_call_ms')}
+    measured['cold_start_ms'] = measured['import_ms'] + measured['first_call_ms']
+    measured['modules'] = samples[0]['modules']
+    # What importing the handler, and then calling it for the first time,
+    # spends most time importing according to -X importtime
+    measured['heaviest_imports_ms'] = heaviest(samples[0]['imports'])
+    measured['heaviest_first_call_imports_ms'] = heaviest(samples[0]['call_imports'])
+    return measured
+
+
+def export(revision, directory):
+    # The functions folder of a revision, without touching the working tree
+    archive = subprocess.run(
+        ['git', '-C', ROOT, 'archive', '--format=tar', revision, 'functions'],
+        check=True, capture_output=True
+    ).stdout
+    path = os.path.join(directory, 'archive.tar')
+    with open(path, 'wb') as f:
+        f.write(archive)
+    with tarfile.open(path) as tar:
+        tar.extractall(directory, filter='data')
+    return os.path.join(directory, 'functions')
+
+
+def handlers_in(functions):
+    return sorted(os.path.basename(os.path.dirname(path)) for path in glob.glob(os.path.join(functions, '*', 'app.py')))
+
+
+def measure_client(functions, handler, runs):
+    env = dict(os.environ, **ENVIRONMENT, PYTHONPATH=functions)
+    samples = []
+    for _run in range(runs):
+        output = subprocess.run(
+            [sys.executable, __file__, '--client-child', handler],
+            cwd=functions, env=env, check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    return {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+
+
+def compare(revision, runs):
+    # Import plus first client, for the handlers in both trees
+    with tempfile.TemporaryDirectory() as directory:
+        trees = [(revision, export(revision, directory)), ('working tree', FUNCTIONS)]
+        subprocess.run([sys.executable, '-m', 'compileall', '-q', trees[0][1]], check=True)
+        handlers = sorted(set(handlers_in(trees[0][1])) & set(handlers_in(FUNCTIONS)))
+
+        width = max(len(name) for name, _functions in trees) + 2
+        print(f"\n{'handler':<24}{'tree':<{width}}{'import':>9}{'first client':>14}{'total':>9}   (ms)")
+        for handler in handlers:
+            for name, functions in trees:
+                result = measure_client(functions, handler, runs)
+                total = result['import_ms'] + result['first_client_ms']
+                print(f"{handler:<24}{name:<{width}}{result['import_ms']:>9.1f}{result['first_client_ms']:>14.1f}{total:>9.1f}")
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for handler, measured in results.items():
+        before = baseline.get(handler)
+        if not before:
+            continue
+        limit = before['cold_start_ms'] * (1 + tolerance)
+        if measured['cold_start_ms'] > limit and measured['cold_start_ms'] - before['cold_start_ms'] > NOISE_MS:
+            found.append(f"{handler}: cold start {measured['cold_start_ms']:.1f} ms, was {before['cold_start_ms']:.1f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help='Fresh interpreters per handler')
+    parser.add_argument('--calls', type=int, default=20, help='Invocations per interpreter, the first one cold')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Fail on regressions against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed cold start increase, as a fraction')
+    parser.add_argument('--against', help='Also compare import and first client with this git revision')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--client-child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.calls < 2:
+        parser.error("--calls must be at least 2, a cold call and a warm one")
+
+    if args.child:
+        child(args.child, args.calls)
+        return
+    if args.client_child:
+        client_child(args.client_child)
+        return
+
+    # Compile first so that compiling isn't measured
+    subprocess.run([sys.executable, '-m', 'compileall', '-q', FUNCTIONS, os.path.join(ROOT, 'local')], check=True)
+    handlers = handlers_in(FUNCTIONS)
+
+    results = {}
+    print(f"{'handler':<24}{'import':>9}{'first call':>12}{'cold start':>12}{'warm call':>11}{'modules':>9}   (ms)")
+    for handler in handlers:
+        measured = results[handler] = measure(handler, args.runs, args.calls)
+        print(
+            f"{handler:<24}{measured['import_ms']:>9.1f}{measured['first_call_ms']:>12.1f}"
+            f"{measured['cold_start_ms']:>12.1f}{measured['warm_call_ms']:>11.2f}{measured['modules']:>9}"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.against:
+        compare(args.against, args.runs)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
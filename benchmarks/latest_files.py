@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Compares the bounded top-N selector in get_latest_files against the previous
+# approach of materialising and sorting the whole listing. Each strategy runs in
+# its own interpreter so that peak RSS figures don't bleed into each other.
+#
+#   python3 benchmarks/latest_files.py --keys 5000000 --top 10
+#
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+
+from get_latest_files.listing import select_latest
+
+
+PAGE_SIZE = 1000
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class ObjectSummary:
+    # Stand-in for boto3's s3.ObjectSummary, which is what the old code held
+    # on to for every object in the bucket.
+    def __init__(self, key, last_modified):
+        self.key = key
+        self.last_modified = last_modified
+
+
+def synthetic_pages(keys):
+    # A lexicographically ordered listing of ALB-style keys whose modification
+    # times are deliberately not in key order.
+    for start in range(0, keys, PAGE_SIZE):
+        contents = []
+        for i in range(start, min(start + PAGE_SIZE, keys)):
+            contents.append({
+                'Key': f"AWSLogs/123456789012/elasticloadbalancing/eu-north-1/{i:012d}.log.gz",
+                'LastModified': EPOCH + timedelta(seconds=(i * 7919) % keys),
+                'Size': 1024,
+            })
+        yield {'Contents': contents, 'IsTruncated': start + PAGE_SIZE < keys}
+
+
+def sort_everything(keys, top):
+    objects = [ObjectSummary(o['Key'], o['LastModified']) for page in synthetic_pages(keys) for o in page['Contents']]
+    objects.sort(key=lambda o: o.last_modified)
+    return len(objects), [o.key for o in objects[-top:]]
+
+
+def bounded_heap(keys, top):
+    latest, stats = select_latest(synthetic_pages(keys), top)
+    return stats['keys_listed'], [key for _last_modified, key in latest]
+
+
+STRATEGIES = {
+    'sort': sort_everything,
+    'heap': bounded_heap,
+}
+
+
+def run_one(strategy, keys, top):
+    started = time.perf_counter()
+    total, files = STRATEGIES[strategy](keys, top)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        'strategy': strategy,
+        'keys': total,
+        'seconds': round(elapsed, 3),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'newest': files[-1],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=5_000_000, help='Number of synthetic keys in the listing')
+    parser.add_argument('--top', type=int, default=10, help='Number of newest keys to keep')
+    parser.add_argument('--strategy', choices=STRATEGIES.keys(), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.strategy:
+        run_one(args.strategy, args.keys, args.top)
+        return
+
+    results = []
+    for strategy in STRATEGIES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--strategy', strategy, '--keys', str(args.keys), '--top', str(args.top)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output))
+
+    print(f"{'strategy':<10}{'keys':>12}{'seconds':>10}{'peak RSS (MB)':>16}")
+    for r in results:
+        print(f"{r['strategy']:<10}{r['keys']:>12}{r['seconds']:>10}{r['peak_rss_mb']:>16}")
+
+    if len({r['newest'] for r in results}) != 1:
+        print("Strategies disagree on the newest key!")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
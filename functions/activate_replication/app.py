@@ -1,110 +1,200 @@
 import os
-import boto3
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from common import credentials, metrics, verdicts
+from common.store import get_store
+from activate_replication import configuration, graph
 
 CROSS_ACCOUNT_ROLE = os.environ['CROSS_ACCOUNT_ROLE']
 REPLICATION_ROLE_NAME = os.environ['REPLICATION_ROLE_NAME']
 CLOUDFRONT_LOGS_BUCKET_NAME = os.environ['CLOUDFRONT_LOGS_BUCKET_NAME']
 LOAD_BALANCER_LOGS_BUCKET_NAME = os.environ['LOAD_BALANCER_LOGS_BUCKET_NAME']
 LOG_ARCHIVE_ACCOUNT_iD = os.environ['LOG_ARCHIVE_ACCOUNT_iD']
+# 'overwrite' writes the whole configuration every time; 'reconcile' reads it
+# first and only writes what differs, keeping the bucket's own rules
+CONFIGURATION_MODE = os.environ.get('CONFIGURATION_MODE', 'overwrite')
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+
+# The order of the fields of a bucket given as a list in a batch
+BUCKET_FIELDS = ('account_id', 'region', 'bucket_name', 'verdict')
+
+# The steps each configuration step has to wait for. S3 refuses replication on
+# buckets without versioning; everything else is independent.
+REQUIRES = {
+    'replication': ['versioning'],
+}
 
-sts_client = boto3.client('sts')
+STORE = get_store()
 
 
 def lambda_handler(data, _context):
+    if 'buckets' in data:
+        return {'buckets': activate_buckets(data['buckets'])}
+    return activate(data)
+
+
+def activate_buckets(buckets):
+    # Backfills and bursts. Buckets are given as events of their own or as
+    # (account_id, region, bucket_name, verdict) lists, and grouped on account
+    # and region so that each group assumes the role once. A bucket which fails
+    # gets its error recorded and doesn't hold up the rest.
+    buckets = [bucket if isinstance(bucket, dict) else dict(zip(BUCKET_FIELDS, bucket)) for bucket in buckets]
+    groups = {}
+    for bucket in buckets:
+        # Buckets already configured don't need the role assumed at all
+        if configured_before(bucket):
+            bucket['changed'] = []
+            continue
+        groups.setdefault((bucket['account_id'], bucket['region']), []).append(bucket)
+
+    def activate_one(bucket, client):
+        try:
+            bucket.update(replicate(bucket, client))
+        except Exception as e:
+            print(f"Failed to activate replication of {bucket['bucket_name']}: {e}")
+            bucket['replication_error'] = str(e)
+
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        futures = []
+        for (account_id, region), group in groups.items():
+            try:
+                client = get_client('s3', account_id, region)
+            except Exception as e:
+                print(f"Failed to assume {CROSS_ACCOUNT_ROLE} in account {account_id}, region {region}: {e}")
+                for bucket in group:
+                    bucket['replication_error'] = str(e)
+                continue
+            futures.extend(executor.submit(activate_one, bucket, client) for bucket in group)
+        for future in futures:
+            future.result()
+    return buckets
+
+
+def activate(data, client=None):
+    if configured_before(data):
+        return {'bucket_name': data['bucket_name'], 'changed': []}
+    return replicate(data, client)
+
+
+def replicate(data, client=None):
     region = data['region']
     account_id = data['account_id']
     source_bucket_name = data['bucket_name']
     verdict = data['verdict']
-    destination_bucket_name = CLOUDFRONT_LOGS_BUCKET_NAME if verdict == 'cloudfront' else LOAD_BALANCER_LOGS_BUCKET_NAME
-
-    client = get_client('s3', account_id, region)
-
-    print("Enabling encyption of {source_bucket_name}...")
-    response = client.put_bucket_encryption(
-        Bucket=source_bucket_name,
-        ServerSideEncryptionConfiguration={
-            'Rules': [
-                {
-                    'ApplyServerSideEncryptionByDefault': {
-                        'SSEAlgorithm': 'AES256'
-                    }
-                },
-            ]
-        }
-    )
-    print(response)
-
-    print("Enabling versioning...")
-    response = client.put_bucket_versioning(
-        Bucket=source_bucket_name,
-        VersioningConfiguration={
-            'MFADelete': 'Disabled',
-            'Status': 'Enabled'
-        }
-    )
-    print(response)
-
-    print(f"Enabling replication to {destination_bucket_name}...")
-    response = client.put_bucket_replication(
-        Bucket=source_bucket_name,
-        ReplicationConfiguration={
-            'Role': f'arn:aws:iam::{account_id}:role/{REPLICATION_ROLE_NAME}',
-            'Rules': [
-                {
-                    'Status': 'Enabled',
-                    'Priority': 1,
-                    "Filter": {},
-                    'DeleteMarkerReplication': {
-                        'Status': 'Disabled'
-                    },
-                    'Destination': {
-                        'Account': LOG_ARCHIVE_ACCOUNT_iD,
-                        'Bucket': f'arn:aws:s3:::{destination_bucket_name}',
-                        'StorageClass': 'STANDARD',
-                        'AccessControlTranslation': {
-                            'Owner': 'Destination'
-                        },
-                    },
-                },
-            ],
-        },
-    )
-    print(response)
-
-    print(f"Setting lifecycle policy...")
-    response = client.put_bucket_lifecycle_configuration(
-        Bucket=source_bucket_name,
-        LifecycleConfiguration={
-            'Rules': [
-                {
-                    'Status': 'Enabled',
-                    'Filter': {},
-                    'Transitions': [],
-                    'Expiration': {
-                        'Days': 14,
-                    },
-                },
-            ],
-        },
-    )
-    print(response)
 
+    client = client or get_client('s3', account_id, region)
+    role_arn, rule = target(data)
+
+    changed = configure(client, source_bucket_name, role_arn, rule, CONFIGURATION_MODE == 'reconcile', account_id, region)
+    metrics.emit('ConfigurationsChanged', len(changed), 'Count', account_id, region)
+    if not changed:
+        print(f"{source_bucket_name} is already configured for replication, nothing to do.")
+    try:
+        verdicts.record_configuration(STORE, account_id, region, source_bucket_name, verdict, desired_hash(role_arn, rule))
+    except Exception as e:
+        print(f"Failed to record the configuration of {source_bucket_name}: {e}")
+    return {'bucket_name': source_bucket_name, 'changed': changed}
+
+
+def target(data):
+    # The replication role of the bucket's account, and our replication rule
+    destination_bucket_name = CLOUDFRONT_LOGS_BUCKET_NAME if data['verdict'] == 'cloudfront' else LOAD_BALANCER_LOGS_BUCKET_NAME
+    role_arn = f"arn:aws:iam::{data['account_id']}:role/{REPLICATION_ROLE_NAME}"
+    return role_arn, configuration.replication_rule(LOG_ARCHIVE_ACCOUNT_iD, destination_bucket_name)
+
+
+def desired_hash(role_arn, rule):
+    # Changes whenever what we would write does, e.g. after a change of role
+    # or destination, so that buckets are then configured again
+    return verdicts.configuration_hash({
+        'encryption': configuration.encryption(),
+        'versioning': configuration.versioning(),
+        'replication': configuration.replication(role_arn, rule),
+        'lifecycle': configuration.lifecycle(),
+    })
+
+
+def configured_before(data):
+    # Whether the verdict store says we configured this bucket, for the same
+    # verdict, exactly as we would now
+    try:
+        decision = verdicts.lookup(STORE, data['account_id'], data['region'], data['bucket_name'])
+    except Exception as e:
+        print(f"Failed to look up the verdict on {data['bucket_name']}: {e}")
+        return False
+    if not decision or decision['verdict'] != data['verdict'] or decision.get('configuration_hash') != desired_hash(*target(data)):
+        return False
+    print(f"{data['bucket_name']} was configured for replication after the verdict of {decision['decided_at']}, nothing to do.")
+    metrics.emit('ActivationsSkipped', 1, 'Count', data['account_id'], data['region'])
     return True
 
 
-def get_client(client_type, account_id, region, role=CROSS_ACCOUNT_ROLE):
-    other_session = sts_client.assume_role(
-        RoleArn=f"arn:aws:iam::{account_id}:role/{role}",
-        RoleSessionName=f"activate_replication_{account_id}"
-    )
-    access_key = other_session['Credentials']['AccessKeyId']
-    secret_key = other_session['Credentials']['SecretAccessKey']
-    session_token = other_session['Credentials']['SessionToken']
-    return boto3.client(
-        client_type,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        aws_session_token=session_token,
-        region_name=region
-    )
+def configure(client, bucket_name, role_arn, rule, reconcile, account_id=None, region=None):
+    # Runs the configuration steps concurrently on the shared client. Failures
+    # are collected and raised together once every step that could run has.
+    # Returns the names of the configurations written.
+    steps = {
+        'encryption': partial(encryption_step, client, bucket_name, reconcile),
+        'versioning': partial(versioning_step, client, bucket_name, reconcile),
+        'replication': partial(replication_step, client, bucket_name, reconcile, role_arn, rule),
+        'lifecycle': partial(lifecycle_step, client, bucket_name, reconcile),
+    }
+    steps = {name: partial(timed_step, name, step, account_id, region) for name, step in steps.items()}
+    results, errors = graph.run(steps, REQUIRES)
+    if errors:
+        raise RuntimeError(f"Configuring {bucket_name} failed: " + '; '.join(f"{name}: {errors[name]}" for name in steps if name in errors))
+    return [name for name in steps if results[name]]
+
+
+def timed_step(name, step, account_id, region):
+    # The latency of the S3 calls a step makes, reads and writes together
+    with metrics.timed('ReplicationStepLatency', account_id, region, {'Step': name}):
+        return step()
+
+
+# Each step writes its configuration, or in reconcile mode only what differs
+# from the current one, and returns whether it wrote anything
+
+def encryption_step(client, bucket_name, reconcile):
+    config = configuration.encryption_change(client, bucket_name) if reconcile else configuration.encryption()
+    if config is None:
+        return False
+    print(f"Enabling encryption of {bucket_name}...")
+    print(client.put_bucket_encryption(Bucket=bucket_name, ServerSideEncryptionConfiguration=config))
+    return True
+
+
+def versioning_step(client, bucket_name, reconcile):
+    config = configuration.versioning_change(client, bucket_name) if reconcile else configuration.versioning()
+    if config is None:
+        return False
+    print(f"Enabling versioning of {bucket_name}...")
+    print(client.put_bucket_versioning(Bucket=bucket_name, VersioningConfiguration=config))
+    return True
+
+
+def replication_step(client, bucket_name, reconcile, role_arn, rule):
+    if reconcile:
+        config = configuration.replication_change(client, bucket_name, role_arn, rule)
+    else:
+        config = configuration.replication(role_arn, rule)
+    if config is None:
+        return False
+    print(f"Enabling replication of {bucket_name} to {rule['Destination']['Bucket']}...")
+    print(client.put_bucket_replication(Bucket=bucket_name, ReplicationConfiguration=config))
+    return True
+
 
+def lifecycle_step(client, bucket_name, reconcile):
+    rule = configuration.expiration_rule()
+    config = configuration.lifecycle_change(client, bucket_name, rule) if reconcile else configuration.lifecycle()
+    if config is None:
+        return False
+    print(f"Setting lifecycle policy of {bucket_name}...")
+    print(client.put_bucket_lifecycle_configuration(Bucket=bucket_name, LifecycleConfiguration=config))
+    return True
+
+
+def get_client(client_type, account_id, region, role=CROSS_ACCOUNT_ROLE):
+    return credentials.get_client(client_type, account_id, region, role, session_name=f"activate_replication_{account_id}")
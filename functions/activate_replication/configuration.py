@@ -0,0 +1,176 @@
+# The configuration a log bucket needs for its logs to be replicated to the Log
+# Archive, and the reads which bring an existing bucket in line with it while
+# keeping any rules of its own. Our rules carry fixed IDs so that they can be
+# told apart from those on later runs.
+REPLICATION_RULE_ID = 'ReplicateToLogArchive'
+EXPIRATION_RULE_ID = 'ExpireReplicatedLogs'
+EXPIRATION_DAYS = 14
+
+
+def encryption():
+    return {
+        'Rules': [
+            {
+                'ApplyServerSideEncryptionByDefault': {
+                    'SSEAlgorithm': 'AES256'
+                }
+            },
+        ]
+    }
+
+
+def versioning():
+    return {
+        'MFADelete': 'Disabled',
+        'Status': 'Enabled'
+    }
+
+
+def replication_rule(destination_account_id, destination_bucket_name):
+    return {
+        'ID': REPLICATION_RULE_ID,
+        'Status': 'Enabled',
+        'Priority': 1,
+        'Filter': {},
+        'DeleteMarkerReplication': {
+            'Status': 'Disabled'
+        },
+        'Destination': {
+            'Account': destination_account_id,
+            'Bucket': f'arn:aws:s3:::{destination_bucket_name}',
+            'StorageClass': 'STANDARD',
+            'AccessControlTranslation': {
+                'Owner': 'Destination'
+            },
+        },
+    }
+
+
+def replication(role_arn, rule):
+    return {
+        'Role': role_arn,
+        'Rules': [rule],
+    }
+
+
+def expiration_rule():
+    return {
+        'ID': EXPIRATION_RULE_ID,
+        'Status': 'Enabled',
+        'Filter': {},
+        'Transitions': [],
+        'Expiration': {
+            'Days': EXPIRATION_DAYS,
+        },
+    }
+
+
+def lifecycle():
+    return {
+        'Rules': [expiration_rule()]
+    }
+
+
+# Each of the following reads the current configuration and returns what to
+# write to bring it in line, or None when the bucket already complies.
+
+def encryption_change(client, bucket_name):
+    current = read(client, 'get_bucket_encryption', 'ServerSideEncryptionConfigurationNotFoundError', Bucket=bucket_name)
+    rules = current['ServerSideEncryptionConfiguration']['Rules'] if current else []
+    # Any default encryption will do; a bucket using KMS is not downgraded
+    if any('ApplyServerSideEncryptionByDefault' in rule for rule in rules):
+        return None
+    return encryption()
+
+
+def versioning_change(client, bucket_name):
+    if client.get_bucket_versioning(Bucket=bucket_name).get('Status') == 'Enabled':
+        return None
+    # MFADelete is left as it is, as changing it requires the root user's MFA
+    return {'Status': 'Enabled'}
+
+
+def replication_change(client, bucket_name, role_arn, rule):
+    current = read(client, 'get_bucket_replication', 'ReplicationConfigurationNotFoundError', Bucket=bucket_name)
+    if not current:
+        return replication(role_arn, rule)
+
+    current = current['ReplicationConfiguration']
+    ours = [r for r in current['Rules'] if is_replication_rule(r, rule)]
+    if current['Role'] == role_arn and any(covers(r, rule) for r in ours):
+        return None
+
+    # A bucket has a single replication role, and S3 won't mix rules of the
+    # older schema, with a Prefix and no Filter or Priority, with ours. Rules
+    # of the bucket's own replicating elsewhere are kept, after which ours
+    # goes, unless either would break them; the bucket is then left alone.
+    others = [r for r in current['Rules'] if r not in ours]
+    if others and current['Role'] != role_arn:
+        raise ValueError(f"Replication of {bucket_name} conflicts with its {len(others)} rules using role {current['Role']}")
+    if any(is_v1(r) for r in others):
+        raise ValueError(f"Replication of {bucket_name} conflicts with its rules of the older schema, which can't be mixed with ours")
+    if current['Role'] != role_arn:
+        print(f"Replacing replication role {current['Role']} of {bucket_name} with {role_arn}")
+    priority = max((r.get('Priority', 0) for r in others), default=0) + 1
+    return {
+        'Role': role_arn,
+        'Rules': others + [dict(rule, Priority=priority)],
+    }
+
+
+def lifecycle_change(client, bucket_name, rule):
+    current = read(client, 'get_bucket_lifecycle_configuration', 'NoSuchLifecycleConfiguration', Bucket=bucket_name)
+    rules = current['Rules'] if current else []
+    # When expiration rules overlap S3 applies the earliest, so any rule which
+    # expires the whole bucket at least as soon as ours does is enough
+    days = rule['Expiration']['Days']
+    if any(expires_within(r, days) for r in rules):
+        return None
+    others = [r for r in rules if r.get('ID') != rule['ID']]
+    return {
+        'Rules': others + [rule]
+    }
+
+
+def read(client, operation, missing, **kwargs):
+    # Returns None where S3 reports an absent configuration as an error
+    try:
+        return getattr(client, operation)(**kwargs)
+    except client.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == missing:
+            return None
+        raise
+
+
+def is_replication_rule(existing, rule):
+    return existing.get('ID') == rule['ID'] or existing.get('Destination', {}).get('Bucket') == rule['Destination']['Bucket']
+
+
+def covers(existing, rule):
+    # Identity, priority and filter aside, everything our rule sets must be set
+    # the same way in the existing rule
+    expected = {k: v for k, v in rule.items() if k not in ('ID', 'Priority', 'Filter')}
+    return whole_bucket(existing) and contains(existing, expected)
+
+
+def is_v1(rule):
+    return 'Prefix' in rule or 'Filter' not in rule
+
+
+def expires_within(existing, days):
+    return (
+        existing.get('Status') == 'Enabled'
+        and whole_bucket(existing)
+        and existing.get('Expiration', {}).get('Days', days + 1) <= days
+    )
+
+
+def whole_bucket(rule):
+    # Older rules have a Prefix instead of a Filter
+    return rule.get('Filter', {'Prefix': rule.get('Prefix', '')}) in ({}, {'Prefix': ''})
+
+
+def contains(actual, expected):
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(contains(actual.get(k), v) for k, v in expected.items())
+    return actual == expected
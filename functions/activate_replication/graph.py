@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run(steps, requires, max_workers=None):
+    # Runs each step as soon as the steps it requires have succeeded, on a pool
+    # of threads, so that the whole takes about as long as its longest chain of
+    # requirements. Returns the results and the errors of the steps by name. A
+    # step whose requirements failed is not run, and gets an error of its own.
+    for name, needed in requires.items():
+        unknown = ({name} | set(needed)) - set(steps)
+        if unknown:
+            raise ValueError(f"Unknown steps in the requirements of {name}: {', '.join(sorted(unknown))}")
+
+    results = {}
+    errors = {}
+    waiting = dict(steps)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(steps) or 1) as executor:
+        while waiting or running:
+            for name in list(waiting):
+                needed = requires.get(name, ())
+                failed = [n for n in needed if n in errors]
+                if failed:
+                    del waiting[name]
+                    errors[name] = RuntimeError(f"not run as {', '.join(failed)} failed")
+                elif all(n in results for n in needed):
+                    running[executor.submit(waiting.pop(name))] = name
+
+            if not running:
+                # Only steps requiring each other are left
+                for name in waiting:
+                    errors[name] = RuntimeError("not run as its requirements are circular")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+    return results, errors
@@ -1,38 +1,87 @@
-import re
+import os
+import random
+
+from analyse_and_decrement.classifier import REGISTRY
+from common import metrics, verdicts
+from common.store import get_store
+
+# The polling schedule: a fast first probe, then exponential backoff with
+# jitter up to a cap, for as long as no new log files turn up
+POLL_INITIAL_SECONDS = int(os.environ.get('POLL_INITIAL_SECONDS', '60'))
+POLL_MULTIPLIER = float(os.environ.get('POLL_MULTIPLIER', '2'))
+POLL_MAX_SECONDS = int(os.environ.get('POLL_MAX_SECONDS', '900'))
+POLL_JITTER = float(os.environ.get('POLL_JITTER', '0.2'))
+
+RANDOM = random.Random()
+
+STORE = get_store()
 
 
 def lambda_handler(data, _context):
-    files = data['files']
-    verdict = 'undecided'
-
-    cloudfront_logs = 0
-    elb_logs = 0
-    other_files = 0
-
-    p_cf = re.compile('.+[A-Z0-9]{8,}\.\d{4}-\d{2}-\d{2}-\d{2}\.[A-Z0-9]{8,}\.gz$')
-    p_elb = re.compile('.*ELBAccessLogTestFile$|.*AWSLogs.+elasticloadbalancing.+\.log\.gz$')
-
-    for file in files:
-        if p_cf.match(file):
-            cloudfront_logs += 1
-        elif p_elb.match(file):
-            elb_logs += 1
-        else:
-            other_files += 1
-            
-    if cloudfront_logs > 0 and elb_logs > 0:
-        verdict = 'unusable'
-    elif cloudfront_logs == 0 and elb_logs == 0 and other_files > 5:
-        verdict = 'unusable'
-    elif cloudfront_logs > 0 and other_files < cloudfront_logs:
-        verdict = 'cloudfront'
-    elif elb_logs > 0 and other_files < elb_logs:
-        verdict = 'elb'
-
-    data['verdict'] = verdict
+    if 'buckets' in data:
+        return {'buckets': [remember(analyse_bucket(bucket)) for bucket in data['buckets']]}
+    return remember(analyse(data))
+
+
+def remember(data):
+    # Final verdicts go to the verdict store, except on buckets which couldn't
+    # be listed. It only saves work later, so failing to write is no failure.
+    if data['verdict'] in verdicts.FINAL and 'listing_error' not in data:
+        try:
+            verdicts.record(STORE, data)
+        except Exception as e:
+            print(f"Failed to record the verdict on {data['bucket_name']}: {e}")
+    return data
+
+
+def analyse_bucket(data):
+    # Batched monitoring. A bucket which couldn't be listed is given up on,
+    # just like the Catch on 'Get Latest Files' does for single executions.
+    if 'listing_error' in data:
+        data['verdict'] = 'unusable'
+        record_verdict(data)
+        return data
+    return analyse(data)
+
+
+def analyse(data):
+    summary = REGISTRY.summarise(get_files(data))
+    cloudfront_logs = summary['cloudfront_logs']
+    elb_logs = summary['elb_logs']
+
+    # Log files arriving without a verdict yet mean one is likely soon, so keep
+    # polling fast; otherwise back off
+    if cloudfront_logs + elb_logs > data.get('cloudfront_logs', 0) + data.get('elb_logs', 0):
+        data['quiet_polls'] = 0
+    else:
+        data['quiet_polls'] = data.get('quiet_polls', -1) + 1
+
+    data['verdict'] = summary['verdict']
     data['counter'] -= 1
     data['cloudfront_logs'] = cloudfront_logs
     data['elb_logs'] = elb_logs
-    data['other_files'] = other_files
+    data['other_files'] = summary['other_files']
+    data['format_counts'] = summary['format_counts']
+    data['wait_seconds'] = next_wait(data['quiet_polls'])
+    record_verdict(data)
     return data
 
+
+def record_verdict(data):
+    # One count per verdict reached, which gives their distribution
+    metrics.emit('Verdicts', 1, 'Count', data.get('account_id'), data.get('region'), {'Verdict': data['verdict']})
+
+
+def next_wait(quiet_polls):
+    wait = POLL_INITIAL_SECONDS * POLL_MULTIPLIER ** quiet_polls
+    wait *= 1 + RANDOM.uniform(-POLL_JITTER, POLL_JITTER)
+    return max(1, int(min(POLL_MAX_SECONDS, wait)))
+
+
+def get_files(data):
+    # Executions started before get_latest_files returned a listing object
+    # carry the bare list of keys in $.files
+    if 'listing' in data:
+        return data['listing']['files']
+    files = data['files']
+    return files['files'] if isinstance(files, dict) else files
@@ -0,0 +1,138 @@
+import re
+from itertools import compress
+from operator import attrgetter, methodcaller, not_
+from collections import Counter
+
+
+# The families of log formats which can be replicated to the Log Archive; all
+# other formats are recognised and counted, but treated as other files
+CLOUDFRONT = 'cloudfront'
+ELB = 'elb'
+
+# Common parts of the keys written by AWS services under AWSLogs/
+AWS_LOGS = r'.*AWSLogs/\d{12}/'
+DATE = r'\d{4}/\d{2}/\d{2}/'
+
+
+class LogFormatRegistry:
+    # A table of named log key formats. All patterns are merged into a single
+    # alternation of named groups, in registration order, so each key is
+    # matched in one pass and the group that matched names its format.
+    #
+    # A format may declare the literal suffixes all of its keys end with. Keys
+    # ending with none of the declared suffixes are then only matched against
+    # the formats which declared none, which is what makes classifying large
+    # listings of mostly other files cheap.
+
+    def __init__(self):
+        self._formats = {}
+        self._pattern = None
+        self._suffixes = ()
+        self._unsuffixed = None
+
+    def register(self, name, pattern, family=None, suffixes=None):
+        if re.compile(pattern).groups:
+            raise ValueError(f"The pattern for {name} must not contain capturing groups")
+        self._formats[name] = (pattern, family, tuple(suffixes) if suffixes else None)
+        self._pattern = self._merge(self._formats)
+        self._suffixes = tuple({s for _p, _f, sfx in self._formats.values() if sfx for s in sfx})
+        self._unsuffixed = self._merge({n: f for n, f in self._formats.items() if not f[2]})
+
+    @staticmethod
+    def _merge(formats):
+        if not formats:
+            return None
+        return re.compile('|'.join(f'(?P<{n}>{p})' for n, (p, _f, _s) in formats.items()))
+
+    @property
+    def names(self):
+        return list(self._formats)
+
+    def family(self, name):
+        return self._formats[name][1]
+
+    def classify(self, key):
+        match = self._pattern.fullmatch(key)
+        return match.lastgroup if match else None
+
+    def count(self, keys):
+        # Returns the number of keys of each format, and of unrecognised keys.
+        # Keys are split on their suffixes first and each part is matched in
+        # bulk; the loops all run in C, which matters for millions of keys.
+        keys = keys if isinstance(keys, list) else list(keys)
+        counts = dict.fromkeys(self._formats, 0)
+        if not self._formats:
+            return counts, len(keys)
+        lastgroup = attrgetter('lastgroup')
+        if self._suffixes:
+            suffixed = list(map(methodcaller('endswith', self._suffixes), keys))
+            parts = [(self._pattern, compress(keys, suffixed))]
+            if self._unsuffixed:
+                parts.append((self._unsuffixed, compress(keys, map(not_, suffixed))))
+        else:
+            parts = [(self._pattern, keys)]
+        matched = Counter()
+        for pattern, part in parts:
+            matched.update(map(lastgroup, filter(None, map(pattern.fullmatch, part))))
+        counts.update(matched)
+        return counts, len(keys) - sum(matched.values())
+
+    def summarise(self, keys):
+        # Per-format counts of the keys and the verdict they lead to
+        counts, other = self.count(keys)
+        families = self.family_counts(counts)
+        cloudfront_logs = families.get(CLOUDFRONT, 0)
+        elb_logs = families.get(ELB, 0)
+        other_files = sum(counts.values()) + other - cloudfront_logs - elb_logs
+        return {
+            'format_counts': counts,
+            'cloudfront_logs': cloudfront_logs,
+            'elb_logs': elb_logs,
+            'other_files': other_files,
+            'verdict': verdict(cloudfront_logs, elb_logs, other_files),
+        }
+
+    def family_counts(self, counts):
+        totals = {}
+        for name, count in counts.items():
+            family = self._formats[name][1]
+            totals[family] = totals.get(family, 0) + count
+        return totals
+
+
+def verdict(cloudfront_logs, elb_logs, other_files):
+    if cloudfront_logs > 0 and elb_logs > 0:
+        return 'unusable'
+    if cloudfront_logs == 0 and elb_logs == 0 and other_files > 5:
+        return 'unusable'
+    if cloudfront_logs > 0 and other_files < cloudfront_logs:
+        return 'cloudfront'
+    if elb_logs > 0 and other_files < elb_logs:
+        return 'elb'
+    return 'undecided'
+
+
+def default_registry():
+    # Each pattern starts with .* followed by a literal, which lets the regex
+    # engine skip ahead to that literal instead of backtracking through the
+    # key. Lookbehinds check what precedes the literal where needed. Suffixes
+    # must hold for every key a pattern matches.
+    registry = LogFormatRegistry()
+    # Standard logs: <prefix><distribution ID>.YYYY-MM-DD-HH.<unique ID>.gz
+    registry.register('cloudfront', r'.*\.(?<=.[A-Z0-9]{8}\.)\d{4}-\d{2}-\d{2}-\d{2}\.[A-Z0-9]{8,}\.gz', CLOUDFRONT, suffixes=['.gz'])
+    # Written by ELB when access logging is enabled, to check the bucket policy
+    registry.register('elb_test_file', r'.*ELBAccessLogTestFile', ELB, suffixes=['ELBAccessLogTestFile'])
+    registry.register('alb', AWS_LOGS + r'elasticloadbalancing/[^/]+/' + DATE + r'\d{12}_elasticloadbalancing_[^_/]+_app\.[^/]+\.log\.gz', ELB, suffixes=['.log.gz'])
+    registry.register('nlb', AWS_LOGS + r'elasticloadbalancing/[^/]+/' + DATE + r'\d{12}_elasticloadbalancing_[^_/]+_net\.[^/]+\.log\.gz', ELB, suffixes=['.log.gz'])
+    # Also catches any other ELB log the former ELB pattern matched
+    registry.register('classic_elb', r'.*AWSLogs.+elasticloadbalancing.+\.log(?:\.gz)?', ELB, suffixes=['.log', '.log.gz'])
+    registry.register('vpc_flow', AWS_LOGS + r'vpcflowlogs/[^/]+/' + DATE + r'[^/]+\.(?:log\.gz|parquet)', suffixes=['.log.gz', '.parquet'])
+    registry.register('cloudtrail', r'.*AWSLogs/(?:o-[a-z0-9]+/)?\d{12}/CloudTrail(?:-Digest|-Insight)?/[^/]+/' + DATE + r'[^/]+\.json\.gz', suffixes=['.json.gz'])
+    registry.register('waf', AWS_LOGS + r'WAFLogs/[^/]+/[^/]+/' + DATE + r'\d{2}/\d{2}/[^/]+\.log\.gz', suffixes=['.log.gz'])
+    # Server access logs: <prefix>YYYY-mm-DD-HH-MM-SS-<unique string>
+    registry.register('s3_access', r'.*-(?<=\d{4}-)\d{2}-\d{2}-\d{2}-\d{2}-\d{2}-[0-9A-F]{16}')
+    return registry
+
+
+# Built once per execution environment
+REGISTRY = default_registry()
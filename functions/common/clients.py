@@ -0,0 +1,59 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+
+# boto3 is imported with the handler, in the init phase which Lambda runs with
+# boosted CPU: every deployed function needs a client, if only for the state
+# table, so importing it later would only move the cost into the first call.
+# The clients of the function's own role are created once per service and
+# region and shared by all threads and invocations of the environment.
+MAX_POOL_CONNECTIONS = int(os.environ.get('MAX_POOL_CONNECTIONS', '50'))
+RETRY_MODE = os.environ.get('RETRY_MODE', 'adaptive')
+MAX_ATTEMPTS = int(os.environ.get('MAX_ATTEMPTS', '5'))
+
+_lock = threading.Lock()
+_session = None
+_config = None
+_clients = {}
+
+
+def config():
+    # Enough pooled connections for the thread pools of the batched paths, and
+    # adaptive retries which back off client-side when throttled
+    global _config
+    if _config is None:
+        _config = Config(
+            max_pool_connections=MAX_POOL_CONNECTIONS,
+            retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+        )
+    return _config
+
+
+def new_session(**kwargs):
+    return boto3.Session(**kwargs)
+
+
+def client(service, region=None):
+    key = (service, region)
+    built = _clients.get(key)
+    if built:
+        return built
+    global _session
+    # boto3 sessions aren't thread-safe, the clients they create are
+    with _lock:
+        if key not in _clients:
+            if _session is None:
+                _session = new_session()
+            _clients[key] = _session.client(service, region_name=region, config=config())
+        return _clients[key]
+
+
+def reset():
+    # Forgets all clients, e.g. after changing the environment in a local run
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from common import clients, metrics
+
+
+# Assumed-role sessions are reused until this close to their expiry
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class CredentialCache:
+    # Caches one boto3 session per (account, role, region) for as long as the
+    # Lambda execution environment lives, so that warm invocations don't call
+    # AssumeRole at all. Clients and resources are built from, and cached on,
+    # that one session. Safe for use from several threads: a miss only blocks
+    # callers wanting the same key.
+
+    def __init__(self, sts_client=None, session_factory=None, refresh_margin=REFRESH_MARGIN, clock=None):
+        self._sts_client = sts_client
+        self._session_factory = session_factory or clients.new_session
+        self._refresh_margin = refresh_margin
+        self._clock = clock or (lambda: datetime.now(timezone.utc))
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def session(self, account_id, role, region, session_name=None):
+        return self._entry(account_id, role, region, session_name)['session']
+
+    def client(self, client_type, account_id, role, region, session_name=None):
+        return self._built('client', client_type, account_id, role, region, session_name)
+
+    def resource(self, client_type, account_id, role, region, session_name=None):
+        return self._built('resource', client_type, account_id, role, region, session_name)
+
+    def invalidate(self, account_id=None, role=None, region=None):
+        with self._lock:
+            for key in list(self._entries):
+                if all(wanted is None or wanted == actual for wanted, actual in zip((account_id, role, region), key)):
+                    del self._entries[key]
+
+    def _built(self, kind, client_type, account_id, role, region, session_name):
+        entry = self._entry(account_id, role, region, session_name)
+        # boto3 sessions aren't thread-safe, the clients they create are
+        with entry['lock']:
+            built = entry[kind]
+            if client_type not in built:
+                factory = entry['session'].client if kind == 'client' else entry['session'].resource
+                built[client_type] = factory(client_type, config=clients.config())
+            return built[client_type]
+
+    def _entry(self, account_id, role, region, session_name):
+        key = (account_id, role, region)
+        entry = self._fresh(key)
+        if entry:
+            return entry
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another thread may have refreshed the entry while we waited
+            entry = self._fresh(key)
+            if entry:
+                return entry
+            entry = self._assume(account_id, role, region, session_name)
+            with self._lock:
+                self._entries[key] = entry
+                self.misses += 1
+            return entry
+
+    def _fresh(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expiration'] - self._refresh_margin > self._clock():
+                self.hits += 1
+                return entry
+        return None
+
+    def _assume(self, account_id, role, region, session_name):
+        if self._sts_client is None:
+            self._sts_client = clients.client('sts')
+        with metrics.timed('AssumeRoleLatency', account_id, region):
+            response = self._sts_client.assume_role(
+                RoleArn=f"arn:aws:iam::{account_id}:role/{role}",
+                RoleSessionName=session_name or f"soar_detect_log_buckets_{account_id}"
+            )
+        credentials = response['Credentials']
+        session = self._session_factory(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'],
+            region_name=region
+        )
+        return {
+            'session': session,
+            'expiration': credentials['Expiration'],
+            'client': {},
+            'resource': {},
+            'lock': threading.Lock(),
+        }
+
+
+# Module scope, so it survives between invocations of the same environment
+CACHE = CredentialCache()
+
+
+def get_client(client_type, account_id, region, role, session_name=None):
+    return CACHE.client(client_type, account_id, role, region, session_name)
+
+
+def get_resource(client_type, account_id, region, role, session_name=None):
+    return CACHE.resource(client_type, account_id, role, region, session_name)
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Metrics are written to the log in CloudWatch Embedded Metric Format, which
+# CloudWatch turns into metrics without any API calls. Each metric is recorded
+# per function, and also per account and region when those are known.
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SOAR-detect-log-buckets')
+FUNCTION = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+
+class StdoutSink:
+
+    def write(self, document):
+        print(json.dumps(document))
+
+
+class MemorySink:
+    # Keeps the documents instead, for running the functions locally
+
+    def __init__(self):
+        self.documents = []
+        self._lock = threading.Lock()
+
+    def write(self, document):
+        with self._lock:
+            self.documents.append(document)
+
+    def values(self, name):
+        with self._lock:
+            return [document[name] for document in self.documents if name in document]
+
+
+class NullSink:
+    # Drops the documents, for long local runs which don't want them
+
+    def write(self, document):
+        pass
+
+
+SINK = StdoutSink()
+
+
+def emit(name, value, unit='Count', account_id=None, region=None, dimensions=None):
+    dimensions = {'Function': FUNCTION, **(dimensions or {})}
+    if account_id:
+        dimensions['Account'] = account_id
+    if region:
+        dimensions['Region'] = region
+    keys = list(dimensions)
+    # Without the account and region too, so that the metric can be seen for
+    # the whole fleet
+    dimension_sets = [keys]
+    overall = [key for key in keys if key not in ('Account', 'Region')]
+    if overall != keys:
+        dimension_sets.append(overall)
+    SINK.write({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': dimension_sets,
+                'Metrics': [{'Name': name, 'Unit': unit}],
+            }],
+        },
+        **dimensions,
+        name: value,
+    })
+
+
+@contextmanager
+def timed(name, account_id=None, region=None, dimensions=None):
+    # Records how long the block took in milliseconds, whether it raised or not
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit(name, (time.perf_counter() - started) * 1000, 'Milliseconds', account_id, region, dimensions)
+
+
+@contextmanager
+def routed(sink):
+    # Routes the metrics emitted within the block to the given sink
+    global SINK
+    previous, SINK = SINK, sink
+    try:
+        yield sink
+    finally:
+        SINK = previous
+
+
+def capture():
+    return routed(MemorySink())
+
+
+def disabled():
+    return routed(NullSink())
@@ -0,0 +1,90 @@
+import os
+import json
+import uuid
+from datetime import datetime, timezone
+
+from common import clients, metrics
+from common.pending import register
+from common.store import bucket_id, INFLIGHT
+
+
+# Starts the monitoring of a bucket, for lifecycle_event on a new bucket and
+# for object_created when a probe hands a bucket over
+STATE_MACHINE_ARN = os.environ.get('STATE_MACHINE_ARN')
+
+# Outlives the longest possible monitoring execution
+INFLIGHT_TTL = 3 * 24 * 60 * 60
+# A claim this young may belong to an execution which is still being started
+CLAIM_GRACE_SECONDS = 60
+
+
+def monitor(store, mode, region, account_id, bucket_name):
+    # Polls the bucket until a verdict is reached, the way the monitoring mode says
+    if mode == 'batched':
+        if register(store, region, account_id, bucket_name):
+            print("Bucket registered for batched monitoring.")
+        else:
+            print(f"Bucket {bucket_name} in account {account_id}, region {region} is already pending. Skipping.")
+        return
+
+    start_monitoring(store, region, account_id, bucket_name)
+
+
+def start_monitoring(store, region, account_id, bucket_name, verdict=None):
+    execution_name = f"{uuid.uuid4()}-{region}-{account_id}-{bucket_name}"[:80]
+    execution_arn = f"{STATE_MACHINE_ARN.replace(':stateMachine:', ':execution:')}:{execution_name}"
+    key = bucket_id(account_id, region, bucket_name)
+
+    if not claim_bucket(store, key, execution_arn):
+        print(f"An active execution for bucket {bucket_name} in account {account_id}, region {region} already exists. Skipping.")
+        return
+
+    print("No content monitoring job running. Starting Step Function...")
+    execution_input = {
+        "region": region,
+        "account_id": account_id,
+        "bucket_name": bucket_name
+    }
+    # With a verdict, the state machine goes straight to replication
+    if verdict:
+        execution_input["verdict"] = verdict
+    try:
+        with metrics.timed('StartExecutionLatency', account_id, region):
+            clients.client('stepfunctions').start_execution(
+                stateMachineArn=STATE_MACHINE_ARN,
+                name=execution_name,
+                input=json.dumps(execution_input)
+            )
+    except Exception:
+        store.delete(INFLIGHT, key)
+        raise
+
+
+def claim_bucket(store, key, execution_arn):
+    # The in-flight index maps each (account, region, bucket) to the execution
+    # monitoring it, so a duplicate is detected with a single conditional
+    # write. A stale entry, left by an execution which has since finished, is
+    # taken over provided nobody else got to it first.
+    claim = {
+        'execution_arn': execution_arn,
+        'started_at': datetime.now(timezone.utc).isoformat(),
+    }
+    if store.put_if_absent(INFLIGHT, key, claim, ttl=INFLIGHT_TTL):
+        return True
+
+    current = store.get(INFLIGHT, key)
+    if current is None:
+        return store.put_if_absent(INFLIGHT, key, claim, ttl=INFLIGHT_TTL)
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(current['started_at'])
+    if age.total_seconds() < CLAIM_GRACE_SECONDS or is_running(current['execution_arn']):
+        return False
+    return store.replace(INFLIGHT, key, claim, expected=current, ttl=INFLIGHT_TTL)
+
+
+def is_running(execution_arn):
+    client = clients.client('stepfunctions')
+    try:
+        with metrics.timed('DescribeExecutionLatency'):
+            return client.describe_execution(executionArn=execution_arn)['status'] == 'RUNNING'
+    except client.exceptions.ExecutionDoesNotExist:
+        return False
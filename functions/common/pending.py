@@ -0,0 +1,22 @@
+from common.store import bucket_id, PENDING
+
+
+# Buckets awaiting batched monitoring, registered by lifecycle_event and
+# object_created and polled by pending_buckets
+
+# The same horizon as the Setup Counter of MonitorBucketForLogs
+INITIAL_COUNTER = 200
+PENDING_TTL = 3 * 24 * 60 * 60
+
+
+def register(store, region, account_id, bucket_name):
+    # Called instead of starting an execution in batched monitoring mode.
+    # Returns False if the bucket already is pending.
+    return store.put_if_absent(PENDING, bucket_id(account_id, region, bucket_name), {
+        'region': region,
+        'account_id': account_id,
+        'bucket_name': bucket_name,
+        'counter': INITIAL_COUNTER,
+        'listing': {},
+        'replication_attempts': 0,
+    }, ttl=PENDING_TTL)
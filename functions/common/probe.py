@@ -0,0 +1,81 @@
+import json
+import hashlib
+
+
+# Event-driven detection. Instead of polling a new bucket, S3 is asked to send
+# its object events to EventBridge for a while. The bucket's existing
+# notification configuration is kept, and restored when the probe is removed.
+# A rule in the bucket's account forwards the events of that bucket only to
+# the organisation's event bus, so that no other bucket sending its events to
+# EventBridge costs us anything.
+
+# The role the organisation's lifecycle rules use to put events on its bus
+FORWARDING_ROLE_NAME = 'EventBridgeInvokeEventBusRole'
+TARGET_ID = 'ProbeToOrgAccount'
+
+
+def attach_probe(s3_client, events_client, bucket_name, account_id, event_bus_arn):
+    # Returns whether EventBridge notifications were already enabled, in which
+    # case they must be left on when the probe is removed
+    forward_events(events_client, bucket_name, account_id, event_bus_arn)
+    configuration = notification_configuration(s3_client, bucket_name)
+    if 'EventBridgeConfiguration' in configuration:
+        return True
+    configuration['EventBridgeConfiguration'] = {}
+    s3_client.put_bucket_notification_configuration(
+        Bucket=bucket_name,
+        NotificationConfiguration=configuration
+    )
+    return False
+
+
+def detach_probe(s3_client, events_client, bucket_name, had_eventbridge):
+    if not had_eventbridge:
+        configuration = notification_configuration(s3_client, bucket_name)
+        if 'EventBridgeConfiguration' in configuration:
+            del configuration['EventBridgeConfiguration']
+            s3_client.put_bucket_notification_configuration(
+                Bucket=bucket_name,
+                NotificationConfiguration=configuration
+            )
+    stop_forwarding(events_client, bucket_name)
+
+
+def forward_events(events_client, bucket_name, account_id, event_bus_arn):
+    name = rule_name(bucket_name)
+    events_client.put_rule(
+        Name=name,
+        Description=f"Forwards the object events of {bucket_name} while it is probed for log files",
+        EventPattern=json.dumps({
+            'source': ['aws.s3'],
+            'detail-type': ['Object Created'],
+            'detail': {'bucket': {'name': [bucket_name]}},
+        }),
+        State='ENABLED'
+    )
+    events_client.put_targets(Rule=name, Targets=[{
+        'Id': TARGET_ID,
+        'Arn': event_bus_arn,
+        'RoleArn': f"arn:aws:iam::{account_id}:role/{FORWARDING_ROLE_NAME}",
+    }])
+
+
+def stop_forwarding(events_client, bucket_name):
+    # Also called for buckets which may never have had a rule
+    name = rule_name(bucket_name)
+    try:
+        events_client.remove_targets(Rule=name, Ids=[TARGET_ID])
+        events_client.delete_rule(Name=name)
+    except events_client.exceptions.ResourceNotFoundException:
+        pass
+
+
+def rule_name(bucket_name):
+    # Bucket names may be longer than a rule name allows
+    return f"soar-log-bucket-probe-{hashlib.sha256(bucket_name.encode()).hexdigest()[:24]}"
+
+
+def notification_configuration(s3_client, bucket_name):
+    configuration = s3_client.get_bucket_notification_configuration(Bucket=bucket_name)
+    configuration.pop('ResponseMetadata', None)
+    return configuration
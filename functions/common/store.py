@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from common import clients, metrics
+
+
+# Kinds of items kept in the state table
+INFLIGHT = 'inflight'
+PENDING = 'pending'
+PROBE = 'probe'
+VERDICT = 'verdict'
+
+
+def bucket_id(account_id, region, bucket_name):
+    # Bucket names are only unique per partition, so the account and region
+    # are part of the identity
+    return f"{account_id}#{region}#{bucket_name}"
+
+
+class DynamoDBStore:
+    # Items are JSON documents keyed on (kind, id) with an optional expiry in
+    # epoch seconds. DynamoDB deletes expired items lazily, so reads and
+    # conditional writes treat them as absent themselves.
+
+    def __init__(self, table_name, client=None, clock=time.time):
+        self._table_name = table_name
+        self._client = client
+        self._clock = clock
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = clients.client('dynamodb')
+        return self._client
+
+    def get(self, kind, id):
+        with self._timed('GetItem'):
+            response = self.client.get_item(
+                TableName=self._table_name,
+                Key=self._key(kind, id),
+                ConsistentRead=True
+            )
+        item = response.get('Item')
+        if not item or self._expired(item):
+            return None
+        return json.loads(item['data']['S'])
+
+    def put(self, kind, id, data, ttl=None):
+        with self._timed('PutItem'):
+            self.client.put_item(TableName=self._table_name, Item=self._item(kind, id, data, ttl))
+
+    def put_if_absent(self, kind, id, data, ttl=None):
+        return self._conditional_put(
+            kind, id, data, ttl,
+            'attribute_not_exists(#kind) OR expires_at < :now',
+            {'#kind': 'kind'},
+            {':now': {'N': str(int(self._clock()))}}
+        )
+
+    def replace(self, kind, id, data, expected, ttl=None):
+        # Only overwrites the item if it still holds what the caller last read
+        return self._conditional_put(
+            kind, id, data, ttl,
+            '#data = :expected',
+            {'#data': 'data'},
+            {':expected': {'S': json.dumps(expected, sort_keys=True)}}
+        )
+
+    def delete(self, kind, id):
+        with self._timed('DeleteItem'):
+            self.client.delete_item(TableName=self._table_name, Key=self._key(kind, id))
+
+    def items(self, kind):
+        paginator = self.client.get_paginator('query')
+        pages = paginator.paginate(
+            TableName=self._table_name,
+            KeyConditionExpression='#kind = :kind',
+            ExpressionAttributeNames={'#kind': 'kind'},
+            ExpressionAttributeValues={':kind': {'S': kind}}
+        )
+        for page in pages:
+            for item in page['Items']:
+                if not self._expired(item):
+                    yield item['id']['S'], json.loads(item['data']['S'])
+
+    def _conditional_put(self, kind, id, data, ttl, condition, names, values):
+        try:
+            with self._timed('ConditionalPutItem'):
+                self.client.put_item(
+                    TableName=self._table_name,
+                    Item=self._item(kind, id, data, ttl),
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values
+                )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def _timed(self, operation):
+        return metrics.timed('StateStoreLatency', dimensions={'Operation': operation})
+
+    def _key(self, kind, id):
+        return {'kind': {'S': kind}, 'id': {'S': id}}
+
+    def _item(self, kind, id, data, ttl):
+        item = self._key(kind, id)
+        item['data'] = {'S': json.dumps(data, sort_keys=True)}
+        if ttl is not None:
+            item['expires_at'] = {'N': str(int(self._clock() + ttl))}
+        return item
+
+    def _expired(self, item):
+        return 'expires_at' in item and int(item['expires_at']['N']) < self._clock()
+
+
+class SQLiteStore:
+    # Local stand-in for DynamoDBStore with the same interface and semantics,
+    # for running the functions outside AWS. Defaults to an in-memory database.
+
+    def __init__(self, path=':memory:', clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'kind TEXT, id TEXT, data TEXT, expires_at INTEGER, PRIMARY KEY (kind, id))'
+        )
+
+    def get(self, kind, id):
+        with self._lock:
+            row = self._live_row(kind, id)
+        return json.loads(row[0]) if row else None
+
+    def put(self, kind, id, data, ttl=None):
+        with self._lock:
+            self._write(kind, id, data, ttl)
+
+    def put_if_absent(self, kind, id, data, ttl=None):
+        with self._lock:
+            if self._live_row(kind, id):
+                return False
+            self._write(kind, id, data, ttl)
+            return True
+
+    def replace(self, kind, id, data, expected, ttl=None):
+        with self._lock:
+            row = self._live_row(kind, id)
+            if not row or row[0] != json.dumps(expected, sort_keys=True):
+                return False
+            self._write(kind, id, data, ttl)
+            return True
+
+    def delete(self, kind, id):
+        with self._lock:
+            self._db.execute('DELETE FROM items WHERE kind = ? AND id = ?', (kind, id))
+
+    def items(self, kind):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, data FROM items WHERE kind = ? AND (expires_at IS NULL OR expires_at >= ?) ORDER BY id',
+                (kind, int(self._clock()))
+            ).fetchall()
+        for id, data in rows:
+            yield id, json.loads(data)
+
+    def _live_row(self, kind, id):
+        return self._db.execute(
+            'SELECT data FROM items WHERE kind = ? AND id = ? AND (expires_at IS NULL OR expires_at >= ?)',
+            (kind, id, int(self._clock()))
+        ).fetchone()
+
+    def _write(self, kind, id, data, ttl):
+        expires_at = int(self._clock() + ttl) if ttl is not None else None
+        self._db.execute(
+            'INSERT OR REPLACE INTO items (kind, id, data, expires_at) VALUES (?, ?, ?, ?)',
+            (kind, id, json.dumps(data, sort_keys=True), expires_at)
+        )
+
+
+def get_store():
+    # The deployed functions get STATE_TABLE_NAME from the template; anywhere
+    # else the local stand-in is used, optionally persisted to a file.
+    table_name = os.environ.get('STATE_TABLE_NAME')
+    if table_name:
+        return DynamoDBStore(table_name)
+    return SQLiteStore(os.environ.get('LOCAL_STATE_PATH', ':memory:'))
@@ -0,0 +1,56 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+
+from common.store import VERDICT, bucket_id
+
+
+# Decisions on buckets, kept in the state table so that a bucket is neither
+# analysed nor configured again once decided: not on a replayed CloudTrail
+# event, nor on a backfill. Each record holds the verdict, the counts it was
+# reached on, when, and a hash of the replication configuration written for it.
+# Records expire after VERDICT_TTL_DAYS, after which a bucket is seen afresh.
+VERDICT_TTL_DAYS = int(os.environ.get('VERDICT_TTL_DAYS', '30'))
+VERDICT_TTL = VERDICT_TTL_DAYS * 24 * 60 * 60
+
+# The verdicts which end the monitoring of a bucket, and those of log buckets
+FINAL = ('cloudfront', 'elb', 'unusable')
+LOGS = ('cloudfront', 'elb')
+COUNTS = ('cloudfront_logs', 'elb_logs', 'other_files', 'format_counts')
+
+
+def lookup(store, account_id, region, bucket_name):
+    return store.get(VERDICT, bucket_id(account_id, region, bucket_name))
+
+
+def record(store, data):
+    # Records the verdict in data, a bucket as the functions pass it. The
+    # configuration hash of an earlier record is kept if the verdict is the same.
+    id = bucket_id(data['account_id'], data['region'], data['bucket_name'])
+    current = store.get(VERDICT, id) or {}
+    decision = {
+        'verdict': data['verdict'],
+        'counts': {name: data[name] for name in COUNTS if name in data},
+        'decided_at': datetime.now(timezone.utc).isoformat(),
+        'configuration_hash': current.get('configuration_hash') if current.get('verdict') == data['verdict'] else None,
+    }
+    store.put(VERDICT, id, decision, ttl=VERDICT_TTL)
+    return decision
+
+
+def record_configuration(store, account_id, region, bucket_name, verdict, configuration_hash):
+    # Called once the bucket has been configured for replication
+    id = bucket_id(account_id, region, bucket_name)
+    decision = store.get(VERDICT, id) or {
+        'verdict': verdict,
+        'counts': {},
+        'decided_at': datetime.now(timezone.utc).isoformat(),
+    }
+    decision.update(verdict=verdict, configuration_hash=configuration_hash)
+    store.put(VERDICT, id, decision, ttl=VERDICT_TTL)
+    return decision
+
+
+def configuration_hash(configuration):
+    return hashlib.sha256(json.dumps(configuration, sort_keys=True).encode()).hexdigest()
@@ -1,15 +1,61 @@
 import os
 import json
-import datetime
 from datetime import datetime, timezone
 import uuid
-import boto3
+from common import credentials
+from create_incident.findings import FindingBuffer, RecentIds
 
 CROSS_ACCOUNT_ROLE = os.environ['CROSS_ACCOUNT_ROLE']
+# Findings imported this recently by the same execution environment are not
+# imported again
+RECENT_FINDINGS_SECONDS = int(os.environ.get('RECENT_FINDINGS_SECONDS', '3600'))
+
+# Finding IDs are derived from what the finding is about, so that importing the
+# same finding again updates it in Security Hub instead of duplicating it
+FINDING_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/OpenSecOps-Org/SOAR-detect-log-buckets')
+
+RECENT = RecentIds(window=RECENT_FINDINGS_SECONDS)
 
-sts_client = boto3.client('sts')
 
 def lambda_handler(data, _context):
+    if 'buckets' in data:
+        return {'buckets': create_incidents(data['buckets'])}
+
+    finding = build_finding(data)
+    buffer = FindingBuffer(get_securityhub_client, recent=RECENT)
+    if not buffer.add(data['account_id'], data['region'], finding):
+        print(f"Finding {finding['Id']} was imported recently, skipping.")
+        return reply(200, body={"finding": finding})
+    error = buffer.flush()[finding['Id']]
+    if isinstance(error, Exception):
+        raise error
+    if error:
+        print(f"Failed to import the ASFF finding: {error}")
+        return reply(400, message="Failed to import the ASFF finding.")
+
+    return reply(200, body={"finding": finding})
+
+
+def create_incidents(buckets):
+    # Batches of buckets, typically a new account with many load balancers.
+    # Findings are imported per account and region, many to a call.
+    buffer = FindingBuffer(get_securityhub_client, recent=RECENT)
+    findings = []
+    for bucket in buckets:
+        finding = build_finding(bucket)
+        buffer.add(bucket['account_id'], bucket['region'], finding)
+        findings.append(finding)
+    results = buffer.flush()
+    print(f"Imported findings for {len(buckets)} buckets in {buffer.calls} calls, {buffer.skipped} skipped as recent.")
+
+    for bucket, finding in zip(buckets, findings):
+        bucket['finding_id'] = finding['Id']
+        if results[finding['Id']]:
+            bucket['incident_error'] = str(results[finding['Id']])
+    return buckets
+
+
+def build_finding(data):
     region = data['region']
     account_id = data['account_id']
     bucket_name = data['bucket_name']
@@ -35,7 +81,7 @@ needed.
 '''
 
     timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
-    finding_id = str(uuid.uuid4())
+    finding_id = finding_id_for(account_id, region, bucket_name, verdict)
     finding_arn = f"arn:aws:securityhub:{region}:{account_id}:product/{account_id}/default/{finding_id}"
 
     remediation_text = 'You may want to change the local log file retention time from 14 days to some other value.'
@@ -85,18 +131,11 @@ needed.
     }
 
     print(f"Creating {severity} incident for {incident_domain} incident '{title}'")
+    return finding
 
-    client = get_client('securityhub', account_id, region)
-    response = client.batch_import_findings(Findings=[finding])
-    print(response)
 
-    http_status = response['ResponseMetadata']['HTTPStatusCode']
-    if http_status != 200:
-        return reply(http_status, message="Failed to import the ASFF finding.")
-    if response['FailedCount'] != 0:
-        return reply(400, message="Failed to import the ASFF finding.")
-
-    return reply(200, body={"finding": finding})
+def finding_id_for(account_id, region, bucket_name, verdict):
+    return str(uuid.uuid5(FINDING_NAMESPACE, f"{account_id}/{region}/{bucket_name}/{verdict}"))
 
 
 def reply(status_code, body={}, message=None):
@@ -109,18 +148,9 @@ def reply(status_code, body={}, message=None):
     }
 
 
+def get_securityhub_client(account_id, region):
+    return get_client('securityhub', account_id, region)
+
+
 def get_client(client_type, account_id, region, role=CROSS_ACCOUNT_ROLE):
-    other_session = sts_client.assume_role(
-        RoleArn=f"arn:aws:iam::{account_id}:role/{role}",
-        RoleSessionName=f"cross_acct_lambda_session_{account_id}"
-    )
-    access_key = other_session['Credentials']['AccessKeyId']
-    secret_key = other_session['Credentials']['SecretAccessKey']
-    session_token = other_session['Credentials']['SessionToken']
-    return boto3.client(
-        client_type,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        aws_session_token=session_token,
-        region_name=region
-    )
+    return credentials.get_client(client_type, account_id, region, role, session_name=f"cross_acct_lambda_session_{account_id}")
@@ -0,0 +1,164 @@
+import time
+import threading
+from collections import OrderedDict
+
+from common import metrics
+
+
+# BatchImportFindings takes at most this many findings per call
+MAX_BATCH = 100
+# The IDs looked up per GetFindings call, as a filter takes a limited number of
+# values
+LOOKUP_BATCH = 20
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 0.5
+
+
+class RecentIds:
+    # The IDs of findings imported by this execution environment, with when
+    # they were imported and their CreatedAt, bounded in number, least recently
+    # imported first. A finding counts as recent for window seconds; its
+    # CreatedAt is remembered for as long as it is kept.
+
+    def __init__(self, window=3600, max_size=10000, clock=time.monotonic):
+        self._window = window
+        self._max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+
+    def __contains__(self, finding_id):
+        with self._lock:
+            imported_at, _created_at = self._ids.get(finding_id, (None, None))
+            return imported_at is not None and self._clock() - imported_at < self._window
+
+    def created_at(self, finding_id):
+        with self._lock:
+            return self._ids.get(finding_id, (None, None))[1]
+
+    def add(self, finding_id, created_at=None):
+        with self._lock:
+            _imported_at, known = self._ids.pop(finding_id, (None, None))
+            self._ids[finding_id] = (self._clock(), known or created_at)
+            while len(self._ids) > self._max_size:
+                self._ids.popitem(last=False)
+
+
+class FindingBuffer:
+    # Collects findings per account and region, the scope of a Security Hub
+    # client, and imports each group in batches. A group is flushed when it
+    # holds a full batch or its oldest finding has waited max_age seconds;
+    # whatever is left is imported by flush(). Only the findings Security Hub
+    # reports as failed are retried. The outcome of every finding is kept in
+    # results by finding ID: None when imported, the error message when Security
+    # Hub rejected it, and the exception when the call itself failed. Findings
+    # in recent, if given, are skipped, and those imported are added to it.
+    #
+    # A finding which already exists in Security Hub keeps its CreatedAt, and
+    # is updated without Workflow, so that the workflow state the analysts set
+    # is left alone. Whether it exists is known from recent, or else looked up
+    # with GetFindings before the import.
+
+    def __init__(self, client_factory, max_age=5.0, recent=None, clock=time.monotonic, sleep=time.sleep):
+        self._client_factory = client_factory
+        self._recent = recent
+        self._max_age = max_age
+        self._clock = clock
+        self._sleep = sleep
+        self._groups = {}
+        self.results = {}
+        self.calls = 0
+        self.skipped = 0
+
+    def add(self, account_id, region, finding):
+        # Returns False for findings imported recently enough to be skipped
+        if self._recent is not None and finding['Id'] in self._recent:
+            self.results[finding['Id']] = None
+            self.skipped += 1
+            return False
+        group = self._groups.setdefault((account_id, region), {'since': self._clock(), 'findings': []})
+        group['findings'].append(finding)
+        if len(group['findings']) >= MAX_BATCH:
+            self._flush((account_id, region))
+        self.flush_due()
+        return True
+
+    def flush_due(self):
+        now = self._clock()
+        for key in [key for key, group in self._groups.items() if now - group['since'] >= self._max_age]:
+            self._flush(key)
+
+    def flush(self):
+        for key in list(self._groups):
+            self._flush(key)
+        return self.results
+
+    def _flush(self, key):
+        findings = self._groups.pop(key)['findings']
+        try:
+            client = self._client_factory(*key)
+        except Exception as e:
+            print(f"Failed to get a Security Hub client for account {key[0]}, region {key[1]}: {e}")
+            self.results.update((finding['Id'], e) for finding in findings)
+            return
+        try:
+            self._carry_over(client, findings, *key)
+        except Exception as e:
+            # Importing them as new could reset their workflow state
+            print(f"Failed to look up existing findings in account {key[0]}, region {key[1]}: {e}")
+            self.results.update((finding['Id'], e) for finding in findings)
+            return
+        for start in range(0, len(findings), MAX_BATCH):
+            self.results.update(self._import(client, findings[start:start + MAX_BATCH], *key))
+
+    def _carry_over(self, client, findings, account_id, region):
+        existing = {}
+        unknown = []
+        for finding in findings:
+            created_at = self._recent.created_at(finding['Id']) if self._recent is not None else None
+            if created_at:
+                existing[finding['Id']] = created_at
+            else:
+                unknown.append(finding['Id'])
+        for start in range(0, len(unknown), LOOKUP_BATCH):
+            ids = unknown[start:start + LOOKUP_BATCH]
+            with metrics.timed('GetFindingsLatency', account_id, region):
+                pages = client.get_paginator('get_findings').paginate(
+                    Filters={'Id': [{'Value': id, 'Comparison': 'EQUALS'} for id in ids]}
+                )
+                for page in pages:
+                    existing.update((found['Id'], found['CreatedAt']) for found in page['Findings'])
+        for finding in findings:
+            if finding['Id'] in existing:
+                finding['CreatedAt'] = existing[finding['Id']]
+                finding.pop('Workflow', None)
+
+    def _import(self, client, findings, account_id, region):
+        results = {}
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                self._sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            self.calls += 1
+            try:
+                with metrics.timed('ImportFindingsLatency', account_id, region):
+                    response = client.batch_import_findings(Findings=findings)
+            except Exception as e:
+                # The whole call failed; retry it as a whole
+                print(f"Failed to import {len(findings)} findings: {e}")
+                results.update((finding['Id'], e) for finding in findings)
+                continue
+
+            failed = {f['Id']: f"{f.get('ErrorCode')}: {f.get('ErrorMessage')}" for f in response.get('FailedFindings', [])}
+            print(f"Imported {len(findings) - len(failed)} of {len(findings)} findings.")
+            metrics.emit('FindingsImported', len(findings) - len(failed), 'Count', account_id, region)
+            if failed:
+                metrics.emit('FindingsFailed', len(failed), 'Count', account_id, region)
+            results.update((finding['Id'], failed.get(finding['Id'])) for finding in findings)
+            if self._recent is not None:
+                for finding in findings:
+                    if finding['Id'] not in failed:
+                        self._recent.add(finding['Id'], finding['CreatedAt'])
+            findings = [finding for finding in findings if finding['Id'] in failed]
+            if not findings:
+                break
+        return results
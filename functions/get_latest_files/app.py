@@ -1,61 +1,99 @@
 import os
-import boto3
+from concurrent.futures import ThreadPoolExecutor
 
-CROSS_ACCOUNT_ROLE = os.environ['CROSS_ACCOUNT_ROLE']
+from common import credentials, metrics
+from get_latest_files.listing import list_pages, select_latest, next_cursor, window_entries
 
-sts_client = boto3.client('sts')
+CROSS_ACCOUNT_ROLE = os.environ['CROSS_ACCOUNT_ROLE']
+LATEST_FILES_COUNT = int(os.environ.get('LATEST_FILES_COUNT', '10'))
+LISTING_MODE = os.environ.get('LISTING_MODE', 'latest')
+SAMPLE_KEYS = int(os.environ.get('SAMPLE_KEYS', '10'))
+SAMPLE_PAGES = int(os.environ.get('SAMPLE_PAGES', '2'))
+SAMPLE_SECONDS = float(os.environ.get('SAMPLE_SECONDS', '20'))
+RESCAN_EVERY = int(os.environ.get('RESCAN_EVERY', '8'))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
 
 
 def lambda_handler(data, _context):
+    if 'buckets' in data:
+        return {'buckets': list_buckets(data['buckets'])}
+    return list_bucket(data)
+
+
+def list_buckets(buckets):
+    # Batched monitoring. Failing to list one bucket, typically because it has
+    # been deleted, must not hold up the rest of the batch.
+    def list_one(bucket):
+        try:
+            bucket['listing'] = list_bucket(bucket)
+        except Exception as e:
+            print(f"Failed to list {bucket['bucket_name']}: {e}")
+            bucket['listing_error'] = str(e)
+        return bucket
+
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        return list(executor.map(list_one, buckets))
+
+
+def list_bucket(data):
     region = data['region']
     account_id = data['account_id']
     bucket_name = data['bucket_name']
+    max_files = data.get('max_files', LATEST_FILES_COUNT)
+    mode = data.get('mode', LISTING_MODE)
 
     print(f"Checking existence of {bucket_name} in account {account_id} of region {region}...")
     s3_client = get_client('s3', account_id, region)
-    s3_client.head_bucket(Bucket=bucket_name)
+    with metrics.timed('HeadBucketLatency', account_id, region):
+        s3_client.head_bucket(Bucket=bucket_name)
     print("Bucket exists.")
 
-    print(f"Getting files...")
-    s3_resource = get_resource('s3', account_id, region)
-    objects = list(s3_resource.Bucket(bucket_name).objects.filter(Prefix=''))
-    objects.sort(key=lambda o: o.last_modified)
+    # Continue from where the previous iteration stopped, unless it's time for
+    # a full rescan to pick up keys sorting before the cursor
+    cursor = data.get('listing', {}).get('cursor')
+    rescan = not cursor or (RESCAN_EVERY > 0 and cursor['since_rescan'] + 1 >= RESCAN_EVERY)
+    if rescan:
+        list_args = {}
+        seed = []
+    else:
+        print(f"Listing from cursor {cursor['start_after']}...")
+        list_args = {'StartAfter': cursor['start_after']} if cursor['start_after'] else {}
+        seed = window_entries(cursor)
+
+    # The pages are fetched as select_latest consumes them
+    with metrics.timed('ListingLatency', account_id, region, {'Mode': mode}):
+        if mode == 'sample':
+            # Stop listing as soon as the classifier has enough evidence
+            print(f"Sampling files...")
+            latest, stats = select_latest(
+                list_pages(s3_client, bucket_name, **list_args),
+                max_files,
+                max_keys=data.get('sample_keys', SAMPLE_KEYS),
+                max_pages=data.get('sample_pages', SAMPLE_PAGES),
+                max_seconds=data.get('sample_seconds', SAMPLE_SECONDS),
+                seed=seed
+            )
+        else:
+            print(f"Getting files...")
+            latest, stats = select_latest(list_pages(s3_client, bucket_name, **list_args), max_files, seed=seed)
+    metrics.emit('ObjectsListed', stats['keys_listed'], 'Count', account_id, region)
+    metrics.emit('ListingPages', stats['pages'], 'Count', account_id, region)
+    cursor = next_cursor(cursor, latest, stats, rescan)
 
-    print(f"Total number of files: {len(objects)}")
+    if stats['complete']:
+        print(f"Files listed: {stats['keys_listed']}, total number of files: {cursor['object_count']}")
+    else:
+        print(f"Sampled {stats['keys_listed']} files in {stats['pages']} pages, stopped on the {stats['stop_reason']} budget")
 
-    files = list(map(lambda x: x.key, objects[-10:]))
+    files = [key for _last_modified, key in latest]
     print(files)
-    return files
+    return {
+        'files': files,
+        'mode': mode,
+        **stats,
+        'cursor': cursor,
+    }
 
 
 def get_client(client_type, account_id, region, role=CROSS_ACCOUNT_ROLE):
-    other_session = sts_client.assume_role(
-        RoleArn=f"arn:aws:iam::{account_id}:role/{role}",
-        RoleSessionName=f"get_latest_files_{account_id}"
-    )
-    access_key = other_session['Credentials']['AccessKeyId']
-    secret_key = other_session['Credentials']['SecretAccessKey']
-    session_token = other_session['Credentials']['SessionToken']
-    return boto3.client(
-        client_type,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        aws_session_token=session_token,
-        region_name=region
-    )
-
-def get_resource(client_type, account_id, region, role=CROSS_ACCOUNT_ROLE):
-    other_session = sts_client.assume_role(
-        RoleArn=f"arn:aws:iam::{account_id}:role/{role}",
-        RoleSessionName=f"get_latest_files_{account_id}"
-    )
-    access_key = other_session['Credentials']['AccessKeyId']
-    secret_key = other_session['Credentials']['SecretAccessKey']
-    session_token = other_session['Credentials']['SessionToken']
-    return boto3.resource(
-        client_type,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        aws_session_token=session_token,
-        region_name=region
-    )
+    return credentials.get_client(client_type, account_id, region, role, session_name=f"get_latest_files_{account_id}")
@@ -0,0 +1,93 @@
+import time
+import heapq
+from datetime import datetime
+
+
+def list_pages(s3_client, bucket_name, **kwargs):
+    # Streams list_objects_v2 pages one at a time without ever materialising
+    # the whole listing. Nothing is fetched until the caller asks for the
+    # next page, so breaking out of the loop stops the listing.
+    paginator = s3_client.get_paginator('list_objects_v2')
+    yield from paginator.paginate(Bucket=bucket_name, **kwargs)
+
+
+def select_latest(pages, n, max_keys=None, max_seconds=None, max_pages=None, seed=(), clock=time.monotonic):
+    # Keeps the n newest objects in a min-heap ordered on (LastModified, Key),
+    # which breaks ties the same way as a stable sort over a lexicographic
+    # listing. The heap can be seeded with (LastModified, Key) pairs carried
+    # over from an earlier listing. Stops early, after the page on which it
+    # happens, as soon as any of the optional budgets is exhausted. Returns the
+    # selected objects oldest first, and statistics saying whether the whole
+    # bucket was covered and where the listing ended.
+    heap = []
+    for entry in seed:
+        push_bounded(heap, entry, n)
+    keys_listed = 0
+    page_count = 0
+    last_key = None
+    stop_reason = None
+    started = clock()
+
+    for page in pages:
+        page_count += 1
+        for obj in page.get('Contents', []):
+            keys_listed += 1
+            last_key = obj['Key']
+            push_bounded(heap, (obj['LastModified'], last_key), n)
+
+        if not page.get('IsTruncated'):
+            break
+        stop_reason = budget_exhausted(keys_listed, page_count, clock() - started, max_keys, max_seconds, max_pages)
+        if stop_reason:
+            break
+
+    stats = {
+        'complete': stop_reason is None,
+        'stop_reason': stop_reason,
+        'keys_listed': keys_listed,
+        'pages': page_count,
+        'last_key': last_key,
+    }
+    return sorted(heap), stats
+
+
+def push_bounded(heap, entry, n):
+    if len(heap) < n:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+
+def budget_exhausted(keys_listed, page_count, elapsed, max_keys, max_seconds, max_pages):
+    if max_keys is not None and keys_listed >= max_keys:
+        return 'keys'
+    if max_pages is not None and page_count >= max_pages:
+        return 'pages'
+    if max_seconds is not None and elapsed >= max_seconds:
+        return 'seconds'
+    return None
+
+
+def next_cursor(cursor, latest, stats, rescanned):
+    # The cursor travels in the execution state between polling iterations.
+    # It remembers where the listing ended, how many objects have been seen,
+    # and the rolling window of newest keys. A rescan cut short by a sampling
+    # budget only saw the first keys of the bucket, so the count of the
+    # previous listings is kept unless the sample exceeds it.
+    cursor = cursor or {}
+    if not rescanned:
+        object_count = cursor.get('object_count', 0) + stats['keys_listed']
+    elif stats['complete']:
+        object_count = stats['keys_listed']
+    else:
+        object_count = max(cursor.get('object_count', 0), stats['keys_listed'])
+    return {
+        'start_after': stats['last_key'] or cursor.get('start_after'),
+        'object_count': object_count,
+        'window': [[last_modified.isoformat(), key] for last_modified, key in latest],
+        'since_rescan': 0 if rescanned else cursor.get('since_rescan', 0) + 1,
+    }
+
+
+def window_entries(cursor):
+    return [(datetime.fromisoformat(last_modified), key) for last_modified, key in cursor.get('window', [])]
@@ -1,21 +1,84 @@
 import os
 import json
-import boto3
-import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import clients, credentials, metrics, verdicts
+from common.monitoring import monitor, start_monitoring, is_running
+from common.probe import attach_probe, stop_forwarding
+from common.store import get_store, bucket_id, INFLIGHT, PENDING, PROBE, VERDICT
 
 
 LOG_ARCHIVE_ACCOUNT_ID = os.environ['LOG_ARCHIVE_ACCOUNT_ID']
-STATE_MACHINE_ARN = os.environ['STATE_MACHINE_ARN']
+MONITORING_MODE = os.environ.get('MONITORING_MODE', 'execution')
+DETECTION_MODE = os.environ.get('DETECTION_MODE', 'polling')
+CROSS_ACCOUNT_ROLE = os.environ.get('CROSS_ACCOUNT_ROLE')
+# The organisation's event bus, to which probed buckets' object events go
+EVENT_BUS_ARN = os.environ.get('EVENT_BUS_ARN')
+# In buffered ingestion mode, the buckets of a batch of queued events handled
+# at a time
+INGESTION_CONCURRENCY = int(os.environ.get('INGESTION_CONCURRENCY', '8'))
+
+# How long a probe waits for objects to be put in the bucket, after which the
+# keys seen so far decide or the bucket is polled instead
+PROBE_SECONDS = int(os.environ.get('PROBE_SECONDS', str(6 * 60 * 60)))
+PROBE_TTL = 3 * 24 * 60 * 60
 
-CLIENT = boto3.client('stepfunctions')
+STORE = get_store()
 
 
 def lambda_handler(event, _context):
+    # EventBridge delivers one event at a time; in buffered ingestion mode the
+    # events are queued and arrive as a batch of SQS records
+    if 'Records' in event:
+        return process_records(event['Records'])
     detail = event['detail']
     process(detail)
     return True
 
 
+def process_records(records):
+    # The events of a batch are grouped per bucket. Each bucket's events are
+    # handled in the order they happened, repeats of the same event collapsed,
+    # and the buckets with bounded concurrency. The messages of a bucket which
+    # fails are reported back to be retried; the rest of the batch is done.
+    metrics.emit('EventsReceived', len(records))
+    buckets = {}
+    failures = []
+    for record in records:
+        try:
+            detail = json.loads(record['body'])['detail']
+            key = bucket_id(detail['recipientAccountId'], detail['awsRegion'], detail['requestParameters']['bucketName'])
+        except Exception as e:
+            print(f"Unreadable message {record['messageId']}: {e}")
+            failures.append(record['messageId'])
+            continue
+        buckets.setdefault(key, []).append((detail.get('eventTime', ''), detail['eventName'], detail, record['messageId']))
+
+    def process_bucket(events):
+        events.sort(key=lambda event: event[0])
+        previous = None
+        for _time, event_name, detail, _message_id in events:
+            if event_name == previous:
+                metrics.emit('EventsDeduplicated', 1)
+                continue
+            process(detail)
+            previous = event_name
+
+    with ThreadPoolExecutor(max_workers=INGESTION_CONCURRENCY) as executor:
+        futures = {key: executor.submit(process_bucket, events) for key, events in buckets.items()}
+        for key, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to process the events of {key}: {e}")
+                failures.extend(message_id for *_event, message_id in buckets[key])
+
+    if failures:
+        metrics.emit('EventsFailed', len(failures))
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
+
 def process(detail):
     event_name = detail['eventName']
     region = detail['awsRegion']
@@ -39,44 +102,92 @@ def process(detail):
 def create_bucket(region, account_id, bucket_name):
     print("Bucket creation detected.")
 
-    if is_duplicate_execution(bucket_name):
-        print(f"An active execution for bucket {bucket_name} already exists. Skipping.")
+    # A bucket decided on before, e.g. by a replayed event, isn't analysed
+    # again. A log bucket not yet configured goes straight to replication.
+    decision = known_verdict(region, account_id, bucket_name)
+    if decision and (decision['verdict'] not in verdicts.LOGS or decision.get('configuration_hash')):
+        print(f"Bucket {bucket_name} in account {account_id}, region {region} was found to be {decision['verdict']} at {decision['decided_at']}. Skipping.")
+        return
+    if decision:
+        print(f"Bucket {bucket_name} is known to be a {decision['verdict']} log bucket.")
+        start_monitoring(STORE, region, account_id, bucket_name, decision['verdict'])
         return
 
-    print("No content monitoring job running. Starting Step Function...")
-    execution_name = f"{uuid.uuid4()}-{region}-{account_id}-{bucket_name}"[:80]
-    CLIENT.start_execution(
-        stateMachineArn=STATE_MACHINE_ARN,
-        name=execution_name,
-        input=json.dumps({
-            "region": region,
-            "account_id": account_id,
-            "bucket_name": bucket_name
-        })
-    )
+    if DETECTION_MODE == 'events':
+        start_probe(region, account_id, bucket_name)
+        return
+
+    monitor(STORE, MONITORING_MODE, region, account_id, bucket_name)
 
 
-def is_duplicate_execution(bucket_name):
-    paginator = CLIENT.get_paginator('list_executions')
-    page_iterator = paginator.paginate(
-        stateMachineArn=STATE_MACHINE_ARN,
-        statusFilter='RUNNING'
+def known_verdict(region, account_id, bucket_name):
+    try:
+        return verdicts.lookup(STORE, account_id, region, bucket_name)
+    except Exception as e:
+        print(f"Failed to look up the verdict on {bucket_name}: {e}")
+        return None
+
+
+def start_probe(region, account_id, bucket_name):
+    key = bucket_id(account_id, region, bucket_name)
+    if STORE.get(PROBE, key):
+        print(f"Bucket {bucket_name} in account {account_id}, region {region} is already probed. Skipping.")
+        return
+
+    print("Attaching object event probe...")
+    s3_client = get_client('s3', account_id, region)
+    events_client = get_client('events', account_id, region)
+    with metrics.timed('AttachProbeLatency', account_id, region):
+        had_eventbridge = attach_probe(s3_client, events_client, bucket_name, account_id, EVENT_BUS_ARN)
+    STORE.put_if_absent(PROBE, key, {
+        'region': region,
+        'account_id': account_id,
+        'bucket_name': bucket_name,
+        'had_eventbridge': had_eventbridge,
+        'keys': [],
+        'deadline': time.time() + PROBE_SECONDS,
+    }, ttl=PROBE_TTL)
+
+
+def get_client(client_type, account_id, region):
+    return credentials.get_client(
+        client_type, account_id, region, CROSS_ACCOUNT_ROLE, session_name=f"lifecycle_event_{account_id}"
     )
-    
-    for page in page_iterator:
-        for execution in page['executions']:
-            execution_arn = execution['executionArn']
-            # Use describe_execution to get the input data
-            execution_details = CLIENT.describe_execution(executionArn=execution_arn)
-            if 'input' in execution_details:
-                try:
-                    execution_input = json.loads(execution_details['input'])
-                    if execution_input.get('bucket_name') == bucket_name:
-                        return True
-                except json.JSONDecodeError:
-                    continue
-    return False
-
-    
+
+
 def delete_bucket(region, account_id, bucket_name):
-    print("Bucket deletion detected. Duly noted.")
+    # Stops the execution monitoring the bucket, found through the in-flight
+    # index, as it would otherwise keep polling until its counter runs out.
+    # Everything else kept about the bucket goes too: its pending entry with
+    # the listing cursor, its probe and its verdict, which doesn't hold for a
+    # new bucket of the same name.
+    print("Bucket deletion detected.")
+    key = bucket_id(account_id, region, bucket_name)
+
+    claim = STORE.get(INFLIGHT, key)
+    if claim:
+        if stop_execution(claim['execution_arn']):
+            print(f"Stopped {claim['execution_arn']}.")
+            metrics.emit('ExecutionsSaved', 1, 'Count', account_id, region)
+        STORE.delete(INFLIGHT, key)
+
+    # The bucket's notifications went with it, but not the rule forwarding them
+    probe = STORE.get(PROBE, key)
+    if probe and not probe.get('concluded'):
+        stop_forwarding(get_client('events', account_id, region), bucket_name)
+
+    for kind in (PENDING, PROBE, VERDICT):
+        STORE.delete(kind, key)
+
+
+def stop_execution(execution_arn):
+    # Returns whether the execution was still running
+    if not is_running(execution_arn):
+        return False
+    client = clients.client('stepfunctions')
+    try:
+        with metrics.timed('StopExecutionLatency'):
+            client.stop_execution(executionArn=execution_arn, cause='The bucket has been deleted')
+    except client.exceptions.ExecutionDoesNotExist:
+        return False
+    return True
@@ -0,0 +1,144 @@
+import os
+import time
+
+from analyse_and_decrement.classifier import REGISTRY
+from common import credentials, metrics, verdicts
+from common.monitoring import monitor, start_monitoring
+from common.probe import detach_probe
+from common.store import get_store, bucket_id, PROBE
+
+
+CROSS_ACCOUNT_ROLE = os.environ['CROSS_ACCOUNT_ROLE']
+MONITORING_MODE = os.environ.get('MONITORING_MODE', 'execution')
+# A log verdict is reached on the first keys which give one. Otherwise the
+# number of keys collected before a bucket can be found unusable, and the
+# number after which a bucket still undecided is given up on.
+PROBE_KEYS = int(os.environ.get('PROBE_KEYS', '10'))
+PROBE_MAX_KEYS = int(os.environ.get('PROBE_MAX_KEYS', '50'))
+
+PROBE_TTL = 3 * 24 * 60 * 60
+MAX_ATTEMPTS = 10
+# A verdict not followed through after this long, e.g. because detaching the
+# probe failed, is followed through by the sweep
+CONCLUDE_GRACE_SECONDS = 300
+
+STORE = get_store()
+
+
+def lambda_handler(event, _context):
+    if event.get('detail-type') == 'Scheduled Event':
+        return sweep()
+
+    region = event['region']
+    account_id = event['account']
+    bucket_name = event['detail']['bucket']['name']
+    key = event['detail']['object']['key']
+
+    id = bucket_id(account_id, region, bucket_name)
+    probe = record_key(id, key)
+    if probe is None:
+        return False
+
+    if not probe.get('verdict'):
+        print(f"{len(probe['keys'])} keys seen in {bucket_name}, no verdict yet.")
+        return True
+
+    conclude(id, probe)
+    return True
+
+
+def sweep():
+    # Runs on a schedule. A probe past its deadline is decided on the keys
+    # seen so far, however few; one still undecided, e.g. for a bucket into
+    # which nothing was put, is removed and the bucket polled instead.
+    now = time.time()
+    for id, probe in STORE.items(PROBE):
+        if probe.get('concluded'):
+            continue
+        if 'verdict' in probe:
+            if probe['decided_at'] + CONCLUDE_GRACE_SECONDS > now:
+                continue
+        elif probe.get('deadline', 0) <= now:
+            decided = dict(probe, verdict=classify(probe['keys'], final=True), decided_at=now)
+            # Unless an object event made the transition in the meantime
+            if not STORE.replace(PROBE, id, decided, expected=probe, ttl=PROBE_TTL):
+                continue
+            metrics.emit('ProbesExpired', 1, 'Count', probe['account_id'], probe['region'])
+            probe = decided
+        else:
+            continue
+        try:
+            conclude(id, probe)
+        except Exception as e:
+            print(f"Failed to conclude the probe of {probe['bucket_name']}: {e}")
+    return True
+
+
+def conclude(id, probe):
+    # Records the verdict, removes the probe and sets up replication of log
+    # buckets. A bucket still undecided falls back to polling.
+    region = probe['region']
+    account_id = probe['account_id']
+    bucket_name = probe['bucket_name']
+    verdict = probe['verdict']
+
+    print(f"Verdict on {bucket_name} in account {account_id}, region {region}: {verdict}. Detaching probe...")
+    if verdict in verdicts.FINAL:
+        try:
+            verdicts.record(STORE, {'account_id': account_id, 'region': region, 'bucket_name': bucket_name, 'verdict': verdict})
+        except Exception as e:
+            print(f"Failed to record the verdict on {bucket_name}: {e}")
+    with metrics.timed('DetachProbeLatency', account_id, region):
+        detach_probe(get_client('s3', account_id, region), get_client('events', account_id, region), bucket_name, probe['had_eventbridge'])
+
+    if verdict in verdicts.LOGS:
+        print("Starting Step Function to set up replication...")
+        start_monitoring(STORE, region, account_id, bucket_name, verdict)
+    elif verdict not in verdicts.FINAL:
+        print("No verdict on the keys put before the probe's deadline. Polling the bucket instead...")
+        monitor(STORE, MONITORING_MODE, region, account_id, bucket_name)
+    STORE.replace(PROBE, id, dict(probe, concluded=True), expected=probe, ttl=PROBE_TTL)
+
+
+def get_client(client_type, account_id, region):
+    return credentials.get_client(
+        client_type, account_id, region, CROSS_ACCOUNT_ROLE, session_name=f"object_created_{account_id}"
+    )
+
+
+def record_key(id, key):
+    # Adds the key to the probe and classifies the keys seen so far. Events for
+    # the same bucket arrive concurrently, so the update is retried until it
+    # applies to the latest version of the probe; exactly one invocation makes
+    # the transition to a verdict. Returns None for buckets not being probed,
+    # or already decided.
+    for _attempt in range(MAX_ATTEMPTS):
+        probe = STORE.get(PROBE, id)
+        if probe is None or 'verdict' in probe:
+            return None
+
+        updated = dict(probe, keys=probe['keys'] + [key])
+        verdict = classify(updated['keys'])
+        if verdict:
+            updated.update(verdict=verdict, decided_at=time.time())
+        if STORE.replace(PROBE, id, updated, expected=probe, ttl=PROBE_TTL):
+            return updated
+
+    raise RuntimeError(f"Could not record {key} for {id}: too much contention")
+
+
+def classify(keys, final=False):
+    # Final once the probe's deadline has passed, when whatever keys there are
+    # decide and 'undecided' is returned rather than None
+    if not keys:
+        return 'undecided' if final else None
+    verdict = REGISTRY.summarise(keys[-PROBE_KEYS:])['verdict']
+    if verdict in verdicts.LOGS:
+        return verdict
+    if len(keys) < PROBE_KEYS and not final:
+        return None
+    if verdict != 'undecided':
+        return verdict
+    if len(keys) >= PROBE_MAX_KEYS:
+        return 'unusable'
+    return 'undecided' if final else None
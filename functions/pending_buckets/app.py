@@ -0,0 +1,147 @@
+import os
+import time
+import uuid
+
+from common import metrics
+from common.pending import PENDING_TTL
+from common.store import get_store, bucket_id, PENDING
+
+
+MONITORING_BATCH_SIZE = int(os.environ.get('MONITORING_BATCH_SIZE', '25'))
+# Keeps the list of batches well within the 256 KB state payload limit
+MAX_BUCKETS_PER_RUN = int(os.environ.get('MAX_BUCKETS_PER_RUN', '1500'))
+MAX_REPLICATION_ATTEMPTS = 3
+
+# Buckets handed out by collect are leased for this long, so that a run which
+# overlaps with this one leaves them alone. MonitorPendingBuckets times out
+# after as long, so no run outlives its leases.
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', '3600'))
+
+STORE = get_store()
+
+
+def lambda_handler(data, _context):
+    action = data['action']
+    if action == 'collect':
+        return collect()
+    if action == 'load':
+        return load(data['ids'], data['lease'])
+    if action == 'settle':
+        return settle(data['buckets'], data['outcomes'], data.get('incidents'))
+    if action == 'release':
+        return release(data['ids'], data['lease'], data['error'])
+    if action == 'report':
+        return report(data['results'])
+    raise ValueError(f"Unknown action '{action}'")
+
+
+def collect():
+    # Only the ids travel through the driver state machine; each batch loads
+    # its buckets when it's about to process them. Each bucket due is leased
+    # with a conditional write, which fails if another run got to it first.
+    now = time.time()
+    lease = str(uuid.uuid4())
+    ids = []
+    for id, bucket in STORE.items(PENDING):
+        if bucket.get('next_poll_at', 0) > now:
+            continue
+        leased = dict(bucket, lease=lease, next_poll_at=now + LEASE_SECONDS)
+        if not STORE.replace(PENDING, id, leased, expected=bucket, ttl=PENDING_TTL):
+            continue
+        ids.append(id)
+        if len(ids) >= MAX_BUCKETS_PER_RUN:
+            print(f"More than {MAX_BUCKETS_PER_RUN} buckets pending, the rest wait for the next run.")
+            break
+
+    batches = [{'ids': ids[i:i + MONITORING_BATCH_SIZE], 'lease': lease} for i in range(0, len(ids), MONITORING_BATCH_SIZE)]
+    print(f"{len(ids)} buckets due for polling, in {len(batches)} batches.")
+    metrics.emit('BucketsDue', len(ids))
+    return {'batches': batches}
+
+
+def load(ids, lease):
+    # Buckets whose lease has since passed to another run are left to it
+    buckets = []
+    for id in ids:
+        bucket = STORE.get(PENDING, id)
+        if bucket and bucket.get('lease') == lease:
+            buckets.append(bucket)
+    return {'buckets': buckets}
+
+
+def settle(buckets, outcomes, incidents=None):
+    # Writes back the buckets still undecided and drops the rest. A bucket
+    # whose replication failed stays pending to be retried on the next run.
+    # Incidents for the buckets replicated were created in one call, whose
+    # result, or error, is in incidents. Returns what failed for report to
+    # act on once all batches are done.
+    failed = []
+    incident_failed = failed_incidents(incidents)
+    for bucket, outcome in zip(buckets, outcomes):
+        id = bucket_id(bucket['account_id'], bucket['region'], bucket['bucket_name'])
+        verdict = bucket['verdict']
+        outcome = outcome['outcome']
+        if outcome == 'replicated' and incident_failed(id):
+            outcome = 'incident_failed'
+
+        current = STORE.get(PENDING, id)
+        if not current or current.get('lease') != bucket.get('lease'):
+            print(f"The lease on {bucket['bucket_name']} has passed to another run, leaving it be.")
+            continue
+        del bucket['lease']
+
+        if outcome == 'replication_failed':
+            bucket['replication_attempts'] += 1
+            if bucket['replication_attempts'] >= MAX_REPLICATION_ATTEMPTS:
+                failed.append(f"replication of {bucket['bucket_name']}")
+                STORE.delete(PENDING, id)
+            else:
+                bucket['next_poll_at'] = time.time()
+                STORE.replace(PENDING, id, bucket, expected=current, ttl=PENDING_TTL)
+        elif verdict == 'undecided' and bucket['counter'] >= 0:
+            # Follow the polling schedule computed by analyse_and_decrement
+            bucket['next_poll_at'] = time.time() + bucket['wait_seconds']
+            STORE.replace(PENDING, id, bucket, expected=current, ttl=PENDING_TTL)
+        else:
+            if outcome == 'incident_failed':
+                failed.append(f"incident for {bucket['bucket_name']}")
+            print(f"Bucket {bucket['bucket_name']} in account {bucket['account_id']}, region {bucket['region']}: {verdict}, {outcome}")
+            STORE.delete(PENDING, id)
+    return {'failed': failed}
+
+
+def failed_incidents(incidents):
+    # Returns whether the incident for a bucket failed, by its id
+    if incidents is None:
+        return lambda _id: False
+    if 'Error' in incidents:
+        print(f"Failed to create incidents: {incidents['Error']}")
+        return lambda _id: True
+    failed = {
+        bucket_id(bucket['account_id'], bucket['region'], bucket['bucket_name'])
+        for bucket in incidents['buckets'] if 'incident_error' in bucket
+    }
+    return failed.__contains__
+
+
+def release(ids, lease, error):
+    # A batch which failed gives its buckets back to be polled on the next run
+    # rather than when the lease runs out
+    now = time.time()
+    for id in ids:
+        bucket = STORE.get(PENDING, id)
+        if bucket and bucket.get('lease') == lease:
+            released = {key: value for key, value in bucket.items() if key != 'lease'}
+            released['next_poll_at'] = now
+            STORE.replace(PENDING, id, released, expected=bucket, ttl=PENDING_TTL)
+    print(f"A batch of {len(ids)} buckets failed: {error['Error']}: {error.get('Cause')}")
+    return {'failed': [f"batch of {len(ids)} buckets ({error['Error']})"]}
+
+
+def report(results):
+    # Fails the run once every batch is done, so that the alarm on the driver
+    # state machine goes off
+    failed = [failure for result in results for failure in result['failed']]
+    if failed:
+        raise RuntimeError(f"Failed: {', '.join(failed)}")
+    return True
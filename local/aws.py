@@ -0,0 +1,208 @@
+# In-memory stand-ins for the AWS services the functions call, and a way to
+# route the functions' clients to them. install() replaces the sessions the
+# shared client layer and the credential cache create, so the functions run
+# unchanged and nothing is sent to AWS. All services count the calls made.
+
+import json
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from local.errors import ClientError
+from local.s3 import S3
+
+
+class STS:
+
+    def __init__(self, clock=time.time):
+        self.calls = []
+        self.exceptions = SimpleNamespace(ClientError=ClientError)
+        self._clock = clock
+
+    def assume_role(self, RoleArn, RoleSessionName, **_kwargs):
+        self.calls.append('assume_role')
+        return {
+            'Credentials': {
+                'AccessKeyId': 'ASIALOCAL',
+                'SecretAccessKey': 'local',
+                'SessionToken': RoleSessionName,
+                'Expiration': datetime.fromtimestamp(self._clock(), timezone.utc) + timedelta(hours=1),
+            },
+        }
+
+
+class ExecutionDoesNotExist(ClientError):
+    pass
+
+
+class StepFunctions:
+    # Records executions started. If on_start is given it is called with the
+    # ARN and parsed input of each, which is how a local engine runs them.
+
+    def __init__(self, on_start=None):
+        self.calls = []
+        self.executions = {}
+        self.exceptions = SimpleNamespace(ClientError=ClientError, ExecutionDoesNotExist=ExecutionDoesNotExist)
+        self.on_start = on_start
+        self._lock = threading.Lock()
+
+    def start_execution(self, stateMachineArn, name, input='{}'):
+        self.calls.append('start_execution')
+        execution_arn = f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}"
+        with self._lock:
+            self.executions[execution_arn] = {'status': 'RUNNING', 'input': json.loads(input)}
+        if self.on_start:
+            self.on_start(execution_arn, json.loads(input))
+        return {'executionArn': execution_arn}
+
+    def describe_execution(self, executionArn):
+        self.calls.append('describe_execution')
+        with self._lock:
+            if executionArn not in self.executions:
+                raise ExecutionDoesNotExist('ExecutionDoesNotExist', 'DescribeExecution')
+            return {'executionArn': executionArn, 'status': self.executions[executionArn]['status']}
+
+    def stop_execution(self, executionArn, **_kwargs):
+        self.calls.append('stop_execution')
+        with self._lock:
+            if executionArn not in self.executions:
+                raise ExecutionDoesNotExist('ExecutionDoesNotExist', 'StopExecution')
+            self.executions[executionArn]['status'] = 'ABORTED'
+        return {}
+
+
+class ResourceNotFoundException(ClientError):
+    pass
+
+
+class EventBridge:
+    # Keeps the rules put on the default bus with their targets, which tells
+    # whose events would be forwarded
+
+    def __init__(self):
+        self.calls = []
+        self.rules = {}
+        self.exceptions = SimpleNamespace(ClientError=ClientError, ResourceNotFoundException=ResourceNotFoundException)
+        self._lock = threading.Lock()
+
+    def put_rule(self, Name, EventPattern, State='ENABLED', **_kwargs):
+        self.calls.append('put_rule')
+        with self._lock:
+            rule = self.rules.setdefault(Name, {'targets': {}})
+            rule.update(pattern=json.loads(EventPattern), state=State)
+        return {'RuleArn': f"arn:aws:events:local:000000000000:rule/{Name}"}
+
+    def put_targets(self, Rule, Targets):
+        self.calls.append('put_targets')
+        with self._lock:
+            self._rule(Rule, 'PutTargets')['targets'].update((target['Id'], target) for target in Targets)
+        return {'FailedEntryCount': 0, 'FailedEntries': []}
+
+    def remove_targets(self, Rule, Ids):
+        self.calls.append('remove_targets')
+        with self._lock:
+            targets = self._rule(Rule, 'RemoveTargets')['targets']
+            for id in Ids:
+                targets.pop(id, None)
+        return {'FailedEntryCount': 0, 'FailedEntries': []}
+
+    def delete_rule(self, Name):
+        self.calls.append('delete_rule')
+        with self._lock:
+            if self._rule(Name, 'DeleteRule')['targets']:
+                raise ClientError('ValidationException', 'DeleteRule', 'Rule can\'t be deleted since it has targets.')
+            del self.rules[Name]
+        return {}
+
+    def forwarded(self, bucket_name):
+        # Whether the Object Created events of the bucket match a rule with targets
+        with self._lock:
+            return any(
+                rule['state'] == 'ENABLED' and rule['targets']
+                and 'Object Created' in rule['pattern'].get('detail-type', [])
+                and bucket_name in rule['pattern'].get('detail', {}).get('bucket', {}).get('name', [bucket_name])
+                for rule in self.rules.values()
+            )
+
+    def _rule(self, name, operation):
+        if name not in self.rules:
+            raise ResourceNotFoundException('ResourceNotFoundException', operation, f"Rule {name} does not exist.")
+        return self.rules[name]
+
+
+class SecurityHub:
+    # Imported findings are kept by Id, so importing one again updates it;
+    # the fields an update leaves out, such as Workflow, keep their value
+
+    def __init__(self):
+        self.calls = []
+        self.findings = {}
+        self.exceptions = SimpleNamespace(ClientError=ClientError)
+        self._lock = threading.Lock()
+
+    def batch_import_findings(self, Findings):
+        self.calls.append('batch_import_findings')
+        if len(Findings) > 100:
+            raise ClientError('InvalidInputException', 'BatchImportFindings', 'At most 100 findings per call')
+        with self._lock:
+            for finding in Findings:
+                self.findings[finding['Id']] = {**self.findings.get(finding['Id'], {}), **finding}
+        return {'FailedCount': 0, 'SuccessCount': len(Findings), 'FailedFindings': []}
+
+    def get_findings(self, Filters, **_kwargs):
+        # Only filtering on Id is supported; all matches come in one page
+        self.calls.append('get_findings')
+        if set(Filters) != {'Id'}:
+            raise NotImplementedError(', '.join(Filters))
+        ids = {condition['Value'] for condition in Filters['Id'] if condition['Comparison'] == 'EQUALS'}
+        with self._lock:
+            return {'Findings': [dict(finding) for id, finding in self.findings.items() if id in ids]}
+
+    def get_paginator(self, operation):
+        if operation != 'get_findings':
+            raise NotImplementedError(operation)
+        return SimpleNamespace(paginate=lambda **kwargs: iter([self.get_findings(**kwargs)]))
+
+
+class AWS:
+    # One of each service, shared by all accounts and regions
+
+    SERVICES = ('s3', 'sts', 'stepfunctions', 'securityhub', 'events')
+
+    def __init__(self, latency=0.0, clock=time.time):
+        self.s3 = S3(latency=latency, clock=clock)
+        self.sts = STS(clock=clock)
+        self.stepfunctions = StepFunctions()
+        self.securityhub = SecurityHub()
+        self.events = EventBridge()
+        self._clock = clock
+
+    def client(self, service, region_name=None, config=None, **_kwargs):
+        if service not in self.SERVICES:
+            raise NotImplementedError(f"No local stand-in for {service}")
+        return getattr(self, service)
+
+    def session(self, **_kwargs):
+        return SimpleNamespace(client=self.client)
+
+    def calls(self):
+        # The number of calls made to each service and operation
+        return Counter(
+            f"{service}.{call}"
+            for service in self.SERVICES
+            for call in getattr(self, service).calls
+        )
+
+    def install(self):
+        # The functions folder must be on sys.path
+        from common import clients, credentials
+        clients.reset()
+        clients.new_session = self.session
+        credentials.CACHE = credentials.CredentialCache(
+            sts_client=self.sts,
+            session_factory=self.session,
+            clock=lambda: datetime.fromtimestamp(self._clock(), timezone.utc)
+        )
+        return self
@@ -0,0 +1,11 @@
+# The error the local stand-ins raise, shaped like botocore's ClientError so
+# that code inspecting e.response['Error']['Code'] works unchanged. Defined
+# here rather than imported, so that running locally needs no boto3.
+
+
+class ClientError(Exception):
+
+    def __init__(self, code, operation_name, message=None):
+        super().__init__(f"An error occurred ({code}) when calling the {operation_name} operation: {message or code}")
+        self.response = {'Error': {'Code': code, 'Message': message or code}}
+        self.operation_name = operation_name
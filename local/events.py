@@ -0,0 +1,60 @@
+# Stand-in event source for running the event-driven detection path locally.
+# Builds the events S3 sends to EventBridge, as forwarded to the custom event
+# bus, and delivers them to a handler in order or as a queued batch.
+
+import json
+import uuid
+from datetime import datetime, timezone
+
+
+def object_created_event(account_id, region, bucket_name, key, size=1024):
+    return {
+        'version': '0',
+        'id': str(uuid.uuid4()),
+        'detail-type': 'Object Created',
+        'source': 'aws.s3',
+        'account': account_id,
+        'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'region': region,
+        'resources': [f"arn:aws:s3:::{bucket_name}"],
+        'detail': {
+            'version': '0',
+            'bucket': {'name': bucket_name},
+            'object': {'key': key, 'size': size},
+            'reason': 'PutObject',
+        },
+    }
+
+
+def lifecycle_event(event_name, account_id, region, bucket_name):
+    return {
+        'detail-type': 'AWS API Call via CloudTrail',
+        'source': 'aws.s3',
+        'account': account_id,
+        'region': region,
+        'detail': {
+            'eventSource': 's3.amazonaws.com',
+            'eventName': event_name,
+            'eventTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'awsRegion': region,
+            'recipientAccountId': account_id,
+            'requestParameters': {'bucketName': bucket_name},
+        },
+    }
+
+
+def queued(events):
+    # The events as a buffering SQS queue hands them to a function in a batch
+    return {'Records': [
+        {'messageId': str(uuid.uuid4()), 'eventSource': 'aws:sqs', 'body': json.dumps(event)}
+        for event in events
+    ]}
+
+
+def deliver(handler, events):
+    # Returns the handler's result for each event
+    return [handler(event, None) for event in events]
+
+
+def put_objects(handler, account_id, region, bucket_name, keys):
+    return deliver(handler, (object_created_event(account_id, region, bucket_name, key) for key in keys))
@@ -0,0 +1,182 @@
+# Stand-in S3 client for running the functions locally. Keeps buckets, their
+# objects and configurations in memory and answers the calls the functions make
+# the way S3 does, including the errors for absent configurations. An optional
+# latency per call makes the effect of running calls concurrently visible, and
+# the clock stamping objects can be virtual; every call made is recorded.
+
+import copy
+import time
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from local.errors import ClientError
+
+
+# The error S3 returns when a bucket has no configuration of each kind
+MISSING = {
+    'encryption': 'ServerSideEncryptionConfigurationNotFoundError',
+    'replication': 'ReplicationConfigurationNotFoundError',
+    'lifecycle': 'NoSuchLifecycleConfiguration',
+}
+
+
+class S3:
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, latency=0.0, clock=time.time):
+        self.latency = latency
+        self.calls = []
+        self.exceptions = SimpleNamespace(ClientError=ClientError)
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def create_bucket(self, Bucket, CreateBucketConfiguration=None, **_kwargs):
+        # Without a location constraint, in us-east-1 as S3 has it
+        self._call('create_bucket')
+        region = (CreateBucketConfiguration or {}).get('LocationConstraint')
+        with self._lock:
+            self._buckets.setdefault(Bucket, {'notification': {}, 'objects': {}, 'region': region})
+        return {}
+
+    def list_buckets(self, **_kwargs):
+        self._call('list_buckets')
+        with self._lock:
+            buckets = [
+                {'Name': name, 'BucketRegion': bucket['region'] or 'us-east-1'}
+                for name, bucket in sorted(self._buckets.items())
+            ]
+        return {'Buckets': buckets, 'IsTruncated': False}
+
+    def get_bucket_location(self, Bucket):
+        self._call('get_bucket_location')
+        with self._lock:
+            return {'LocationConstraint': self._bucket(Bucket)['region']}
+
+    def delete_bucket(self, Bucket):
+        self._call('delete_bucket')
+        with self._lock:
+            self._bucket(Bucket)
+            del self._buckets[Bucket]
+        return {}
+
+    def head_bucket(self, Bucket):
+        self._call('head_bucket')
+        with self._lock:
+            self._bucket(Bucket)
+        return {}
+
+    def put_object(self, Bucket, Key, Body=b'', **_kwargs):
+        self._call('put_object')
+        with self._lock:
+            self._bucket(Bucket)['objects'][Key] = {
+                'Key': Key,
+                'LastModified': datetime.fromtimestamp(self._clock(), timezone.utc),
+                'Size': len(Body),
+            }
+        return {}
+
+    def list_objects_v2(self, Bucket, StartAfter='', ContinuationToken=None, MaxKeys=PAGE_SIZE, **_kwargs):
+        # The continuation token is simply the last key of the previous page
+        self._call('list_objects_v2')
+        after = ContinuationToken or StartAfter
+        with self._lock:
+            keys = sorted(key for key in self._bucket(Bucket)['objects'] if key > after)
+            contents = [dict(self._buckets[Bucket]['objects'][key]) for key in keys[:MaxKeys]]
+        page = {'KeyCount': len(contents), 'IsTruncated': len(keys) > MaxKeys}
+        if contents:
+            page['Contents'] = contents
+        if page['IsTruncated']:
+            page['NextContinuationToken'] = contents[-1]['Key']
+        return page
+
+    def get_paginator(self, operation):
+        if operation not in ('list_objects_v2', 'list_buckets'):
+            raise NotImplementedError(operation)
+        return Paginator(getattr(self, operation))
+
+    def configuration(self, bucket_name, kind):
+        # For inspecting a bucket without recording a call
+        with self._lock:
+            return copy.deepcopy(self._bucket(bucket_name).get(kind))
+
+    def get_bucket_encryption(self, Bucket):
+        return {'ServerSideEncryptionConfiguration': self._get('get_bucket_encryption', Bucket, 'encryption')}
+
+    def put_bucket_encryption(self, Bucket, ServerSideEncryptionConfiguration):
+        return self._put('put_bucket_encryption', Bucket, 'encryption', ServerSideEncryptionConfiguration)
+
+    def get_bucket_versioning(self, Bucket):
+        self._call('get_bucket_versioning')
+        with self._lock:
+            return copy.deepcopy(self._bucket(Bucket).get('versioning', {}))
+
+    def put_bucket_versioning(self, Bucket, VersioningConfiguration):
+        return self._put('put_bucket_versioning', Bucket, 'versioning', VersioningConfiguration)
+
+    def get_bucket_replication(self, Bucket):
+        return {'ReplicationConfiguration': self._get('get_bucket_replication', Bucket, 'replication')}
+
+    def put_bucket_replication(self, Bucket, ReplicationConfiguration):
+        with self._lock:
+            versioned = self._bucket(Bucket).get('versioning', {}).get('Status') == 'Enabled'
+        if not versioned:
+            self._call('put_bucket_replication')
+            raise ClientError('InvalidRequest', 'PutBucketReplication')
+        return self._put('put_bucket_replication', Bucket, 'replication', ReplicationConfiguration)
+
+    def get_bucket_lifecycle_configuration(self, Bucket):
+        return self._get('get_bucket_lifecycle_configuration', Bucket, 'lifecycle')
+
+    def put_bucket_lifecycle_configuration(self, Bucket, LifecycleConfiguration):
+        return self._put('put_bucket_lifecycle_configuration', Bucket, 'lifecycle', LifecycleConfiguration)
+
+    def get_bucket_notification_configuration(self, Bucket):
+        self._call('get_bucket_notification_configuration')
+        with self._lock:
+            return copy.deepcopy(self._bucket(Bucket)['notification'])
+
+    def put_bucket_notification_configuration(self, Bucket, NotificationConfiguration, **_kwargs):
+        return self._put('put_bucket_notification_configuration', Bucket, 'notification', NotificationConfiguration)
+
+    def _get(self, operation, bucket_name, kind):
+        self._call(operation)
+        with self._lock:
+            configuration = self._bucket(bucket_name).get(kind)
+        if configuration is None:
+            raise ClientError(MISSING[kind], operation)
+        return copy.deepcopy(configuration)
+
+    def _put(self, operation, bucket_name, kind, configuration):
+        self._call(operation)
+        with self._lock:
+            self._bucket(bucket_name)[kind] = copy.deepcopy(configuration)
+        return {}
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls.append(operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _bucket(self, bucket_name):
+        if bucket_name not in self._buckets:
+            raise ClientError('NoSuchBucket', 'bucket')
+        return self._buckets[bucket_name]
+
+
+class Paginator:
+
+    def __init__(self, operation):
+        self._operation = operation
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self._operation(**kwargs, **({'ContinuationToken': token} if token else {}))
+            yield page
+            if not page['IsTruncated']:
+                return
+            token = page['NextContinuationToken']
@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+#
+# Runs MonitorBucketForLogs locally, end to end and in virtual time. Synthetic
+# buckets are created in the in-memory stand-ins, their CreateBucket event is
+# delivered to lifecycle_event, and the execution it starts is interpreted from
+# the ASL definition with its Task states calling the handlers directly. Wait
+# states and retries advance a virtual clock, and objects are put in the bucket
+# as the clock passes their time. Each scenario reports its state transitions,
+# Lambda invocations, AWS calls and an estimate of what they cost.
+#
+#   python3 local/simulator.py --scenarios 2000 --seed 1
+#   POLL_MAX_SECONDS=1800 python3 local/simulator.py --scenarios 2000 --seed 1 --output slower.json
+#
+# Needs PyYAML to read the definition.
+
+import os
+import re
+import sys
+import json
+import heapq
+import random
+import argparse
+import importlib
+import contextlib
+from time import perf_counter
+from functools import partial, lru_cache
+from collections import Counter
+from datetime import datetime, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+FUNCTIONS = os.path.join(ROOT, 'functions')
+DEFINITION = os.path.join(ROOT, 'statemachine', 'monitor_bucket_for_logs.asl.yaml')
+
+ACCOUNT_ID = '222222222222'
+REGION = 'eu-north-1'
+
+# What the template passes to the functions. The state table is left out so
+# that the functions use the SQLite stand-in. Settings already in the
+# environment win, which is how variations of the polling strategy are run.
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': REGION,
+    'CROSS_ACCOUNT_ROLE': 'AWSControlTowerExecution',
+    'LOG_ARCHIVE_ACCOUNT_ID': '111111111111',
+    'LOG_ARCHIVE_ACCOUNT_iD': '111111111111',
+    'STATE_MACHINE_ARN': f'arn:aws:states:{REGION}:{ACCOUNT_ID}:stateMachine:MonitorBucketForLogs',
+    'REPLICATION_ROLE_NAME': 'replication-role',
+    'CLOUDFRONT_LOGS_BUCKET_NAME': 'cloudfront-logs',
+    'LOAD_BALANCER_LOGS_BUCKET_NAME': 'load-balancer-logs',
+}
+
+# Step Functions refuses to run an execution past this many history events
+MAX_TRANSITIONS = 25000
+
+# The longest a bucket is simulated for, as long as the in-flight index keeps
+# an execution's claim
+HORIZON_SECONDS = 3 * 24 * 60 * 60
+
+# List prices in USD in us-east-1, for comparing runs rather than budgeting:
+# standard workflow state transitions, Lambda requests without their duration,
+# and S3 requests. STS, Step Functions API calls and the findings are left out.
+PRICES = {
+    'transition': 0.025 / 1000,
+    'invocation': 0.20 / 1000000,
+    's3_write_or_list': 0.005 / 1000,
+    's3_other': 0.0004 / 1000,
+}
+
+# The mix of buckets simulated by default, and what is put in each
+KINDS = {
+    'alb': 0.3,         # ALB access logs every five minutes, starting within ten
+    'cloudfront': 0.1,  # CloudFront standard logs, starting within the hour
+    'late_alb': 0.1,    # ALB access logs, but only once logging is enabled a day or two later
+    'data': 0.3,        # application data trickling in
+    'empty': 0.15,      # nothing, ever
+    'deleted': 0.05,    # nothing, and deleted within two hours
+}
+
+
+class StatesError(Exception):
+    # An error as Step Functions names it, for Retry and Catch to match
+
+    def __init__(self, error, cause=''):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+class VirtualClock:
+    # Epoch seconds which only move when advanced. Actions scheduled for a
+    # time are run, in order, as the clock passes it.
+
+    def __init__(self, start=None):
+        self.now = start if start is not None else datetime.now(timezone.utc).timestamp()
+        self._events = []
+        self._sequence = 0
+
+    def __call__(self):
+        return self.now
+
+    def schedule(self, at, action):
+        heapq.heappush(self._events, (at, self._sequence, action))
+        self._sequence += 1
+
+    def advance(self, seconds):
+        until = self.now + max(0, seconds)
+        while self._events and self._events[0][0] <= until:
+            at, _sequence, action = heapq.heappop(self._events)
+            self.now = max(self.now, at)
+            action()
+        self.now = until
+
+    def clear(self):
+        self._events = []
+
+
+class Engine:
+    # Interprets the ASL this repo uses: Pass, Task, Choice, Wait, Succeed and
+    # Fail states, with InputPath, Parameters, ResultPath and OutputPath, and
+    # Retry and Catch on Task states. Task resources are looked up in a dict
+    # of callables taking the state's input. Waits advance the clock.
+
+    def __init__(self, definition, resources, clock, max_transitions=MAX_TRANSITIONS):
+        self.definition = definition
+        self.resources = resources
+        self.clock = clock
+        self.max_transitions = max_transitions
+
+    def run(self, data, stopped=lambda: False):
+        # stopped tells whether the execution has been stopped from outside,
+        # which is checked between states
+        execution = {
+            'status': 'RUNNING',
+            'transitions': 0,
+            'invocations': Counter(),
+            'started_at': self.clock.now,
+        }
+        name = self.definition['StartAt']
+        try:
+            while name:
+                if stopped():
+                    execution['status'] = 'ABORTED'
+                    break
+                state = self.definition['States'][name]
+                self._transition(execution)
+                if state['Type'] == 'Fail':
+                    raise StatesError(state.get('Error', 'States.Fail'), state.get('Cause', ''))
+                step = getattr(self, f"_{state['Type'].lower()}", None)
+                if step is None:
+                    raise NotImplementedError(f"{state['Type']} states are not simulated")
+                name, data = step(state, data, execution)
+            else:
+                execution.update(status='SUCCEEDED', output=data)
+        except StatesError as e:
+            execution.update(status='FAILED', error=e.error, cause=e.cause)
+        execution['seconds'] = self.clock.now - execution['started_at']
+        return execution
+
+    def _transition(self, execution):
+        # Retries are billed as transitions, so they count here too
+        execution['transitions'] += 1
+        if execution['transitions'] > self.max_transitions:
+            raise StatesError('States.Runtime', f"More than {self.max_transitions} transitions")
+
+    def _pass(self, state, data, _execution):
+        effective = parameters(state, get_path(data, state.get('InputPath', '$')))
+        result = state['Result'] if 'Result' in state else effective
+        return self._next(state, data, result)
+
+    def _task(self, state, data, execution):
+        effective = parameters(state, get_path(data, state.get('InputPath', '$')))
+        attempts = Counter()
+        while True:
+            try:
+                result = self._invoke(state['Resource'], effective, execution)
+                break
+            except StatesError as e:
+                retrier = matching(state.get('Retry', []), e.error)
+                if retrier is not None and attempts[retrier] < state['Retry'][retrier].get('MaxAttempts', 3):
+                    retry = state['Retry'][retrier]
+                    delay = retry.get('IntervalSeconds', 1) * retry.get('BackoffRate', 2.0) ** attempts[retrier]
+                    attempts[retrier] += 1
+                    self._transition(execution)
+                    self.clock.advance(min(delay, retry.get('MaxDelaySeconds', delay)))
+                    continue
+                catcher = matching(state.get('Catch', []), e.error)
+                if catcher is None:
+                    raise
+                catch = state['Catch'][catcher]
+                data = set_path(data, catch.get('ResultPath', '$'), {'Error': e.error, 'Cause': e.cause})
+                return catch['Next'], data
+        return self._next(state, data, result)
+
+    def _invoke(self, resource, payload, execution):
+        name, handler = self.resources[resource]
+        execution['invocations'][name] += 1
+        # Through JSON both ways, as Lambda does
+        try:
+            return json.loads(json.dumps(handler(json.loads(json.dumps(payload)), None)))
+        except StatesError:
+            raise
+        except Exception as e:
+            raise StatesError(type(e).__name__, str(e))
+
+    def _choice(self, state, data, _execution):
+        for rule in state['Choices']:
+            if evaluate(rule, data):
+                return rule['Next'], data
+        if 'Default' not in state:
+            raise StatesError('States.NoChoiceMatched', 'No choice rule matched')
+        return state['Default'], data
+
+    def _wait(self, state, data, _execution):
+        if 'Seconds' in state:
+            seconds = state['Seconds']
+        elif 'SecondsPath' in state:
+            seconds = get_path(data, state['SecondsPath'])
+        else:
+            timestamp = state['Timestamp'] if 'Timestamp' in state else get_path(data, state['TimestampPath'])
+            seconds = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp() - self.clock.now
+        self.clock.advance(seconds)
+        return self._next(state, data, None, keep_input=True)
+
+    def _succeed(self, state, data, _execution):
+        return None, get_path(get_path(data, state.get('InputPath', '$')), state.get('OutputPath', '$'))
+
+    def _next(self, state, data, result, keep_input=False):
+        if not keep_input:
+            data = set_path(data, state.get('ResultPath', '$'), result)
+        data = get_path(data, state.get('OutputPath', '$'))
+        return (None if state.get('End') else state['Next']), data
+
+
+# Reference paths: $ and $.field.field only, which is all the definitions use
+
+def get_path(data, path):
+    if path is None:
+        return {}
+    value = data
+    for field in path_fields(path):
+        if not isinstance(value, dict) or field not in value:
+            raise StatesError('States.Runtime', f"Invalid path {path}")
+        value = value[field]
+    return value
+
+
+def set_path(data, path, value):
+    if path is None:
+        return data
+    fields = path_fields(path)
+    if not fields:
+        return value
+    data = dict(data)
+    target = data
+    for field in fields[:-1]:
+        target[field] = dict(target.get(field, {}))
+        target = target[field]
+    target[fields[-1]] = value
+    return data
+
+
+@lru_cache(maxsize=None)
+def path_fields(path):
+    if not re.fullmatch(r'\$(\.\w+)*', path):
+        raise NotImplementedError(f"Path {path} is not simulated")
+    return tuple(path.split('.')[1:])
+
+
+def is_present(data, path):
+    try:
+        get_path(data, path)
+        return True
+    except StatesError:
+        return False
+
+
+def parameters(state, data):
+    if 'Parameters' not in state:
+        return data
+    return resolve(state['Parameters'], data)
+
+
+def resolve(template, data):
+    if isinstance(template, dict):
+        return {
+            key[:-2] if key.endswith('.$') else key: get_path(data, value) if key.endswith('.$') else resolve(value, data)
+            for key, value in template.items()
+        }
+    if isinstance(template, list):
+        return [resolve(value, data) for value in template]
+    return template
+
+
+def matching(handlers, error):
+    # The index of the first retrier or catcher whose ErrorEquals matches
+    for index, handler in enumerate(handlers):
+        names = handler['ErrorEquals']
+        if error in names or 'States.ALL' in names or ('States.TaskFailed' in names and error != 'States.Timeout'):
+            return index
+    return None
+
+
+COMPARISONS = {
+    'StringEquals': (str, lambda a, b: a == b),
+    'StringLessThan': (str, lambda a, b: a < b),
+    'StringGreaterThan': (str, lambda a, b: a > b),
+    'NumericEquals': ((int, float), lambda a, b: a == b),
+    'NumericLessThan': ((int, float), lambda a, b: a < b),
+    'NumericLessThanEquals': ((int, float), lambda a, b: a <= b),
+    'NumericGreaterThan': ((int, float), lambda a, b: a > b),
+    'NumericGreaterThanEquals': ((int, float), lambda a, b: a >= b),
+    'BooleanEquals': (bool, lambda a, b: a == b),
+}
+
+
+def evaluate(rule, data):
+    if 'And' in rule:
+        return all(evaluate(r, data) for r in rule['And'])
+    if 'Or' in rule:
+        return any(evaluate(r, data) for r in rule['Or'])
+    if 'Not' in rule:
+        return not evaluate(rule['Not'], data)
+    if 'IsPresent' in rule:
+        return is_present(data, rule['Variable']) == rule['IsPresent']
+    value = get_path(data, rule['Variable'])
+    if 'IsNull' in rule:
+        return (value is None) == rule['IsNull']
+    for operator, (kind, compare) in COMPARISONS.items():
+        if operator in rule:
+            # A value of the wrong type doesn't match; booleans aren't numbers
+            if not isinstance(value, kind) or (kind != bool and isinstance(value, bool)):
+                return False
+            return compare(value, rule[operator])
+    raise NotImplementedError(f"Choice rule {rule} is not simulated")
+
+
+def load_definition(path, substitutions):
+    import yaml
+    with open(path) as f:
+        text = f.read()
+    return yaml.safe_load(re.sub(r'\$\{(\w+)\}', lambda m: substitutions[m.group(1)], text))
+
+
+def function_name(substitution):
+    # GetLatestFilesFunctionArn -> get_latest_files
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', substitution[:-len('FunctionArn')]).lower()
+
+
+class Simulator:
+    # Runs scenarios one after the other against one set of stand-ins, as if
+    # in one account and region, from one virtual clock. Faults listed in a
+    # scenario make the handler named fail with the given errors, one per
+    # invocation, before it runs normally.
+
+    def __init__(self, definition=DEFINITION):
+        for key, value in ENVIRONMENT.items():
+            os.environ.setdefault(key, value)
+        for path in (ROOT, FUNCTIONS):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+        from local.aws import AWS
+        from local.events import lifecycle_event
+
+        self._lifecycle_event = lifecycle_event
+        self.clock = VirtualClock()
+        self.aws = AWS(clock=self.clock).install()
+        self.aws.stepfunctions.on_start = lambda arn, data: self._started.append((arn, data))
+        self._started = []
+        self._faults = {}
+
+        with open(definition) as f:
+            names = sorted(set(re.findall(r'\$\{(\w+FunctionArn)\}', f.read())))
+        arns = {name: f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{function_name(name)}" for name in names}
+        self.handlers = {
+            function: importlib.import_module(f'{function}.app').lambda_handler
+            for function in [function_name(name) for name in names] + ['lifecycle_event']
+        }
+        resources = {arn: (function_name(name), partial(self._invoke, function_name(name))) for name, arn in arns.items()}
+        self.engine = Engine(load_definition(definition, arns), resources, self.clock)
+        # One state table for all functions, expiring items in virtual time
+        from common.store import SQLiteStore
+        store = SQLiteStore(clock=self.clock)
+        for function in self.handlers:
+            module = importlib.import_module(f'{function}.app')
+            if hasattr(module, 'STORE'):
+                module.STORE = store
+        self._jitter = importlib.import_module('analyse_and_decrement.app').RANDOM
+
+    def run(self, scenario):
+        from common import metrics
+        bucket_name = scenario['bucket_name']
+        s3 = self.aws.s3
+        marks = {service: len(getattr(self.aws, service).calls) for service in self.aws.SERVICES}
+        started = self.clock.now
+        self._faults = {name: list(errors) for name, errors in scenario.get('faults', {}).items()}
+        # Seeding the polling jitter per scenario makes the outcome independent
+        # of which scenarios ran before
+        if scenario.get('seed') is not None:
+            self._jitter.seed(scenario['seed'])
+
+        s3.create_bucket(Bucket=bucket_name)
+        own = Counter({'s3.create_bucket': 1})
+        self._put_next(bucket_name, iter(scenario['objects']), started, own)
+        if scenario.get('deleted_after') is not None:
+            self.clock.schedule(started + scenario['deleted_after'], partial(self._delete, bucket_name, own))
+
+        # The handlers print, and emit their metrics, as they would in Lambda
+        executions = []
+        invocations = self._invocations = Counter({'lifecycle_event': 1})
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), metrics.capture():
+            self.clock.advance(0)
+            self.handlers['lifecycle_event'](self._lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, bucket_name), None)
+            while self._started:
+                execution_arn, data = self._started.pop(0)
+                status = self.aws.stepfunctions.executions[execution_arn]
+                execution = self.engine.run(data, stopped=lambda: status['status'] == 'ABORTED')
+                status['status'] = execution['status']
+                invocations.update(execution['invocations'])
+                executions.append(execution)
+        self.clock.clear()
+
+        calls = Counter(
+            f"{service}.{call}"
+            for service, mark in marks.items()
+            for call in getattr(self.aws, service).calls[mark:]
+        ) - own
+        last = executions[-1] if executions else {}
+        report = {
+            'index': scenario.get('index'),
+            'name': scenario['name'],
+            'kind': scenario['kind'],
+            'status': last.get('status', 'NOT_STARTED'),
+            'verdict': last.get('output', {}).get('verdict'),
+            'error': last.get('error'),
+            'executions': len(executions),
+            'virtual_seconds': self.clock.now - started,
+            'transitions': sum(execution['transitions'] for execution in executions),
+            'invocations': dict(invocations),
+            'api_calls': dict(calls),
+        }
+        report['cost_usd'] = cost(report)
+        return report
+
+    def _invoke(self, function, event, context):
+        faults = self._faults.get(function)
+        if faults:
+            raise StatesError(faults.pop(0), 'Injected by the scenario')
+        return self.handlers[function](event, context)
+
+    def _put_next(self, bucket_name, objects, started, own, key=None):
+        # Puts the object due, if any, and schedules the next one. The objects
+        # are generated one at a time, as most are never reached.
+        if key is not None:
+            self.aws.s3.put_object(Bucket=bucket_name, Key=key)
+            own['s3.put_object'] += 1
+        following = next(objects, None)
+        if following:
+            offset, key = following
+            self.clock.schedule(started + offset, partial(self._put_next, bucket_name, objects, started, own, key))
+
+    def _delete(self, bucket_name, own):
+        # Followed by its DeleteBucket event, as CloudTrail would
+        self.aws.s3.delete_bucket(Bucket=bucket_name)
+        own['s3.delete_bucket'] += 1
+        self._invocations['lifecycle_event'] += 1
+        self.handlers['lifecycle_event'](self._lifecycle_event('DeleteBucket', ACCOUNT_ID, REGION, bucket_name), None)
+
+
+def cost(report):
+    s3_calls = {call[3:]: count for call, count in report['api_calls'].items() if call.startswith('s3.')}
+    return (
+        report['transitions'] * PRICES['transition']
+        + sum(report['invocations'].values()) * PRICES['invocation']
+        + sum(count for call, count in s3_calls.items() if call.startswith(('put_', 'list_'))) * PRICES['s3_write_or_list']
+        + sum(count for call, count in s3_calls.items() if not call.startswith(('put_', 'list_'))) * PRICES['s3_other']
+    )
+
+
+def alb_key(at):
+    moment = datetime.fromtimestamp(at, timezone.utc)
+    return (
+        f'AWSLogs/{ACCOUNT_ID}/elasticloadbalancing/{REGION}/{moment:%Y/%m/%d}/'
+        f'{ACCOUNT_ID}_elasticloadbalancing_{REGION}_app.my-alb.1234567890abcdef_{moment:%Y%m%dT%H%MZ}_10.0.0.1_{int(at) % 10 ** 8:08d}.log.gz'
+    )
+
+
+def cloudfront_key(at, rng):
+    moment = datetime.fromtimestamp(at, timezone.utc)
+    return f'cdn/E2QWRUHAPOMQZL.{moment:%Y-%m-%d-%H}.{rng.getrandbits(32):08X}.gz'
+
+
+def scenario(kind, index, seed, start):
+    # start is the virtual time the bucket is created at, which the log keys
+    # carry. The objects to put are generated as they fall due.
+    rng = random.Random(seed)
+    deleted_after = None
+    if kind == 'deleted':
+        deleted_after = rng.uniform(60, 7200)
+    elif kind not in KINDS:
+        raise ValueError(f"Unknown kind of scenario '{kind}'")
+    return {
+        'index': index,
+        'name': f'{kind}-{index}',
+        'kind': kind,
+        'bucket_name': f'sim-{kind.replace("_", "-")}-{index}',
+        'objects': objects(kind, start, rng),
+        'deleted_after': deleted_after,
+        'seed': seed,
+    }
+
+
+def objects(kind, start, rng):
+    # Yields (offset in seconds from creation, key) in time order, up to the
+    # horizon
+    if kind in ('alb', 'late_alb'):
+        first = rng.uniform(0, 600) if kind == 'alb' else rng.uniform(86400, 2 * 86400)
+        yield first, f'AWSLogs/{ACCOUNT_ID}/ELBAccessLogTestFile'
+        for offset in range(int(first) + 300, HORIZON_SECONDS, 300):
+            yield offset, alb_key(start + offset)
+    elif kind == 'cloudfront':
+        offset = rng.uniform(300, 3600)
+        while offset < HORIZON_SECONDS:
+            yield offset, cloudfront_key(start + offset, rng)
+            offset += rng.uniform(60, 900)
+    elif kind == 'data':
+        offset = rng.expovariate(1 / 1800)
+        count = 0
+        while offset < HORIZON_SECONDS:
+            yield offset, f'uploads/{count:06d}.csv'
+            count += 1
+            offset += rng.expovariate(1 / 1800)
+
+
+def simulate(jobs):
+    # Runs (kind, index, seed) scenarios on a simulator of its own, in a worker
+    # process or not
+    simulator = Simulator()
+    return [simulator.run(scenario(kind, index, seed, simulator.clock.now)) for kind, index, seed in jobs]
+
+
+def summarise(reports):
+    # Per kind of scenario: outcomes, and the mean work and cost per bucket
+    summary = {}
+    for kind in sorted({report['kind'] for report in reports}):
+        group = [report for report in reports if report['kind'] == kind]
+        count = len(group)
+        summary[kind] = {
+            'scenarios': count,
+            'statuses': dict(Counter(report['status'] for report in group)),
+            'verdicts': dict(Counter(str(report['verdict']) for report in group)),
+            'mean_hours': sum(report['virtual_seconds'] for report in group) / count / 3600,
+            'mean_transitions': sum(report['transitions'] for report in group) / count,
+            'mean_invocations': sum(sum(report['invocations'].values()) for report in group) / count,
+            'mean_api_calls': sum(sum(report['api_calls'].values()) for report in group) / count,
+            'cost_per_1000_usd': sum(report['cost_usd'] for report in group) / count * 1000,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', type=int, default=1000, help='The number of buckets to simulate')
+    parser.add_argument('--kind', action='append', choices=sorted(KINDS), help='Only simulate buckets of this kind (repeatable)')
+    parser.add_argument('--seed', type=int, default=0, help='Seeds the scenarios and the polling jitter')
+    parser.add_argument('--workers', type=int, default=1, help='Processes to spread the scenarios over')
+    parser.add_argument('--output', help='Write the summary and every scenario report to this JSON file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    kinds = args.kind or list(KINDS)
+    weights = [KINDS[kind] for kind in kinds]
+    jobs = [(rng.choices(kinds, weights)[0], index, rng.getrandbits(64)) for index in range(args.scenarios)]
+
+    started = perf_counter()
+    if args.workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            chunks = executor.map(simulate, [jobs[i::args.workers] for i in range(args.workers)])
+            reports = sorted((report for chunk in chunks for report in chunk), key=lambda report: report['index'])
+    else:
+        reports = simulate(jobs)
+    elapsed = perf_counter() - started
+
+    summary = summarise(reports)
+    print(f"{'kind':<12}{'buckets':>8}{'hours':>8}{'transitions':>13}{'invocations':>13}{'api calls':>11}{'$/1000':>9}   verdicts")
+    for kind, measured in summary.items():
+        verdicts = ', '.join(f"{verdict} {count}" for verdict, count in sorted(measured['verdicts'].items()))
+        print(
+            f"{kind:<12}{measured['scenarios']:>8}{measured['mean_hours']:>8.1f}{measured['mean_transitions']:>13.1f}"
+            f"{measured['mean_invocations']:>13.1f}{measured['mean_api_calls']:>11.1f}{measured['cost_per_1000_usd']:>9.3f}   {verdicts}"
+        )
+    total = sum(report['cost_usd'] for report in reports)
+    print(f"\n{len(reports)} buckets in {elapsed:.1f} s, ${total:.4f} in total, ${total / len(reports) * 1000:.3f} per 1000 buckets")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'summary': summary, 'scenarios': reports}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
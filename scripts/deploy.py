@@ -13,6 +13,8 @@ from botocore.exceptions import WaiterError
 import time
 import shutil
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 
 # Create an STS client
@@ -158,7 +160,7 @@ def dereference(value, params):
 # 
 # ---------------------------------------------------------------------------------------
 
-def process_sam(sam, repo_name, params, dry_run, verbose):
+def process_sam(sam, repo_name, params, dry_run, verbose, workers=1, continue_on_error=False, minimal_artifacts=False):
     printc(LIGHT_BLUE, "")
     printc(LIGHT_BLUE, "")
     printc(LIGHT_BLUE, "================================================")
@@ -176,6 +178,7 @@ def process_sam(sam, repo_name, params, dry_run, verbose):
     stack_name = sam['stack-name']
     capabilities = sam.get('capabilities', 'CAPABILITY_IAM')
     s3_prefix = sam.get('s3-prefix', stack_name)
+    minimal_artifacts = minimal_artifacts or sam.get('minimal-artifacts', False)
     tags = 'infra:immutable="true"'
 
     # Get the AWS SSO profile
@@ -188,10 +191,18 @@ def process_sam(sam, repo_name, params, dry_run, verbose):
         printc(LIGHT_BLUE, "Executing 'git pull'...")
         subprocess.run(['git', 'pull'], check=True)
 
+        args = ['sam', 'build', '--parallel', '--cached']
+
+        if minimal_artifacts:
+            # One artifact per function, holding only the modules it imports,
+            # built from the template the packaging tool writes
+            printc(LIGHT_BLUE, "")
+            printc(LIGHT_BLUE, f"Executing '{PACKAGE_FUNCTIONS}'...")
+            subprocess.run([sys.executable, PACKAGE_FUNCTIONS], stdout=None if verbose else subprocess.DEVNULL, check=True)
+            args += ['--template', MINIMAL_TEMPLATE]
+
         printc(LIGHT_BLUE, "")
         printc(LIGHT_BLUE, "Executing 'sam build'...")
-    
-        args = ['sam', 'build', '--parallel', '--cached']
 
         try:
             if verbose:
@@ -207,16 +218,7 @@ def process_sam(sam, repo_name, params, dry_run, verbose):
             # Retry the build command, always verbosely
             subprocess.run(args, check=True)
 
-        for region in sam_regions:
-            printc(LIGHT_BLUE, "")
-            printc(LIGHT_BLUE, "")
-            printc(LIGHT_BLUE, "------------------------------------------------")
-            printc(LIGHT_BLUE, "")
-            printc(LIGHT_BLUE, f"  Deploying {stack_name} to {region}...")
-            printc(LIGHT_BLUE, "")
-            printc(LIGHT_BLUE, "------------------------------------------------")
-            printc(LIGHT_BLUE, "")
-
+        def deploy_args(region):
             args = [
                     'sam', 'deploy', 
                     '--stack-name', stack_name,
@@ -233,14 +235,30 @@ def process_sam(sam, repo_name, params, dry_run, verbose):
             ]
             if dry_run:
                 args.append('--no-execute-changeset')
+            if verbose:
+                args.append('--debug')
+            return args
+
+        if workers > 1 and len(sam_regions) > 1:
+            deploy_regions_in_parallel(stack_name, sam_regions, deploy_args, workers, continue_on_error, dry_run)
+            return
+
+        for region in sam_regions:
+            printc(LIGHT_BLUE, "")
+            printc(LIGHT_BLUE, "")
+            printc(LIGHT_BLUE, "------------------------------------------------")
+            printc(LIGHT_BLUE, "")
+            printc(LIGHT_BLUE, f"  Deploying {stack_name} to {region}...")
+            printc(LIGHT_BLUE, "")
+            printc(LIGHT_BLUE, "------------------------------------------------")
+            printc(LIGHT_BLUE, "")
+
+            if dry_run:
                 printc(GREEN, "Executing 'sam deploy' with --no-execute-changeset...")
             else:
                 printc(LIGHT_BLUE, "Executing 'sam deploy'...")
 
-            if verbose:
-                args.append('--debug')
-                
-            subprocess.run(args, check=True)
+            subprocess.run(deploy_args(region), check=True)
 
             printc(GREEN, "")
             printc(GREEN + BOLD, "Deployment completed successfully.")
@@ -251,6 +269,164 @@ def process_sam(sam, repo_name, params, dry_run, verbose):
     printc(GREEN, "")
 
 
+# Used with --minimal-artifacts, or when the SAM section sets minimal-artifacts
+PACKAGE_FUNCTIONS = os.path.join('tools', 'package_functions.py')
+MINIMAL_TEMPLATE = 'template.minimal.yaml'
+
+# Where the output of each region's 'sam deploy' goes in parallel mode
+SAM_DEPLOY_LOG_DIR = os.path.join('.aws-sam', 'deploy-logs')
+
+STATUS_COLORS = {
+    'pending': GRAY,
+    'deploying': YELLOW,
+    'succeeded': GREEN,
+    'failed': RED,
+    'cancelled': GRAY,
+}
+
+
+def deploy_regions_in_parallel(stack_name, regions, deploy_args, workers, continue_on_error, dry_run):
+    """
+    Runs 'sam deploy' in up to the given number of regions at a time, each with its
+    output captured to a log file of its own, while a summary table of the regions
+    is kept up to date. Ends with a report of the outcome in each region.
+
+    Parameters:
+    - stack_name (str): Name of the SAM stack.
+    - regions (list): The regions to deploy to, started in this order.
+    - deploy_args (function): Returns the 'sam deploy' command line for a region.
+    - workers (int): The most regions deployed at a time.
+    - continue_on_error (bool): Whether to go on with the remaining regions after a
+      failure. If not, no further regions are started once one has failed; those
+      already deploying are left to finish, as stopping sam wouldn't stop CloudFormation.
+    """
+    os.makedirs(SAM_DEPLOY_LOG_DIR, exist_ok=True)
+    states = {
+        region: {
+            'status': 'pending',
+            'started': None,
+            'finished': None,
+            'last_line': '',
+            'log': os.path.join(SAM_DEPLOY_LOG_DIR, f"{stack_name}-{region}.log"),
+        }
+        for region in regions
+    }
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def deploy_region(region):
+        state = states[region]
+        with lock:
+            if stop.is_set():
+                state['status'] = 'cancelled'
+                return
+            state['status'] = 'deploying'
+            state['started'] = time.time()
+        try:
+            with open(state['log'], 'w') as log:
+                process = subprocess.Popen(deploy_args(region), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+                for line in process.stdout:
+                    log.write(line)
+                    log.flush()
+                    if line.strip():
+                        state['last_line'] = line.strip()
+                process.wait()
+        except OSError as e:
+            # sam couldn't be started, e.g. as it isn't installed, which fails the region like any other error
+            with lock:
+                state['finished'] = time.time()
+                state['status'] = 'failed'
+                state['last_line'] = f"'sam deploy' could not be run: {e}"
+                if not continue_on_error:
+                    stop.set()
+            return
+        with lock:
+            state['finished'] = time.time()
+            if process.returncode == 0:
+                state['status'] = 'succeeded'
+            else:
+                state['status'] = 'failed'
+                state['last_line'] = f"'sam deploy' exited with status {process.returncode}: {state['last_line']}"
+                if not continue_on_error:
+                    stop.set()
+
+    printc(LIGHT_BLUE, "")
+    mode = "with --no-execute-changeset " if dry_run else ""
+    printc(LIGHT_BLUE, f"Deploying {stack_name} {mode}to {len(regions)} regions, {workers} at a time. Logs are in {SAM_DEPLOY_LOG_DIR}.")
+    printc(LIGHT_BLUE, "")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(deploy_region, region) for region in regions]
+        table = SummaryTable(states, live=sys.stdout.isatty())
+        pending = futures
+        while pending:
+            _done, pending = wait(pending, timeout=1)
+            with lock:
+                table.draw()
+        with lock:
+            table.draw()
+        for future in futures:
+            # Errors other than those of running sam, which fail the region instead
+            try:
+                future.result()
+            except Exception as e:
+                printc(RED, f"An error occurred: {str(e)}")
+
+    # The final report
+    printc(LIGHT_BLUE, "")
+    printc(LIGHT_BLUE, "------------------------------------------------")
+    printc(LIGHT_BLUE, "")
+    for region, state in states.items():
+        log = state['log'] if state['started'] else ''
+        printc(STATUS_COLORS[state['status']], f"  {region:<16} {state['status']:<10} {format_elapsed(state):>6}  {log}")
+    printc(LIGHT_BLUE, "")
+
+    failed = [region for region, state in states.items() if state['status'] != 'succeeded']
+    if failed:
+        printc(RED, f"Deployment did not complete in {len(failed)} of {len(regions)} regions: {', '.join(failed)}.")
+        for region in failed:
+            if states[region]['status'] == 'failed':
+                printc(RED, f"  {region}: {states[region]['last_line']}")
+    else:
+        printc(GREEN + BOLD, f"Deployment completed successfully in all {len(regions)} regions.")
+
+
+class SummaryTable:
+    # One line per region, redrawn in place on a terminal. Elsewhere, such as
+    # in CI logs, a line is printed whenever the status of a region changes.
+
+    def __init__(self, states, live):
+        self.states = states
+        self.live = live
+        self.drawn = False
+        self.printed = {}
+
+    def draw(self):
+        if not self.live:
+            for region, state in self.states.items():
+                if self.printed.get(region) != state['status']:
+                    self.printed[region] = state['status']
+                    printc(STATUS_COLORS[state['status']], f"  {region:<16} {state['status']}")
+            return
+
+        width = shutil.get_terminal_size().columns
+        if self.drawn:
+            # Move up to the first line of the table
+            sys.stdout.write(f"\033[{len(self.states)}F")
+        for region, state in self.states.items():
+            line = f"  {region:<16} {state['status']:<10} {format_elapsed(state):>6}  {state['last_line']}"
+            printc(STATUS_COLORS[state['status']], line[:width - 1])
+        sys.stdout.flush()
+        self.drawn = True
+
+
+def format_elapsed(state):
+    if not state['started']:
+        return ''
+    seconds = int((state['finished'] or time.time()) - state['started'])
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
 
 # ---------------------------------------------------------------------------------------
 # 
@@ -1101,7 +1277,7 @@ def handle_stack_set(repo_name, stack_name, template_str, params, capabilities,
 # 
 # ---------------------------------------------------------------------------------------
 
-def deploy(dry_run, verbose):
+def deploy(dry_run, verbose, workers=1, continue_on_error=False, minimal_artifacts=False):
     # Check if 'config-deploy.toml' exists at the root of the repo
     if not os.path.exists('config-deploy.toml'):
         printc(RED, "Error: 'config-deploy.toml' is missing.")
@@ -1127,7 +1303,7 @@ def deploy(dry_run, verbose):
     # Decide what to do
     if sam:
         process_cloudformation(pre_sam, repo_name, params, cross_account_role, dry_run, verbose)
-        process_sam(sam, repo_name, params, dry_run, verbose)
+        process_sam(sam, repo_name, params, dry_run, verbose, workers, continue_on_error, minimal_artifacts)
         process_cloudformation(post_sam, repo_name, params, cross_account_role, dry_run, verbose)
 
     elif cf:
@@ -1148,12 +1324,18 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--dry-run', action='store_true', help='Perform a dry run of the deployments')
     parser.add_argument('--verbose', action='store_true', help='Verbose mode')
+    parser.add_argument('--parallel-regions', type=int, default=1, metavar='N',
+                        help='Deploy the SAM project to up to N regions at a time, logging each to a file (default: 1, one region after the other)')
+    parser.add_argument('--continue-on-error', action='store_true',
+                        help='With --parallel-regions, go on deploying the remaining regions after a region fails')
+    parser.add_argument('--minimal-artifacts', action='store_true',
+                        help='Build each function from a minimal artifact made by tools/package_functions.py')
     args = parser.parse_args()
 
     if args.dry_run:
         printc(GREEN, "\nThis is a dry run. No changes will be made.")
 
-    deploy(args.dry_run, args.verbose)
+    deploy(args.dry_run, args.verbose, args.parallel_regions, args.continue_on_error, args.minimal_artifacts)
 
 
 if __name__ == '__main__':
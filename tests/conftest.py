@@ -0,0 +1,79 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+for path in (ROOT, os.path.join(ROOT, 'functions')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# What the template passes to the functions, which some of them read at
+# import. The state table is left out so that the SQLite stand-in is used.
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'eu-north-1',
+    'CROSS_ACCOUNT_ROLE': 'AWSControlTowerExecution',
+    'LOG_ARCHIVE_ACCOUNT_ID': '111111111111',
+    'LOG_ARCHIVE_ACCOUNT_iD': '111111111111',
+    'STATE_MACHINE_ARN': 'arn:aws:states:eu-north-1:222222222222:stateMachine:MonitorBucketForLogs',
+    'REPLICATION_ROLE_NAME': 'replication-role',
+    'CLOUDFRONT_LOGS_BUCKET_NAME': 'cloudfront-logs',
+    'LOAD_BALANCER_LOGS_BUCKET_NAME': 'load-balancer-logs',
+}
+for key, value in ENVIRONMENT.items():
+    os.environ.setdefault(key, value)
+os.environ.pop('STATE_TABLE_NAME', None)
+
+# The account, region and bucket the tests are about, unless they say otherwise
+ACCOUNT_ID = '333333333333'
+REGION = 'eu-north-1'
+BUCKET = 'new-bucket'
+START = 1_700_000_000.0
+
+
+class Clock:
+    # Virtual time, moved on by the tests or by whatever sleeps on it
+
+    def __init__(self, now=START):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def datetime(self):
+        return datetime.fromtimestamp(self.now, timezone.utc)
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    # The local stand-ins, with the functions' clients routed to them for the
+    # duration of the test
+    from common import clients, credentials
+    from local.aws import AWS
+    monkeypatch.setattr(clients, 'new_session', clients.new_session)
+    monkeypatch.setattr(credentials, 'CACHE', credentials.CACHE)
+    yield AWS().install()
+    clients.reset()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def store(clock):
+    # The state table, on the virtual clock
+    from common.store import SQLiteStore
+    return SQLiteStore(clock=clock)
+
+
+def started(aws):
+    # The input of each execution started so far
+    return [execution['input'] for execution in aws.stepfunctions.executions.values()]
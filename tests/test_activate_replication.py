@@ -0,0 +1,220 @@
+import time
+import threading
+
+import pytest
+
+from activate_replication import app, configuration, graph
+from common.store import SQLiteStore
+from local.errors import ClientError
+from local.s3 import S3
+
+
+BUCKET = 'log-bucket'
+ROLE_ARN = 'arn:aws:iam::333333333333:role/replication-role'
+RULE = configuration.replication_rule('111111111111', 'load-balancer-logs')
+LATENCY = 0.05
+
+
+def s3_with_bucket(latency=0.0):
+    s3 = S3(latency=latency)
+    s3.create_bucket(Bucket=BUCKET)
+    s3.calls.clear()
+    return s3
+
+
+def failing(operation):
+    def fail(**_kwargs):
+        raise ClientError('AccessDenied', operation)
+    return fail
+
+
+def test_steps_wait_for_their_requirements():
+    order = []
+    lock = threading.Lock()
+
+    def step(name, seconds=0.0):
+        def run():
+            time.sleep(seconds)
+            with lock:
+                order.append(name)
+            return name
+        return run
+
+    results, errors = graph.run({'a': step('a', 0.05), 'b': step('b'), 'c': step('c')}, {'b': ['a']})
+    assert results == {'a': 'a', 'b': 'b', 'c': 'c'}
+    assert errors == {}
+    assert order.index('a') < order.index('b')
+    assert order[0] == 'c'
+
+
+def test_steps_requiring_a_failed_step_are_not_run():
+    ran = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    results, errors = graph.run({'a': fail, 'b': lambda: ran.append('b'), 'c': lambda: 'c'}, {'b': ['a']})
+    assert results == {'c': 'c'}
+    assert str(errors['a']) == 'boom'
+    assert str(errors['b']) == 'not run as a failed'
+    assert ran == []
+
+
+def test_circular_and_unknown_requirements():
+    results, errors = graph.run({'a': lambda: 1, 'b': lambda: 2}, {'a': ['b'], 'b': ['a']})
+    assert results == {}
+    assert set(errors) == {'a', 'b'}
+    with pytest.raises(ValueError):
+        graph.run({'a': lambda: 1}, {'a': ['z']})
+
+
+def test_chain_runs_in_order():
+    order = []
+    steps = {name: (lambda name=name: order.append(name)) for name in 'abcd'}
+    _results, errors = graph.run(steps, {'d': ['c'], 'c': ['b'], 'b': ['a']})
+    assert errors == {}
+    assert order == ['a', 'b', 'c', 'd']
+
+
+def test_failure_skips_the_steps_depending_on_it_in_turn():
+    def fail():
+        raise RuntimeError('boom')
+
+    results, errors = graph.run({'a': fail, 'b': lambda: 'b', 'c': lambda: 'c'}, {'b': ['a'], 'c': ['b']})
+    assert results == {}
+    assert str(errors['b']) == 'not run as a failed'
+    assert str(errors['c']) == 'not run as b failed'
+
+
+def test_pool_is_bounded():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def step():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    results, errors = graph.run({str(n): step for n in range(6)}, {}, max_workers=2)
+    assert len(results) == 6
+    assert errors == {}
+    assert max(peak) == 2
+
+
+@pytest.mark.parametrize('reconcile', [False, True])
+def test_replication_waits_for_versioning(reconcile):
+    s3 = s3_with_bucket()
+    changed = app.configure(s3, BUCKET, ROLE_ARN, RULE, reconcile)
+    assert changed == ['encryption', 'versioning', 'replication', 'lifecycle']
+    assert s3.calls.index('put_bucket_versioning') < s3.calls.index('put_bucket_replication')
+    assert s3.configuration(BUCKET, 'replication') == configuration.replication(ROLE_ARN, RULE)
+
+
+def test_compliant_bucket_is_only_read():
+    s3 = s3_with_bucket()
+    app.configure(s3, BUCKET, ROLE_ARN, RULE, True)
+    s3.calls.clear()
+    assert app.configure(s3, BUCKET, ROLE_ARN, RULE, True) == []
+    assert all(call.startswith('get_') for call in s3.calls)
+
+
+def test_failed_versioning_skips_replication():
+    s3 = s3_with_bucket()
+    s3.put_bucket_versioning = failing('PutBucketVersioning')
+    with pytest.raises(RuntimeError) as raised:
+        app.configure(s3, BUCKET, ROLE_ARN, RULE, False)
+    assert 'replication: not run as versioning failed' in str(raised.value)
+    assert 'put_bucket_replication' not in s3.calls
+    # The independent steps still ran
+    assert s3.configuration(BUCKET, 'encryption') == configuration.encryption()
+    assert s3.configuration(BUCKET, 'lifecycle') == configuration.lifecycle()
+
+
+def test_errors_are_reported_together():
+    s3 = s3_with_bucket()
+    s3.put_bucket_encryption = failing('PutBucketEncryption')
+    s3.put_bucket_lifecycle_configuration = failing('PutBucketLifecycleConfiguration')
+    with pytest.raises(RuntimeError) as raised:
+        app.configure(s3, BUCKET, ROLE_ARN, RULE, False)
+    message = str(raised.value)
+    assert message.startswith(f"Configuring {BUCKET} failed: encryption: ")
+    assert '; lifecycle: ' in message
+    assert 'PutBucketLifecycleConfiguration' in message
+    assert 'replication' not in message
+    assert s3.configuration(BUCKET, 'replication') == configuration.replication(ROLE_ARN, RULE)
+
+
+@pytest.mark.parametrize('reconcile, calls', [(False, 4), (True, 8)])
+def test_steps_overlap(reconcile, calls):
+    # Serially, every call would add its latency; concurrently, only those on
+    # the longest chain do: versioning then replication, each read then
+    # written in reconcile mode
+    s3 = s3_with_bucket(LATENCY)
+    started = time.perf_counter()
+    app.configure(s3, BUCKET, ROLE_ARN, RULE, reconcile)
+    elapsed = time.perf_counter() - started
+    assert len(s3.calls) == calls
+    assert elapsed < calls * LATENCY * 0.75
+
+
+@pytest.fixture
+def batch(aws, monkeypatch):
+    monkeypatch.setattr(app, 'STORE', SQLiteStore())
+    for name in ('a', 'b', 'c'):
+        aws.s3.create_bucket(Bucket=name)
+    return aws
+
+
+def test_batch_assumes_the_role_once_per_account_and_region(batch):
+    buckets = app.activate_buckets([
+        ['333333333333', 'eu-north-1', 'a', 'elb'],
+        ['333333333333', 'eu-north-1', 'b', 'cloudfront'],
+        {'account_id': '333333333333', 'region': 'eu-west-1', 'bucket_name': 'c', 'verdict': 'elb'},
+    ])
+    assert [bucket['bucket_name'] for bucket in buckets] == ['a', 'b', 'c']
+    assert all(bucket['changed'] for bucket in buckets)
+    assert batch.sts.calls == ['assume_role', 'assume_role']
+    assert batch.s3.configuration('b', 'replication')['Rules'][0]['Destination']['Bucket'].endswith('cloudfront-logs')
+
+
+def test_batch_failures_stay_with_their_buckets(batch, monkeypatch):
+    get_client = app.get_client
+
+    def unassumable(client_type, account_id, region):
+        if region == 'eu-west-1':
+            raise RuntimeError('AccessDenied')
+        return get_client(client_type, account_id, region)
+
+    monkeypatch.setattr(app, 'get_client', unassumable)
+    a, gone, c = app.activate_buckets([
+        ['333333333333', 'eu-north-1', 'a', 'elb'],
+        ['333333333333', 'eu-north-1', 'gone', 'elb'],
+        ['333333333333', 'eu-west-1', 'c', 'elb'],
+    ])
+    assert 'replication_error' not in a
+    assert 'NoSuchBucket' in gone['replication_error']
+    assert c['replication_error'] == 'AccessDenied'
+
+
+def test_batch_concurrency_is_bounded(batch, monkeypatch):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def replicate(bucket, _client):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+        return {'changed': []}
+
+    monkeypatch.setattr(app, 'BATCH_CONCURRENCY', 3)
+    monkeypatch.setattr(app, 'replicate', replicate)
+    app.activate_buckets([['333333333333', 'eu-north-1', f'bucket-{n}', 'elb'] for n in range(9)])
+    assert max(peak) == 3
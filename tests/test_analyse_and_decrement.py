@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from analyse_and_decrement import app
+
+
+INITIAL = 60
+MULTIPLIER = 2
+MAXIMUM = 900
+JITTER = 0.2
+ALB_KEY = (
+    'AWSLogs/333333333333/elasticloadbalancing/eu-north-1/2024/03/01/'
+    '333333333333_elasticloadbalancing_eu-north-1_app.my-alb.1234567890abcdef_20240301T1200Z_10.0.0.1_{:08d}.log.gz'
+)
+
+
+@pytest.fixture
+def schedule(monkeypatch):
+    monkeypatch.setattr(app, 'POLL_INITIAL_SECONDS', INITIAL)
+    monkeypatch.setattr(app, 'POLL_MULTIPLIER', MULTIPLIER)
+    monkeypatch.setattr(app, 'POLL_MAX_SECONDS', MAXIMUM)
+    monkeypatch.setattr(app, 'POLL_JITTER', JITTER)
+    monkeypatch.setattr(app, 'RANDOM', random.Random(42))
+
+
+@pytest.mark.parametrize('quiet_polls', range(8))
+def test_wait_stays_within_the_jitter(schedule, quiet_polls):
+    base = INITIAL * MULTIPLIER ** quiet_polls
+    for _ in range(200):
+        wait = app.next_wait(quiet_polls)
+        assert min(MAXIMUM, int(base * (1 - JITTER))) <= wait <= min(MAXIMUM, base * (1 + JITTER))
+
+
+def test_wait_is_capped(schedule):
+    assert {app.next_wait(quiet_polls) for quiet_polls in range(4, 40)} == {MAXIMUM}
+
+
+def test_wait_grows_until_the_cap(schedule):
+    # The jitter is narrower than the growth, so waits never shrink
+    for _ in range(50):
+        waits = [app.next_wait(quiet_polls) for quiet_polls in range(8)]
+        assert waits == sorted(waits)
+        assert waits[0] < waits[3] < MAXIMUM == waits[-1]
+
+
+def test_wait_without_jitter(schedule, monkeypatch):
+    monkeypatch.setattr(app, 'POLL_JITTER', 0)
+    assert [app.next_wait(quiet_polls) for quiet_polls in range(6)] == [60, 120, 240, 480, 900, 900]
+
+
+def test_wait_is_at_least_a_second(schedule, monkeypatch):
+    monkeypatch.setattr(app, 'POLL_INITIAL_SECONDS', 0)
+    assert app.next_wait(0) == 1
+
+
+def test_new_log_files_reset_the_backoff(schedule, monkeypatch):
+    monkeypatch.setattr(app, 'POLL_JITTER', 0)
+    data = {'bucket_name': 'new-bucket', 'counter': 200, 'listing': {'files': []}}
+    for expected in (60, 120, 240):
+        data = app.analyse(data)
+        assert data['wait_seconds'] == expected
+    data['listing'] = {'files': [ALB_KEY.format(0)]}
+    data = app.analyse(data)
+    assert data['quiet_polls'] == 0
+    assert data['wait_seconds'] == INITIAL
+    # The same log file again is no news
+    data = app.analyse(data)
+    assert data['wait_seconds'] == 2 * INITIAL
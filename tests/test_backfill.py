@@ -0,0 +1,152 @@
+import argparse
+
+import pytest
+
+from activate_replication import app as activate_replication
+from common.credentials import CredentialCache
+from common.store import SQLiteStore, bucket_id
+from conftest import ACCOUNT_ID, Clock
+from tools import backfill
+
+
+ALB_KEY = (
+    f'AWSLogs/{ACCOUNT_ID}/elasticloadbalancing/eu-north-1/2024/03/01/'
+    f'{ACCOUNT_ID}_elasticloadbalancing_eu-north-1_app.my-alb.1234567890abcdef_20240301T1200Z_10.0.0.1_{{:08d}}.log.gz'
+)
+
+
+def arguments(**changes):
+    args = dict(
+        function=None, role='AWSControlTowerExecution', accounts=[ACCOUNT_ID], exclude=None, regions=None,
+        account_concurrency=2, bucket_concurrency=2, files=10, sample_keys=1000, sample_pages=1, activation_batch=2,
+    )
+    args.update(changes)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def fleet(aws, monkeypatch):
+    monkeypatch.setattr(activate_replication, 'STORE', SQLiteStore())
+    s3 = aws.s3
+    for name in ('alb-1', 'alb-2', 'alb-3'):
+        s3.create_bucket(Bucket=name, CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'})
+        for n in range(10):
+            s3.put_object(Bucket=name, Key=ALB_KEY.format(n))
+    s3.create_bucket(Bucket='data')
+    for n in range(10):
+        s3.put_object(Bucket='data', Key=f'uploads/{n}.csv')
+    return aws
+
+
+def run(aws, store, invoke=None, **changes):
+    cache = CredentialCache(sts_client=aws.sts, session_factory=aws.session)
+    job = backfill.Backfill(arguments(**changes), store, backfill.RateLimiter(10000), cache)
+    if invoke:
+        job.invoke = invoke
+    counts = job.run()
+    return job, counts
+
+
+def activate(payload):
+    # ActivateReplication, invoked in-process
+    return activate_replication.lambda_handler(payload, None)
+
+
+def statuses(store):
+    return {checkpoint['bucket_name']: checkpoint['status'] for _id, checkpoint in store.items(backfill.BUCKET)}
+
+
+def test_rate_limiter_allows_bursts_then_waits():
+    clock = Clock(0.0)
+    # A rate whose interval is exact in binary, so that virtual time adds up
+    limiter = backfill.RateLimiter(8, burst=4, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        limiter.acquire()
+    assert clock.slept == []
+    for _ in range(8):
+        limiter.acquire()
+    # The rest at the rate, an eighth of a second apart
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_limited_acquires_before_each_page():
+    clock = Clock(0.0)
+    limiter = backfill.RateLimiter(1, burst=1, clock=clock, sleep=clock.sleep)
+    assert list(backfill.limited(iter(['a', 'b', 'c']), limiter)) == ['a', 'b', 'c']
+    # One more for finding the pages exhausted
+    assert clock.now == pytest.approx(3.0)
+
+
+def test_dry_run_classifies_only(fleet):
+    store = SQLiteStore()
+    _job, counts = run(fleet, store)
+    assert statuses(store) == {'alb-1': 'classified', 'alb-2': 'classified', 'alb-3': 'classified', 'data': 'skipped'}
+    assert counts['verdict elb'] == 3
+    assert 'put_bucket_replication' not in fleet.s3.calls
+    # Not done until the log buckets are activated
+    assert list(store.items(backfill.ACCOUNT)) == []
+
+
+def test_regions_filter(fleet):
+    store = SQLiteStore()
+    run(fleet, store, regions=['us-east-1'])
+    assert statuses(store) == {'data': 'skipped'}
+
+
+def test_log_buckets_are_activated_in_batches(fleet):
+    store = SQLiteStore()
+    payloads = []
+
+    def invoke(payload):
+        payloads.append(payload)
+        return activate(payload)
+
+    _job, counts = run(fleet, store, invoke, function='ActivateReplication')
+    assert [len(payload['buckets']) for payload in payloads] == [2, 1]
+    assert payloads[0]['buckets'][0] == [ACCOUNT_ID, 'eu-north-1', 'alb-1', 'elb']
+    assert counts['activated'] == 3
+    assert fleet.s3.configuration('alb-1', 'replication') is not None
+    assert [id for id, _checkpoint in store.items(backfill.ACCOUNT)] == [ACCOUNT_ID]
+
+
+def test_resume_retries_what_failed(fleet):
+    store = SQLiteStore()
+
+    def unavailable(_payload):
+        raise RuntimeError('Rate exceeded')
+
+    _job, counts = run(fleet, store, unavailable, function='ActivateReplication')
+    assert counts['activation_errors'] == 3
+    assert set(statuses(store).values()) == {'activation_failed', 'skipped'}
+    assert list(store.items(backfill.ACCOUNT)) == []
+
+    listed = fleet.s3.calls.count('list_objects_v2')
+    _job, counts = run(fleet, store, activate, function='ActivateReplication')
+    assert counts['activated'] == 3
+    # Buckets already classified aren't sampled again
+    assert fleet.s3.calls.count('list_objects_v2') == listed
+
+    # Nor is a finished account scanned again
+    calls = len(fleet.s3.calls)
+    _job, counts = run(fleet, store, activate, function='ActivateReplication')
+    assert len(fleet.s3.calls) == calls
+    assert counts['accounts'] == 0
+
+
+def test_buckets_which_could_not_be_sampled_are_sampled_again(fleet, monkeypatch):
+    store = SQLiteStore()
+    list_objects_v2 = fleet.s3.list_objects_v2
+
+    def failing(Bucket, **kwargs):
+        if Bucket == 'alb-2':
+            raise RuntimeError('AccessDenied')
+        return list_objects_v2(Bucket=Bucket, **kwargs)
+
+    monkeypatch.setattr(fleet.s3, 'list_objects_v2', failing)
+    run(fleet, store)
+    assert statuses(store)['alb-2'] == 'classification_failed'
+
+    monkeypatch.setattr(fleet.s3, 'list_objects_v2', list_objects_v2)
+    run(fleet, store)
+    assert statuses(store)['alb-2'] == 'classified'
+    assert store.get(backfill.BUCKET, bucket_id(ACCOUNT_ID, 'eu-north-1', 'alb-2'))['verdict'] == 'elb'
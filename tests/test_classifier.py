@@ -0,0 +1,137 @@
+import pytest
+
+from analyse_and_decrement import app
+from analyse_and_decrement.classifier import LogFormatRegistry, REGISTRY, verdict
+
+
+ACCOUNT_ID = '123456789012'
+SAMPLES = {
+    'cloudfront': 'cf-logs/E2EXAMPLE1ABCD.2024-03-01-12.A1B2C3D4E5.gz',
+    'elb_test_file': 'lb-logs/AWSLogs/123456789012/ELBAccessLogTestFile',
+    'alb': 'AWSLogs/123456789012/elasticloadbalancing/eu-north-1/2024/03/01/'
+           '123456789012_elasticloadbalancing_eu-north-1_app.my-alb.1234567890abcdef_20240301T1200Z_10.0.0.1_5x9kq2lp.log.gz',
+    'nlb': 'AWSLogs/123456789012/elasticloadbalancing/eu-north-1/2024/03/01/'
+           '123456789012_elasticloadbalancing_eu-north-1_net.my-nlb.1234567890abcdef_20240301T1200Z_2a46f1b3.log.gz',
+    'classic_elb': 'AWSLogs/123456789012/elasticloadbalancing/eu-north-1/2024/03/01/'
+                   '123456789012_elasticloadbalancing_eu-north-1_my-elb_20240301T1200Z_10.0.0.1_20sg8hgm.log',
+    'vpc_flow': 'AWSLogs/123456789012/vpcflowlogs/eu-north-1/2024/03/01/'
+                '123456789012_vpcflowlogs_eu-north-1_fl-1234abcd_20240301T1200Z_fe123456.log.gz',
+    'cloudtrail': 'AWSLogs/o-abc123/123456789012/CloudTrail/eu-north-1/2024/03/01/'
+                  '123456789012_CloudTrail_eu-north-1_20240301T1200Z_Mu0KsOhtH1ar15ZZ.json.gz',
+    'waf': 'AWSLogs/123456789012/WAFLogs/eu-north-1/my-acl/2024/03/01/12/00/'
+           '123456789012_waflogs_eu-north-1_my-acl_20240301T1200Z_abcd1234.log.gz',
+    's3_access': 'access-logs/2024-03-01-12-34-56-0123456789ABCDEF',
+}
+OTHER = [
+    'uploads/2024/03/invoice-0001.pdf',
+    'backup.tar.gz',
+    'AWSLogs/not-an-account/elasticloadbalancing.txt',
+    'reports/2024-03-01.log',
+]
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_classify(name):
+    assert REGISTRY.classify(SAMPLES[name]) == name
+    assert REGISTRY.classify(f"prefix/{SAMPLES[name]}") == name
+
+
+@pytest.mark.parametrize('key', OTHER)
+def test_classify_other(key):
+    assert REGISTRY.classify(key) is None
+
+
+def test_bulk_count_agrees_with_classify():
+    keys = [f"{i}/{key}" for i in range(50) for key in list(SAMPLES.values()) + OTHER]
+    counts, other = REGISTRY.count(keys)
+    expected = dict.fromkeys(REGISTRY.names, 0)
+    for key in keys:
+        name = REGISTRY.classify(key)
+        if name:
+            expected[name] += 1
+    assert counts == expected
+    assert other == 50 * len(OTHER)
+
+
+def test_count_accepts_iterables():
+    counts, other = REGISTRY.count(iter(SAMPLES.values()))
+    assert set(counts.values()) == {1}
+    assert other == 0
+
+
+def test_unsuffixed_formats_see_all_keys():
+    registry = LogFormatRegistry()
+    registry.register('gz', r'.*\.gz', 'logs', suffixes=['.gz'])
+    registry.register('dated', r'\d{4}-\d{2}-\d{2}.*')
+    counts, other = registry.count(['a.gz', '2024-03-01.gz', '2024-03-01.txt', 'b.txt'])
+    # Registration order decides between formats which both match
+    assert counts == {'gz': 2, 'dated': 1}
+    assert other == 1
+
+
+def test_empty_registry():
+    assert LogFormatRegistry().count(['a', 'b']) == ({}, 2)
+
+
+def test_capturing_groups_are_refused():
+    with pytest.raises(ValueError):
+        LogFormatRegistry().register('bad', r'(a|b)\.log')
+
+
+def test_summarise():
+    keys = [SAMPLES['alb']] * 3 + [SAMPLES['vpc_flow']] + OTHER[:1]
+    summary = REGISTRY.summarise(keys)
+    assert summary['elb_logs'] == 3
+    assert summary['cloudfront_logs'] == 0
+    # Logs of formats which aren't replicated count as other files
+    assert summary['other_files'] == 2
+    assert summary['format_counts']['vpc_flow'] == 1
+    assert summary['verdict'] == 'elb'
+
+
+@pytest.mark.parametrize('counts, expected', [
+    ((1, 1, 0), 'unusable'),
+    ((0, 0, 6), 'unusable'),
+    ((0, 0, 5), 'undecided'),
+    ((3, 0, 2), 'cloudfront'),
+    ((0, 3, 2), 'elb'),
+    ((0, 2, 2), 'undecided'),
+])
+def test_verdict(counts, expected):
+    assert verdict(*counts) == expected
+
+
+@pytest.mark.parametrize('name, family', [
+    ('cloudfront', 'cloudfront'),
+    ('alb', 'elb'),
+    ('nlb', 'elb'),
+    ('classic_elb', 'elb'),
+    ('elb_test_file', 'elb'),
+    ('vpc_flow', None),
+    ('s3_access', None),
+])
+def test_families(name, family):
+    assert REGISTRY.family(name) == family
+
+
+def test_family_counts():
+    counts, _other = REGISTRY.count([SAMPLES['alb'], SAMPLES['classic_elb'], SAMPLES['cloudfront'], SAMPLES['waf']])
+    assert REGISTRY.family_counts(counts) == {'elb': 2, 'cloudfront': 1, None: 1}
+
+
+def test_registering_a_name_again_replaces_the_format():
+    registry = LogFormatRegistry()
+    registry.register('logs', r'.*\.log')
+    registry.register('logs', r'.*\.txt', 'text')
+    assert registry.names == ['logs']
+    assert registry.classify('a.txt') == 'logs'
+    assert registry.classify('a.log') is None
+    assert registry.family('logs') == 'text'
+
+
+def test_analyse_reports_format_counts():
+    data = app.analyse({'counter': 200, 'listing': {'files': [SAMPLES['nlb'], SAMPLES['alb'], OTHER[0]]}})
+    assert data['verdict'] == 'elb'
+    assert data['elb_logs'] == 2
+    assert data['other_files'] == 1
+    assert data['format_counts']['nlb'] == data['format_counts']['alb'] == 1
@@ -0,0 +1,56 @@
+from benchmarks import cold_start
+
+
+STDERR = '\n'.join([
+    'import time: self [us] | cumulative | imported package',
+    'import time:       100 |        100 | zipimport',
+    cold_start.MARKERS[0],
+    'import time:       500 |        500 |   botocore.config',
+    'import time:      2000 |      12000 | boto3',
+    'import time:       300 |        300 |     json.decoder',
+    'import time:       700 |       1500 | common.store',
+    cold_start.MARKERS[1],
+    'import time:       900 |        900 | sqlite3',
+])
+
+
+def test_top_level_imports_are_those_between_the_markers():
+    imports = cold_start.top_level_imports(STDERR, *cold_start.MARKERS[:2])
+    assert imports == {'boto3': 12.0, 'common.store': 1.5}
+    assert cold_start.heaviest(imports, count=1) == {'boto3': 12.0}
+
+
+def results(**cold_starts):
+    return {handler: {'cold_start_ms': ms} for handler, ms in cold_starts.items()}
+
+
+def test_regressions_beyond_the_tolerance_and_the_noise():
+    baseline = results(a=100.0, b=100.0, c=10.0)
+    found = cold_start.regressions(results(a=130.0, b=120.0, c=14.0, new=500.0), baseline, 0.25)
+    # b is within the tolerance, c within the noise, and new has no baseline
+    assert found == ['a: cold start 130.0 ms, was 100.0 ms']
+
+
+def test_every_handler_is_found():
+    assert cold_start.handlers_in(cold_start.FUNCTIONS) == [
+        'activate_replication',
+        'analyse_and_decrement',
+        'create_incident',
+        'get_latest_files',
+        'lifecycle_event',
+        'object_created',
+        'pending_buckets',
+    ]
+
+
+def test_a_revision_is_exported_without_the_working_tree(tmp_path):
+    functions = cold_start.export('HEAD', str(tmp_path))
+    assert cold_start.handlers_in(functions) == cold_start.handlers_in(cold_start.FUNCTIONS)
+
+
+def test_handlers_are_profiled_against_the_stand_ins():
+    # One fresh interpreter, a cold call and a warm one
+    measured = cold_start.measure('pending_buckets', runs=1, calls=2)
+    assert measured['cold_start_ms'] == measured['import_ms'] + measured['first_call_ms']
+    assert measured['warm_call_ms'] > 0
+    assert any(name.startswith('common') for name in measured['heaviest_imports_ms'])
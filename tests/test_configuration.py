@@ -0,0 +1,121 @@
+import pytest
+
+from activate_replication import app, configuration
+from common.store import SQLiteStore
+from local.s3 import S3
+
+
+BUCKET = 'log-bucket'
+ROLE_ARN = 'arn:aws:iam::333333333333:role/replication-role'
+OTHER_ROLE_ARN = 'arn:aws:iam::333333333333:role/their-own-role'
+RULE = configuration.replication_rule('111111111111', 'load-balancer-logs')
+
+
+def their_rule(**changes):
+    rule = {
+        'ID': 'TheirBackup',
+        'Status': 'Enabled',
+        'Priority': 3,
+        'Filter': {'Prefix': 'important/'},
+        'DeleteMarkerReplication': {'Status': 'Disabled'},
+        'Destination': {'Bucket': 'arn:aws:s3:::their-backup'},
+    }
+    rule.update(changes)
+    return rule
+
+
+def v1_rule():
+    return {
+        'ID': 'TheirOldBackup',
+        'Status': 'Enabled',
+        'Prefix': 'important/',
+        'Destination': {'Bucket': 'arn:aws:s3:::their-backup'},
+    }
+
+
+@pytest.fixture
+def s3():
+    s3 = S3()
+    s3.create_bucket(Bucket=BUCKET)
+    s3.put_bucket_versioning(Bucket=BUCKET, VersioningConfiguration={'Status': 'Enabled'})
+    return s3
+
+
+def replicating(s3, role_arn, rules):
+    s3.put_bucket_replication(Bucket=BUCKET, ReplicationConfiguration={'Role': role_arn, 'Rules': rules})
+
+
+def test_no_replication(s3):
+    assert configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE) == configuration.replication(ROLE_ARN, RULE)
+
+
+def test_already_replicating(s3):
+    replicating(s3, ROLE_ARN, [their_rule(), dict(RULE, Priority=4)])
+    assert configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE) is None
+
+
+def test_their_rules_are_kept(s3):
+    replicating(s3, ROLE_ARN, [their_rule()])
+    change = configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE)
+    assert change == {'Role': ROLE_ARN, 'Rules': [their_rule(), dict(RULE, Priority=4)]}
+
+
+def test_our_outdated_rule_is_replaced(s3):
+    outdated = dict(RULE, Destination=dict(RULE['Destination'], StorageClass='GLACIER'))
+    replicating(s3, ROLE_ARN, [their_rule(), outdated])
+    change = configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE)
+    assert change['Rules'] == [their_rule(), dict(RULE, Priority=4)]
+
+
+def test_role_of_our_rules_only_is_replaced(s3):
+    replicating(s3, OTHER_ROLE_ARN, [dict(RULE, Priority=1)])
+    assert configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE) == {'Role': ROLE_ARN, 'Rules': [RULE]}
+
+
+def test_role_of_their_rules_is_not_replaced(s3):
+    replicating(s3, OTHER_ROLE_ARN, [their_rule()])
+    with pytest.raises(ValueError, match='their-own-role'):
+        configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE)
+
+
+def test_older_schema_is_not_mixed_with_ours(s3):
+    replicating(s3, ROLE_ARN, [v1_rule()])
+    with pytest.raises(ValueError, match='older schema'):
+        configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE)
+
+
+def test_our_rule_of_the_older_schema_still_covers(s3):
+    ours = {k: v for k, v in RULE.items() if k not in ('Priority', 'Filter')}
+    replicating(s3, ROLE_ARN, [dict(ours, Prefix='')])
+    assert configuration.replication_change(s3, BUCKET, ROLE_ARN, RULE) is None
+
+
+def test_lifecycle_rules_are_kept(s3):
+    theirs = {'ID': 'TheirExpiry', 'Status': 'Enabled', 'Filter': {'Prefix': 'tmp/'}, 'Expiration': {'Days': 1}}
+    s3.put_bucket_lifecycle_configuration(Bucket=BUCKET, LifecycleConfiguration={'Rules': [theirs]})
+    rule = configuration.expiration_rule()
+    assert configuration.lifecycle_change(s3, BUCKET, rule) == {'Rules': [theirs, rule]}
+    # An earlier expiry of the whole bucket is enough
+    whole = dict(theirs, Filter={}, Expiration={'Days': 7})
+    s3.put_bucket_lifecycle_configuration(Bucket=BUCKET, LifecycleConfiguration={'Rules': [whole]})
+    assert configuration.lifecycle_change(s3, BUCKET, rule) is None
+
+
+def test_conflict_is_reported_and_nothing_else_held_up(aws, monkeypatch):
+    monkeypatch.setattr(app, 'CONFIGURATION_MODE', 'reconcile')
+    monkeypatch.setattr(app, 'STORE', SQLiteStore())
+    for name in ('theirs', 'ours'):
+        aws.s3.create_bucket(Bucket=name)
+        aws.s3.put_bucket_versioning(Bucket=name, VersioningConfiguration={'Status': 'Enabled'})
+    aws.s3.put_bucket_replication(Bucket='theirs', ReplicationConfiguration={'Role': OTHER_ROLE_ARN, 'Rules': [their_rule()]})
+
+    theirs, ours = app.activate_buckets([
+        ['333333333333', 'eu-north-1', 'theirs', 'elb'],
+        ['333333333333', 'eu-north-1', 'ours', 'elb'],
+    ])
+    assert 'conflicts' in theirs['replication_error']
+    assert aws.s3.configuration('theirs', 'replication') == {'Role': OTHER_ROLE_ARN, 'Rules': [their_rule()]}
+    # The other steps still ran
+    assert aws.s3.configuration('theirs', 'lifecycle') == configuration.lifecycle()
+    assert 'replication_error' not in ours
+    assert 'replication' in ours['changed']
@@ -0,0 +1,186 @@
+import pytest
+
+from conftest import ACCOUNT_ID, REGION, Clock
+from create_incident import app
+from create_incident.findings import FindingBuffer, RecentIds, MAX_ATTEMPTS, MAX_BATCH
+from local.aws import SecurityHub
+from local.errors import ClientError
+
+
+class FlakySecurityHub(SecurityHub):
+    # Rejects the findings in reject for as many imports as given, and fails
+    # the first calls outright if told to
+
+    def __init__(self, reject=None, failed_calls=0):
+        super().__init__()
+        self.reject = dict(reject or {})
+        self.failed_calls = failed_calls
+        self.batches = []
+
+    def batch_import_findings(self, Findings):
+        self.batches.append([finding['Id'] for finding in Findings])
+        if self.failed_calls:
+            self.failed_calls -= 1
+            raise ClientError('ThrottlingException', 'BatchImportFindings')
+        rejected = [finding for finding in Findings if self.reject.get(finding['Id'])]
+        for finding in rejected:
+            self.reject[finding['Id']] -= 1
+        response = super().batch_import_findings([finding for finding in Findings if finding not in rejected])
+        response['FailedFindings'] = [
+            {'Id': finding['Id'], 'ErrorCode': 'InvalidInput', 'ErrorMessage': 'Rejected'} for finding in rejected
+        ]
+        return response
+
+
+def bucket(name, verdict='elb', account_id=ACCOUNT_ID, region=REGION):
+    return {'account_id': account_id, 'region': region, 'bucket_name': name, 'verdict': verdict}
+
+
+def finding(name, **kwargs):
+    return app.build_finding(bucket(name, **kwargs))
+
+
+def buffer_for(hub, clock=None, recent=None, max_age=5.0):
+    clock = clock or Clock()
+    return FindingBuffer(lambda _account_id, _region: hub, max_age=max_age, recent=recent, clock=clock, sleep=clock.sleep)
+
+
+def test_only_failed_findings_are_retried():
+    hub = FlakySecurityHub(reject={finding('b')['Id']: 1})
+    clock = Clock()
+    buffer = buffer_for(hub, clock)
+    for name in ('a', 'b', 'c'):
+        buffer.add(ACCOUNT_ID, REGION, finding(name))
+    results = buffer.flush()
+    assert hub.batches == [[finding(name)['Id'] for name in 'abc'], [finding('b')['Id']]]
+    assert set(results.values()) == {None}
+    assert clock.slept == [0.5]
+    assert buffer.calls == 2
+
+
+def test_findings_failing_every_attempt_keep_the_error():
+    hub = FlakySecurityHub(reject={finding('b')['Id']: MAX_ATTEMPTS})
+    buffer = buffer_for(hub)
+    buffer.add(ACCOUNT_ID, REGION, finding('a'))
+    buffer.add(ACCOUNT_ID, REGION, finding('b'))
+    results = buffer.flush()
+    assert len(hub.batches) == MAX_ATTEMPTS
+    assert results[finding('a')['Id']] is None
+    assert results[finding('b')['Id']] == 'InvalidInput: Rejected'
+
+
+def test_failed_calls_are_retried_whole():
+    hub = FlakySecurityHub(failed_calls=MAX_ATTEMPTS)
+    buffer = buffer_for(hub)
+    buffer.add(ACCOUNT_ID, REGION, finding('a'))
+    results = buffer.flush()
+    assert isinstance(results[finding('a')['Id']], ClientError)
+    assert hub.findings == {}
+
+    hub = FlakySecurityHub(failed_calls=1)
+    buffer = buffer_for(hub)
+    buffer.add(ACCOUNT_ID, REGION, finding('a'))
+    assert buffer.flush() == {finding('a')['Id']: None}
+
+
+def test_findings_are_grouped_and_batched():
+    hubs = {}
+    buffer = FindingBuffer(lambda account_id, region: hubs.setdefault((account_id, region), FlakySecurityHub()))
+    for n in range(MAX_BATCH + 1):
+        buffer.add(ACCOUNT_ID, REGION, finding(f"bucket-{n}"))
+    buffer.add(ACCOUNT_ID, 'eu-west-1', finding('other', region='eu-west-1'))
+    buffer.flush()
+    assert [len(batch) for batch in hubs[(ACCOUNT_ID, REGION)].batches] == [MAX_BATCH, 1]
+    assert [len(batch) for batch in hubs[(ACCOUNT_ID, 'eu-west-1')].batches] == [1]
+
+
+def test_groups_are_flushed_when_due():
+    hub = FlakySecurityHub()
+    clock = Clock()
+    buffer = buffer_for(hub, clock, max_age=5.0)
+    buffer.add(ACCOUNT_ID, REGION, finding('a'))
+    clock.now += 4
+    buffer.add(ACCOUNT_ID, REGION, finding('b'))
+    assert hub.batches == []
+    clock.now += 1
+    buffer.flush_due()
+    assert hub.batches == [[finding('a')['Id'], finding('b')['Id']]]
+
+
+def test_recent_findings_are_skipped_within_the_window():
+    hub = FlakySecurityHub()
+    clock = Clock()
+    recent = RecentIds(window=60, clock=clock)
+    buffer = buffer_for(hub, clock, recent)
+    assert buffer.add(ACCOUNT_ID, REGION, finding('a'))
+    buffer.flush()
+
+    buffer = buffer_for(hub, clock, recent)
+    clock.now += 59
+    assert not buffer.add(ACCOUNT_ID, REGION, finding('a'))
+    assert buffer.skipped == 1
+    clock.now += 1
+    assert buffer.add(ACCOUNT_ID, REGION, finding('a'))
+
+
+def test_recent_ids_are_bounded():
+    clock = Clock()
+    recent = RecentIds(window=60, max_size=2, clock=clock)
+    for id in ('a', 'b', 'c'):
+        recent.add(id, f"created {id}")
+    assert 'a' not in recent
+    assert 'b' in recent and 'c' in recent
+    # Importing again keeps the first CreatedAt
+    recent.add('b', 'later')
+    assert recent.created_at('b') == 'created b'
+    assert recent.created_at('a') is None
+
+
+def triaged(aws, name):
+    # The analyst has resolved the finding in Security Hub, a while ago
+    finding_id = app.finding_id_for(ACCOUNT_ID, REGION, name, 'elb')
+    aws.securityhub.findings[finding_id].update(CreatedAt='2024-03-01T12:00:00Z', Workflow={'Status': 'RESOLVED'})
+    return dict(aws.securityhub.findings[finding_id])
+
+
+@pytest.fixture
+def hub(aws, monkeypatch):
+    monkeypatch.setattr(app, 'RECENT', RecentIds())
+    return aws
+
+
+def test_reimport_keeps_created_at_and_workflow(hub, monkeypatch):
+    app.create_incidents([bucket('a')])
+    created = triaged(hub, 'a')
+    assert hub.securityhub.calls == ['get_findings', 'batch_import_findings']
+
+    # In another execution environment, once the first has been recycled
+    monkeypatch.setattr(app, 'RECENT', RecentIds())
+    result = app.lambda_handler(bucket('a'), None)
+    assert result['statusCode'] == 200
+    updated = hub.securityhub.findings[created['Id']]
+    assert updated['CreatedAt'] == '2024-03-01T12:00:00Z'
+    assert updated['Workflow'] == {'Status': 'RESOLVED'}
+    assert hub.securityhub.calls[-2:] == ['get_findings', 'batch_import_findings']
+
+
+def test_known_findings_are_not_looked_up(hub, monkeypatch):
+    monkeypatch.setattr(app, 'RECENT', RecentIds(window=0))
+    app.create_incidents([bucket('a')])
+    created = triaged(hub, 'a')
+    hub.securityhub.calls.clear()
+    app.create_incidents([bucket('a'), bucket('b')])
+    # Only the finding this environment hasn't imported is looked up
+    assert hub.securityhub.calls == ['get_findings', 'batch_import_findings']
+    assert hub.securityhub.findings[created['Id']]['Workflow'] == {'Status': 'RESOLVED'}
+    assert hub.securityhub.findings[app.finding_id_for(ACCOUNT_ID, REGION, 'b', 'elb')]['Workflow'] == {'Status': 'NEW'}
+
+
+def test_failed_lookup_imports_nothing(hub, monkeypatch):
+    def unavailable(**_kwargs):
+        raise ClientError('AccessDeniedException', 'GetFindings')
+
+    monkeypatch.setattr(hub.securityhub, 'get_findings', unavailable)
+    [result] = app.create_incidents([bucket('a')])
+    assert 'AccessDeniedException' in result['incident_error']
+    assert hub.securityhub.findings == {}
@@ -0,0 +1,133 @@
+import time
+import threading
+from datetime import timedelta
+from types import SimpleNamespace
+
+from common.credentials import CredentialCache, REFRESH_MARGIN
+from conftest import ACCOUNT_ID, REGION, START, Clock
+from local.aws import STS
+
+
+class SlowSTS(STS):
+    # Keeps AssumeRole in flight long enough for other threads to miss too
+
+    def assume_role(self, **kwargs):
+        time.sleep(0.05)
+        return super().assume_role(**kwargs)
+
+
+def session(**kwargs):
+    return SimpleNamespace(credentials=kwargs, client=lambda service, **_kwargs: SimpleNamespace(service=service))
+
+
+def cache(sts=None, clock=None):
+    clock = clock or Clock()
+    sts = sts or STS(clock=clock)
+    return CredentialCache(sts_client=sts, session_factory=session, clock=clock.datetime), sts, clock
+
+
+def test_miss_then_hits():
+    credentials, sts, _clock = cache()
+    first = credentials.session(ACCOUNT_ID, 'role', REGION)
+    for _ in range(3):
+        assert credentials.session(ACCOUNT_ID, 'role', REGION) is first
+    assert sts.calls == ['assume_role']
+    assert (credentials.misses, credentials.hits) == (1, 3)
+
+
+def test_keyed_on_account_role_and_region():
+    credentials, sts, _clock = cache()
+    for key in [(ACCOUNT_ID, 'role', REGION), ('444444444444', 'role', REGION),
+                (ACCOUNT_ID, 'other', REGION), (ACCOUNT_ID, 'role', 'us-east-1')]:
+        credentials.session(*key)
+        credentials.session(*key)
+    assert len(sts.calls) == 4
+    assert credentials.session(ACCOUNT_ID, 'role', 'us-east-1').credentials['region_name'] == 'us-east-1'
+
+
+def test_clients_built_once_per_session():
+    credentials, _sts, _clock = cache()
+    s3 = credentials.client('s3', ACCOUNT_ID, 'role', REGION)
+    assert credentials.client('s3', ACCOUNT_ID, 'role', REGION) is s3
+    assert credentials.client('securityhub', ACCOUNT_ID, 'role', REGION).service == 'securityhub'
+
+
+def test_refreshes_ahead_of_expiry():
+    credentials, sts, clock = cache()
+    first = credentials.session(ACCOUNT_ID, 'role', REGION)
+    # The fake's credentials last an hour
+    refresh_at = START + 3600 - REFRESH_MARGIN.total_seconds()
+
+    clock.now = refresh_at - 1
+    assert credentials.session(ACCOUNT_ID, 'role', REGION) is first
+    assert len(sts.calls) == 1
+
+    clock.now = refresh_at
+    second = credentials.session(ACCOUNT_ID, 'role', REGION)
+    assert second is not first
+    assert len(sts.calls) == 2
+    assert credentials.session(ACCOUNT_ID, 'role', REGION) is second
+
+
+def test_refresh_margin_is_configurable():
+    clock = Clock()
+    sts = STS(clock=clock)
+    credentials = CredentialCache(sts_client=sts, session_factory=session, refresh_margin=timedelta(0), clock=clock.datetime)
+    credentials.session(ACCOUNT_ID, 'role', REGION)
+    clock.now = START + 3599
+    credentials.session(ACCOUNT_ID, 'role', REGION)
+    assert len(sts.calls) == 1
+
+
+def test_invalidate():
+    credentials, sts, _clock = cache()
+    credentials.session(ACCOUNT_ID, 'role', REGION)
+    credentials.session(ACCOUNT_ID, 'role', 'us-east-1')
+    credentials.session('444444444444', 'role', REGION)
+
+    credentials.invalidate(region='us-east-1')
+    credentials.session(ACCOUNT_ID, 'role', REGION)
+    credentials.session(ACCOUNT_ID, 'role', 'us-east-1')
+    assert len(sts.calls) == 4
+
+    credentials.invalidate(account_id=ACCOUNT_ID)
+    credentials.session('444444444444', 'role', REGION)
+    assert len(sts.calls) == 4
+    credentials.session(ACCOUNT_ID, 'role', REGION)
+    assert len(sts.calls) == 5
+
+    credentials.invalidate()
+    credentials.session('444444444444', 'role', REGION)
+    assert len(sts.calls) == 6
+
+
+def test_concurrent_misses_assume_once():
+    clock = Clock()
+    credentials, sts, _clock = cache(SlowSTS(clock=clock), clock)
+    barrier = threading.Barrier(8)
+    sessions = []
+
+    def get():
+        barrier.wait()
+        sessions.append(credentials.session(ACCOUNT_ID, 'role', REGION))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sts.calls == ['assume_role']
+    assert len(sessions) == 8 and all(s is sessions[0] for s in sessions)
+
+
+def test_misses_on_other_keys_do_not_wait():
+    # A slow AssumeRole for one key doesn't hold up a hit on another
+    clock = Clock()
+    credentials, _sts, _clock = cache(SlowSTS(clock=clock), clock)
+    credentials.session('444444444444', 'role', REGION)
+    thread = threading.Thread(target=credentials.session, args=(ACCOUNT_ID, 'role', REGION))
+    thread.start()
+    started = time.monotonic()
+    credentials.session('444444444444', 'role', REGION)
+    assert time.monotonic() - started < 0.04
+    thread.join()
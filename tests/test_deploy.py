@@ -0,0 +1,119 @@
+import re
+import sys
+
+import pytest
+
+pytest.importorskip('toml')
+
+from scripts import deploy
+
+
+REGIONS = ['eu-north-1', 'eu-west-1', 'us-east-1', 'us-west-2']
+FAILING = 'eu-west-1'
+
+
+def sam_deploy(region):
+    # Stands in for the 'sam deploy' command line of a region
+    if region == FAILING:
+        return [sys.executable, '-c', "import sys; print('Deploying'); print('ROLLBACK_COMPLETE'); sys.exit(1)"]
+    return [sys.executable, '-c', f"print('Deploying'); print('Stack deployed in {region}')"]
+
+
+def plain(output):
+    return re.sub(r'\033\[[0-9;]*[A-Za-z]', '', output)
+
+
+def report(output):
+    # The status of each region in the final report
+    lines = plain(output).split('-' * 48)[-1].splitlines()
+    return {line.split()[0]: line.split()[1] for line in lines if line.startswith('  ') and line.split()[0] in REGIONS}
+
+
+@pytest.fixture
+def logs(tmp_path, monkeypatch):
+    monkeypatch.setattr(deploy, 'SAM_DEPLOY_LOG_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_no_regions_are_started_after_a_failure(logs, capsys):
+    deploy.deploy_regions_in_parallel('stack', REGIONS, sam_deploy, 1, False, False)
+    output = capsys.readouterr().out
+    assert report(output) == {
+        'eu-north-1': 'succeeded',
+        'eu-west-1': 'failed',
+        'us-east-1': 'cancelled',
+        'us-west-2': 'cancelled',
+    }
+    assert 'Deployment did not complete in 3 of 4 regions' in plain(output)
+    assert f"{FAILING}: 'sam deploy' exited with status 1: ROLLBACK_COMPLETE" in plain(output)
+    assert (logs / 'stack-eu-north-1.log').read_text() == 'Deploying\nStack deployed in eu-north-1\n'
+    assert not (logs / 'stack-us-east-1.log').exists()
+
+
+def test_remaining_regions_are_deployed_on_error(logs, capsys):
+    deploy.deploy_regions_in_parallel('stack', REGIONS, sam_deploy, 2, True, False)
+    output = capsys.readouterr().out
+    assert report(output) == {region: 'failed' if region == FAILING else 'succeeded' for region in REGIONS}
+    assert 'Deployment did not complete in 1 of 4 regions: eu-west-1.' in plain(output)
+    assert (logs / f'stack-{FAILING}.log').read_text() == 'Deploying\nROLLBACK_COMPLETE\n'
+
+
+def test_region_fails_when_sam_cannot_be_started(logs, capsys):
+    def missing_sam(region):
+        if region == FAILING:
+            return [str(logs / 'no-such-sam'), 'deploy']
+        return sam_deploy(region)
+
+    deploy.deploy_regions_in_parallel('stack', REGIONS, missing_sam, 1, False, False)
+    output = plain(capsys.readouterr().out)
+    assert report(output) == {
+        'eu-north-1': 'succeeded',
+        'eu-west-1': 'failed',
+        'us-east-1': 'cancelled',
+        'us-west-2': 'cancelled',
+    }
+    assert f"{FAILING}: 'sam deploy' could not be run: [Errno 2] No such file or directory" in output
+    assert 'An error occurred' not in output
+
+
+def test_all_regions_succeed(logs, capsys):
+    regions = [region for region in REGIONS if region != FAILING]
+    deploy.deploy_regions_in_parallel('stack', regions, sam_deploy, 3, False, True)
+    output = plain(capsys.readouterr().out)
+    assert 'with --no-execute-changeset to 3 regions, 3 at a time' in output
+    assert 'Deployment completed successfully in all 3 regions.' in output
+
+
+def states(*statuses):
+    return {
+        region: {'status': status, 'started': None, 'finished': None, 'last_line': f'{region} output'}
+        for region, status in zip(REGIONS, statuses)
+    }
+
+
+def test_table_prints_only_changes_when_not_live(capsys):
+    table_states = states('deploying', 'pending')
+    table = deploy.SummaryTable(table_states, live=False)
+    table.draw()
+    table.draw()
+    table_states['eu-west-1']['status'] = 'deploying'
+    table.draw()
+    lines = plain(capsys.readouterr().out).splitlines()
+    assert [line.split() for line in lines] == [
+        ['eu-north-1', 'deploying'],
+        ['eu-west-1', 'pending'],
+        ['eu-west-1', 'deploying'],
+    ]
+
+
+def test_live_table_is_redrawn_in_place(capsys, monkeypatch):
+    monkeypatch.setattr(deploy.shutil, 'get_terminal_size', lambda: deploy.os.terminal_size((20, 24)))
+    table = deploy.SummaryTable(states('succeeded', 'failed'), live=True)
+    table.draw()
+    first = capsys.readouterr().out
+    table.draw()
+    second = capsys.readouterr().out
+    assert '\033[2F' not in first
+    assert second.startswith('\033[2F')
+    # Each line is cut to the width of the terminal
+    assert all(len(line) == 19 for line in plain(second).splitlines())
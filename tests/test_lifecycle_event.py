@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from common import metrics, monitoring
+from common.store import bucket_id, INFLIGHT, PENDING, PROBE, VERDICT
+from conftest import ACCOUNT_ID, REGION, BUCKET, started
+from lifecycle_event import app
+from local.events import lifecycle_event, queued
+
+
+ID = bucket_id(ACCOUNT_ID, REGION, BUCKET)
+EXECUTION_ARN = f"{monitoring.STATE_MACHINE_ARN.replace(':stateMachine:', ':execution:')}:earlier"
+
+
+@pytest.fixture(autouse=True)
+def function(aws, store, monkeypatch):
+    monkeypatch.setattr(app, 'STORE', store)
+    monkeypatch.setattr(app, 'MONITORING_MODE', 'execution')
+    monkeypatch.setattr(app, 'DETECTION_MODE', 'polling')
+
+
+def create_bucket(name=BUCKET, region=REGION):
+    app.lambda_handler(lifecycle_event('CreateBucket', ACCOUNT_ID, region, name), None)
+
+
+def started_buckets(aws):
+    return [execution['bucket_name'] for execution in started(aws)]
+
+
+def claimed(store, seconds_ago):
+    # An earlier claim on the bucket
+    started_at = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
+    claim = {'execution_arn': EXECUTION_ARN, 'started_at': started_at.isoformat()}
+    store.put(INFLIGHT, ID, claim, ttl=monitoring.INFLIGHT_TTL)
+    return claim
+
+
+def execution(aws, status):
+    # The execution of the earlier claim
+    aws.stepfunctions.executions[EXECUTION_ARN] = {'status': status, 'input': {'bucket_name': BUCKET}}
+
+
+def test_claim_is_a_conditional_write(aws, store):
+    create_bucket()
+    create_bucket()
+    assert started_buckets(aws) == [BUCKET]
+    [execution_arn] = aws.stepfunctions.executions
+    assert store.get(INFLIGHT, ID)['execution_arn'] == execution_arn
+    # The duplicate was refused without describing anything
+    assert aws.stepfunctions.calls == ['start_execution']
+
+
+def test_claims_cover_account_and_region(aws, store):
+    create_bucket()
+    create_bucket(region='eu-west-1')
+    create_bucket(name='other-bucket')
+    assert started_buckets(aws) == [BUCKET, BUCKET, 'other-bucket']
+
+
+def test_young_claim_is_left_alone(aws, store):
+    # Its execution may still be being started, so it isn't even described
+    claim = claimed(store, seconds_ago=monitoring.CLAIM_GRACE_SECONDS - 10)
+    create_bucket()
+    assert started_buckets(aws) == []
+    assert aws.stepfunctions.calls == []
+    assert store.get(INFLIGHT, ID) == claim
+
+
+def test_claim_of_a_running_execution_holds(aws, store):
+    claim = claimed(store, seconds_ago=monitoring.CLAIM_GRACE_SECONDS + 10)
+    execution(aws, 'RUNNING')
+    create_bucket()
+    assert aws.stepfunctions.calls == ['describe_execution']
+    assert store.get(INFLIGHT, ID) == claim
+
+
+@pytest.mark.parametrize('status', ['SUCCEEDED', 'ABORTED', None])
+def test_stale_claim_is_taken_over(aws, store, status):
+    claimed(store, seconds_ago=monitoring.CLAIM_GRACE_SECONDS + 10)
+    if status:
+        execution(aws, status)
+    create_bucket()
+    assert started_buckets(aws)[-1] == BUCKET
+    assert store.get(INFLIGHT, ID)['execution_arn'] == list(aws.stepfunctions.executions)[-1]
+
+
+def test_stale_claim_is_taken_over_once(aws, store, monkeypatch):
+    # Another invocation replaces the stale claim between our read and write
+    claimed(store, seconds_ago=monitoring.CLAIM_GRACE_SECONDS + 10)
+    is_running = monitoring.is_running
+
+    def overtaken(execution_arn):
+        store.put(INFLIGHT, ID, {'execution_arn': 'theirs', 'started_at': datetime.now(timezone.utc).isoformat()})
+        return is_running(execution_arn)
+
+    monkeypatch.setattr(monitoring, 'is_running', overtaken)
+    create_bucket()
+    assert started_buckets(aws) == []
+    assert store.get(INFLIGHT, ID)['execution_arn'] == 'theirs'
+
+
+def test_claim_is_released_when_the_start_fails(aws, store, monkeypatch):
+    def failing(**_kwargs):
+        raise RuntimeError('ExecutionLimitExceeded')
+
+    monkeypatch.setattr(aws.stepfunctions, 'start_execution', failing)
+    with pytest.raises(RuntimeError):
+        create_bucket()
+    assert store.get(INFLIGHT, ID) is None
+
+
+def delete_bucket(name=BUCKET):
+    with metrics.capture() as sink:
+        app.lambda_handler(lifecycle_event('DeleteBucket', ACCOUNT_ID, REGION, name), None)
+    return sink
+
+
+def kept(store, id=ID):
+    return {kind: store.get(kind, id) is not None for kind in (INFLIGHT, PENDING, PROBE, VERDICT)}
+
+
+def test_delete_stops_the_execution_and_forgets_the_bucket(aws, store):
+    create_bucket()
+    create_bucket(name='other-bucket')
+    [execution_arn, other_arn] = aws.stepfunctions.executions
+    for kind, data in ((PENDING, {'bucket_name': BUCKET}), (PROBE, {'concluded': True}), (VERDICT, {'verdict': 'elb'})):
+        store.put(kind, ID, data)
+
+    sink = delete_bucket()
+    assert aws.stepfunctions.executions[execution_arn]['status'] == 'ABORTED'
+    assert aws.stepfunctions.executions[other_arn]['status'] == 'RUNNING'
+    assert sink.values('ExecutionsSaved') == [1]
+    assert kept(store) == {INFLIGHT: False, PENDING: False, PROBE: False, VERDICT: False}
+    assert kept(store, bucket_id(ACCOUNT_ID, REGION, 'other-bucket'))[INFLIGHT]
+
+
+def test_delete_of_a_finished_execution_saves_nothing(aws, store):
+    claimed(store, seconds_ago=monitoring.CLAIM_GRACE_SECONDS + 10)
+    execution(aws, 'SUCCEEDED')
+    sink = delete_bucket()
+    assert aws.stepfunctions.calls == ['describe_execution']
+    assert sink.values('ExecutionsSaved') == []
+    assert store.get(INFLIGHT, ID) is None
+
+
+def test_delete_without_a_claim(aws, store):
+    store.put(PENDING, ID, {'bucket_name': BUCKET})
+    store.put(VERDICT, ID, {'verdict': 'unusable'})
+    sink = delete_bucket()
+    assert aws.stepfunctions.calls == []
+    assert sink.values('ExecutionsSaved') == []
+    assert not any(kept(store).values())
+
+
+def at(event, event_time):
+    event['detail']['eventTime'] = event_time
+    return event
+
+
+def test_batch_is_handled_per_bucket(monkeypatch):
+    handled = []
+
+    def handler(event_name):
+        def handle(_region, _account_id, bucket_name):
+            if bucket_name == 'broken':
+                raise RuntimeError('AccessDenied')
+            handled.append((bucket_name, event_name))
+        return handle
+
+    monkeypatch.setattr(app, 'create_bucket', handler('CreateBucket'))
+    monkeypatch.setattr(app, 'delete_bucket', handler('DeleteBucket'))
+    batch = queued([
+        # Queued out of order, and a CloudTrail event delivered twice
+        at(lifecycle_event('DeleteBucket', ACCOUNT_ID, REGION, 'a'), '2024-03-01T12:05:00Z'),
+        at(lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, 'a'), '2024-03-01T12:00:00Z'),
+        at(lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, 'b'), '2024-03-01T12:00:00Z'),
+        at(lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, 'b'), '2024-03-01T12:00:00Z'),
+        at(lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, 'broken'), '2024-03-01T12:00:00Z'),
+        at(lifecycle_event('DeleteBucket', ACCOUNT_ID, REGION, 'broken'), '2024-03-01T12:01:00Z'),
+    ])
+    batch['Records'].append({'messageId': 'unreadable', 'eventSource': 'aws:sqs', 'body': 'not json'})
+
+    with metrics.capture() as sink:
+        result = app.lambda_handler(batch, None)
+    assert [event for event in handled if event[0] == 'a'] == [('a', 'CreateBucket'), ('a', 'DeleteBucket')]
+    assert [event for event in handled if event[0] == 'b'] == [('b', 'CreateBucket')]
+    # Exactly the messages of the failed bucket, and the unreadable one
+    failed = {failure['itemIdentifier'] for failure in result['batchItemFailures']}
+    assert failed == {record['messageId'] for record in batch['Records'][4:]}
+    assert len(result['batchItemFailures']) == 3
+    assert sink.values('EventsReceived') == [7]
+    assert sink.values('EventsDeduplicated') == [1]
+    assert sink.values('EventsFailed') == [3]
@@ -0,0 +1,175 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import ACCOUNT_ID, REGION, BUCKET
+from get_latest_files import app
+from get_latest_files.listing import select_latest, next_cursor, window_entries
+
+
+EPOCH = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+def objects(count, seed=0, distinct_times=None):
+    # Objects in listing order, i.e. on their keys; few distinct times make ties
+    rng = random.Random(seed)
+    distinct_times = distinct_times or count
+    keys = sorted(f"key-{rng.randrange(10 ** 9):09d}" for _ in range(count))
+    return [{'Key': key, 'LastModified': EPOCH + timedelta(minutes=rng.randrange(distinct_times))} for key in keys]
+
+
+def paged(contents, size):
+    # Listing pages as list_objects_v2 returns them, counting those fetched
+    pages = [contents[i:i + size] for i in range(0, len(contents), size)] or [[]]
+    fetched = []
+
+    def pages_():
+        for number, page in enumerate(pages, 1):
+            fetched.append(number)
+            yield {'Contents': page, 'IsTruncated': number < len(pages)}
+
+    return pages_(), fetched
+
+
+def sort_all(contents, n):
+    return sorted((obj['LastModified'], obj['Key']) for obj in contents)[-n:]
+
+
+@pytest.mark.parametrize('count, size, n, distinct_times', [
+    (0, 1000, 10, None),
+    (5, 1000, 10, None),
+    (2500, 1000, 10, None),
+    (2500, 7, 25, None),
+    # Mostly ties, broken on the key
+    (2500, 100, 10, 3),
+    (100, 10, 10, 1),
+])
+def test_select_latest_is_sort_all(count, size, n, distinct_times):
+    contents = objects(count, seed=count + size, distinct_times=distinct_times)
+    pages, _fetched = paged(contents, size)
+    latest, stats = select_latest(pages, n)
+    assert latest == sort_all(contents, n)
+    assert stats['complete']
+    assert stats['keys_listed'] == count
+    assert stats['last_key'] == (contents[-1]['Key'] if contents else None)
+
+
+def test_seed_is_merged_with_the_listing():
+    contents = objects(50)
+    seed = [(EPOCH + timedelta(days=1), 'carried-over'), (EPOCH - timedelta(days=1), 'too-old')]
+    pages, _fetched = paged(contents, 10)
+    latest, _stats = select_latest(pages, 5, seed=seed)
+    assert latest == sort_all(contents, 4) + [(EPOCH + timedelta(days=1), 'carried-over')]
+
+
+@pytest.mark.parametrize('budget, pages_fetched, keys_listed', [
+    ({'max_keys': 7}, 3, 9),
+    ({'max_keys': 9}, 3, 9),
+    ({'max_pages': 2}, 2, 6),
+])
+def test_budgets_stop_at_a_page_boundary(budget, pages_fetched, keys_listed):
+    contents = objects(30)
+    pages, fetched = paged(contents, 3)
+    latest, stats = select_latest(pages, 4, **budget)
+    assert fetched == list(range(1, pages_fetched + 1))
+    assert stats['stop_reason'] == next(iter(budget))[4:]
+    assert not stats['complete']
+    assert stats['keys_listed'] == keys_listed
+    assert stats['last_key'] == contents[keys_listed - 1]['Key']
+    assert latest == sort_all(contents[:keys_listed], 4)
+
+
+def test_time_budget_stops_at_a_page_boundary():
+    # A clock which moves a second each time it is read
+    ticks = iter(range(100))
+    pages, fetched = paged(objects(30), 3)
+    _latest, stats = select_latest(pages, 4, max_seconds=3, clock=lambda: next(ticks))
+    assert stats['stop_reason'] == 'seconds'
+    assert fetched == [1, 2, 3]
+
+
+def test_budget_reached_on_the_last_page_is_complete():
+    pages, _fetched = paged(objects(6), 3)
+    _latest, stats = select_latest(pages, 4, max_keys=6)
+    assert stats['complete']
+    assert stats['stop_reason'] is None
+
+
+def test_cursor_round_trips_the_window():
+    contents = objects(20)
+    latest, stats = select_latest(paged(contents, 5)[0], 3)
+    cursor = next_cursor(None, latest, stats, rescanned=True)
+    assert cursor['start_after'] == contents[-1]['Key']
+    assert cursor['object_count'] == 20
+    assert cursor['since_rescan'] == 0
+    assert window_entries(cursor) == latest
+
+    # Nothing new since: the cursor stays put and the count holds
+    latest, stats = select_latest(paged([], 5)[0], 3, seed=window_entries(cursor))
+    cursor = next_cursor(cursor, latest, stats, rescanned=False)
+    assert cursor['start_after'] == contents[-1]['Key']
+    assert cursor['object_count'] == 20
+    assert cursor['since_rescan'] == 1
+
+
+def test_sampled_rescan_keeps_the_count():
+    contents = objects(30)
+    latest, stats = select_latest(paged(contents, 5)[0], 3)
+    cursor = next_cursor(None, latest, stats, rescanned=True)
+    assert cursor['object_count'] == 30
+
+    # The rescan stops on its budget after the first page
+    latest, stats = select_latest(paged(contents, 5)[0], 3, max_pages=1)
+    cursor = next_cursor(cursor, latest, stats, rescanned=True)
+    assert not stats['complete']
+    assert cursor['object_count'] == 30
+    assert cursor['since_rescan'] == 0
+
+
+@pytest.fixture
+def bucket(aws, monkeypatch):
+    monkeypatch.setattr(app, 'LISTING_MODE', 'latest')
+    monkeypatch.setattr(app, 'RESCAN_EVERY', 3)
+    aws.s3.create_bucket(Bucket=BUCKET)
+    return aws.s3
+
+
+def poll(listing=None):
+    data = {'region': REGION, 'account_id': ACCOUNT_ID, 'bucket_name': BUCKET, 'max_files': 3}
+    if listing:
+        data['listing'] = listing
+    return app.list_bucket(data)
+
+
+def test_polls_resume_from_the_cursor_and_rescan(bucket, monkeypatch):
+    for n in range(5):
+        bucket.put_object(Bucket=BUCKET, Key=f"b-{n}")
+    listing = poll()
+    assert listing['keys_listed'] == 5
+    assert listing['cursor']['start_after'] == 'b-4'
+
+    # Only the keys after the cursor are listed, merged with the window
+    bucket.put_object(Bucket=BUCKET, Key='c-0')
+    listing = poll(listing)
+    assert listing['keys_listed'] == 1
+    assert listing['files'][-1] == 'c-0'
+    assert listing['cursor']['object_count'] == 6
+
+    # A key sorting before the cursor is missed
+    bucket.put_object(Bucket=BUCKET, Key='a-0')
+    listing = poll(listing)
+    assert listing['keys_listed'] == 0
+    assert 'a-0' not in listing['files']
+    assert listing['cursor']['since_rescan'] == 2
+
+    # Until the rescan every RESCAN_EVERY polls, which starts the count afresh
+    listing = poll(listing)
+    assert listing['keys_listed'] == 7
+    assert listing['files'][-1] == 'a-0'
+    assert listing['cursor']['since_rescan'] == 0
+    assert listing['cursor']['object_count'] == 7
+
+    listing = poll(listing)
+    assert listing['keys_listed'] == 0
+    assert listing['cursor']['since_rescan'] == 1
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from common import metrics
+
+
+def test_embedded_metric_format(capsys):
+    metrics.emit('Verdicts', 1, 'Count', '333333333333', 'eu-north-1', {'Verdict': 'elb'})
+    document = json.loads(capsys.readouterr().out)
+    [directive] = document['_aws']['CloudWatchMetrics']
+    assert directive['Namespace'] == metrics.NAMESPACE
+    assert directive['Metrics'] == [{'Name': 'Verdicts', 'Unit': 'Count'}]
+    # Per account and region, and for the whole fleet
+    assert directive['Dimensions'] == [['Function', 'Verdict', 'Account', 'Region'], ['Function', 'Verdict']]
+    assert document['Function'] == metrics.FUNCTION
+    assert document['Verdict'] == 'elb'
+    assert document['Account'] == '333333333333'
+    assert document['Region'] == 'eu-north-1'
+    assert document['Verdicts'] == 1
+    assert isinstance(document['_aws']['Timestamp'], int)
+
+
+def test_fleet_wide_metric_has_a_single_dimension_set():
+    with metrics.capture() as sink:
+        metrics.emit('EventsReceived', 10)
+    [document] = sink.documents
+    assert document['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Function']]
+    assert sink.values('EventsReceived') == [10]
+
+
+def test_timed_records_milliseconds_even_on_errors():
+    with metrics.capture() as sink:
+        with metrics.timed('StepLatency', dimensions={'Step': 'a'}):
+            pass
+        with pytest.raises(ValueError):
+            with metrics.timed('StepLatency', dimensions={'Step': 'b'}):
+                raise ValueError()
+    assert [document['Step'] for document in sink.documents] == ['a', 'b']
+    assert all(value >= 0 for value in sink.values('StepLatency'))
+    assert {document['_aws']['CloudWatchMetrics'][0]['Metrics'][0]['Unit'] for document in sink.documents} == {'Milliseconds'}
+
+
+def test_capture_restores_the_sink():
+    sink = metrics.SINK
+    with pytest.raises(RuntimeError):
+        with metrics.capture():
+            raise RuntimeError()
+    assert metrics.SINK is sink
+    with metrics.capture() as outer:
+        with metrics.capture() as inner:
+            metrics.emit('Inner', 1)
+        metrics.emit('Outer', 1)
+    assert inner.values('Inner') == [1] and outer.values('Inner') == []
+    assert outer.values('Outer') == [1]
+
+
+def test_disabled_metrics_are_dropped(capsys):
+    sink = metrics.SINK
+    with metrics.capture() as outer:
+        with metrics.disabled():
+            metrics.emit('Dropped', 1)
+        metrics.emit('Kept', 1)
+    assert outer.values('Dropped') == []
+    assert outer.values('Kept') == [1]
+    assert metrics.SINK is sink
+    assert capsys.readouterr().out == ''
+
+
+def test_handlers_emit_per_account_and_region(aws, monkeypatch):
+    from common.store import SQLiteStore
+    from lifecycle_event import app
+    from local.events import lifecycle_event
+    monkeypatch.setattr(app, 'STORE', SQLiteStore())
+    monkeypatch.setattr(app, 'DETECTION_MODE', 'polling')
+    monkeypatch.setattr(app, 'MONITORING_MODE', 'execution')
+    with metrics.capture() as sink:
+        app.lambda_handler(lifecycle_event('CreateBucket', '333333333333', 'eu-north-1', 'new-bucket'), None)
+    [document] = [document for document in sink.documents if 'StartExecutionLatency' in document]
+    assert (document['Account'], document['Region']) == ('333333333333', 'eu-north-1')
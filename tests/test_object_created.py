@@ -0,0 +1,169 @@
+from types import SimpleNamespace
+
+import pytest
+
+from common import metrics
+from common.probe import rule_name
+from common.store import bucket_id, PENDING, PROBE, VERDICT
+from conftest import ACCOUNT_ID, REGION, BUCKET, started
+from lifecycle_event import app as lifecycle
+from local.events import lifecycle_event, object_created_event, put_objects
+from object_created import app
+
+
+ID = bucket_id(ACCOUNT_ID, REGION, BUCKET)
+ALB_KEY = (
+    f'AWSLogs/{ACCOUNT_ID}/elasticloadbalancing/{REGION}/2024/03/01/'
+    f'{ACCOUNT_ID}_elasticloadbalancing_{REGION}_app.my-alb.1234567890abcdef_20240301T1200Z_10.0.0.1_{{:08d}}.log.gz'
+)
+
+
+@pytest.fixture(autouse=True)
+def functions(aws, store, clock, monkeypatch):
+    # Both functions share the state table
+    for module in (app, lifecycle):
+        monkeypatch.setattr(module, 'STORE', store)
+        monkeypatch.setattr(module, 'time', SimpleNamespace(time=clock))
+    monkeypatch.setattr(lifecycle, 'DETECTION_MODE', 'events')
+    for module in (app, lifecycle):
+        monkeypatch.setattr(module, 'MONITORING_MODE', 'execution')
+    monkeypatch.setattr(lifecycle, 'EVENT_BUS_ARN', 'arn:aws:events:eu-north-1:222222222222:event-bus/SOAR-events')
+    aws.s3.create_bucket(Bucket=BUCKET)
+
+
+def probe(aws):
+    lifecycle.lambda_handler(lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, BUCKET), None)
+    return app.STORE.get(PROBE, ID)
+
+
+def test_probe_forwards_only_the_bucket_events(aws, clock):
+    assert probe(aws)['deadline'] == clock.now + lifecycle.PROBE_SECONDS
+    assert 'EventBridgeConfiguration' in aws.s3.get_bucket_notification_configuration(Bucket=BUCKET)
+    assert aws.events.forwarded(BUCKET)
+    assert not aws.events.forwarded('another-bucket')
+    target = aws.events.rules[rule_name(BUCKET)]['targets']['ProbeToOrgAccount']
+    assert target['Arn'] == lifecycle.EVENT_BUS_ARN
+    assert target['RoleArn'] == f"arn:aws:iam::{ACCOUNT_ID}:role/EventBridgeInvokeEventBusRole"
+
+
+def test_verdict_removes_the_probe(aws, clock):
+    probe(aws)
+    assert put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, [ALB_KEY.format(0)]) == [True]
+    assert app.STORE.get(PROBE, ID)['concluded']
+    assert app.STORE.get(VERDICT, ID)['verdict'] == 'elb'
+    assert aws.s3.get_bucket_notification_configuration(Bucket=BUCKET) == {}
+    assert aws.events.rules == {}
+    assert started(aws) == [{'region': REGION, 'account_id': ACCOUNT_ID, 'bucket_name': BUCKET, 'verdict': 'elb'}]
+    # Later events are ignored
+    assert app.lambda_handler(object_created_event(ACCOUNT_ID, REGION, BUCKET, ALB_KEY.format(99)), None) is False
+
+
+@pytest.mark.parametrize('others', [0, 1, 2])
+def test_first_log_keys_decide_at_once(aws, clock, others):
+    # A low-volume log bucket needn't wait for PROBE_KEYS keys
+    probe(aws)
+    keys = [f"index-{n}.html" for n in range(others)] + [ALB_KEY.format(n) for n in range(others + 1)]
+    results = put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, keys)
+    assert results[-1] is True
+    assert app.STORE.get(PROBE, ID)['concluded']
+    assert app.STORE.get(VERDICT, ID)['verdict'] == 'elb'
+    assert [execution['verdict'] for execution in started(aws)] == ['elb']
+
+
+def test_other_keys_decide_only_on_enough_of_them(aws, clock):
+    probe(aws)
+    keys = [f"index-{n}.html" for n in range(app.PROBE_KEYS)]
+    put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, keys[:-1])
+    assert 'verdict' not in app.STORE.get(PROBE, ID)
+    put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, keys[-1:])
+    assert app.STORE.get(VERDICT, ID)['verdict'] == 'unusable'
+    assert started(aws) == []
+
+
+def test_probe_emits_no_polling_verdicts(aws, clock):
+    # Verdicts counts the polls of analyse_and_decrement, per account and region
+    probe(aws)
+    with metrics.capture() as sink:
+        put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, [ALB_KEY.format(n) for n in range(app.PROBE_KEYS)])
+    assert sink.values('Verdicts') == []
+
+
+def test_existing_eventbridge_notifications_are_kept(aws, clock):
+    aws.s3.put_bucket_notification_configuration(Bucket=BUCKET, NotificationConfiguration={'EventBridgeConfiguration': {}})
+    probe(aws)
+    put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, [ALB_KEY.format(n) for n in range(app.PROBE_KEYS)])
+    assert aws.s3.get_bucket_notification_configuration(Bucket=BUCKET) == {'EventBridgeConfiguration': {}}
+    assert aws.events.rules == {}
+
+
+def test_sweep_leaves_probes_before_their_deadline(aws, clock):
+    probe(aws)
+    clock.now += lifecycle.PROBE_SECONDS - 1
+    app.lambda_handler({'detail-type': 'Scheduled Event'}, None)
+    assert not app.STORE.get(PROBE, ID).get('concluded')
+    assert aws.events.forwarded(BUCKET)
+
+
+def test_sweep_decides_on_fewer_keys(aws, clock):
+    probe(aws)
+    put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, [f"index-{n}.html" for n in range(6)])
+    assert 'verdict' not in app.STORE.get(PROBE, ID)
+    clock.now += lifecycle.PROBE_SECONDS
+    app.lambda_handler({'detail-type': 'Scheduled Event'}, None)
+    assert app.STORE.get(PROBE, ID)['verdict'] == 'unusable'
+    assert app.STORE.get(PROBE, ID)['concluded']
+    assert app.STORE.get(VERDICT, ID)['verdict'] == 'unusable'
+    assert not aws.events.forwarded(BUCKET)
+    assert started(aws) == []
+
+
+def test_sweep_polls_buckets_without_keys(aws, clock):
+    probe(aws)
+    clock.now += lifecycle.PROBE_SECONDS
+    app.lambda_handler({'detail-type': 'Scheduled Event'}, None)
+    assert app.STORE.get(PROBE, ID)['concluded']
+    assert app.STORE.get(VERDICT, ID) is None
+    assert not aws.events.forwarded(BUCKET)
+    assert aws.s3.get_bucket_notification_configuration(Bucket=BUCKET) == {}
+    # Monitored without a verdict, as a new bucket is when polling
+    assert started(aws) == [{'region': REGION, 'account_id': ACCOUNT_ID, 'bucket_name': BUCKET}]
+
+
+def test_sweep_registers_buckets_without_keys_when_batched(aws, clock, monkeypatch):
+    monkeypatch.setattr(app, 'MONITORING_MODE', 'batched')
+    probe(aws)
+    clock.now += lifecycle.PROBE_SECONDS
+    app.lambda_handler({'detail-type': 'Scheduled Event'}, None)
+    assert app.STORE.get(PENDING, ID)['bucket_name'] == BUCKET
+    assert started(aws) == []
+
+
+def test_sweep_concludes_verdicts_not_followed_through(aws, clock, monkeypatch):
+    probe(aws)
+    detach_probe = app.detach_probe
+    monkeypatch.setattr(app, 'detach_probe', failing)
+    with pytest.raises(RuntimeError):
+        put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, [ALB_KEY.format(n) for n in range(app.PROBE_KEYS)])
+    assert not app.STORE.get(PROBE, ID).get('concluded')
+
+    monkeypatch.setattr(app, 'detach_probe', detach_probe)
+    # Left alone while the invocation which reached the verdict may still be at it
+    app.lambda_handler({'detail-type': 'Scheduled Event'}, None)
+    assert not app.STORE.get(PROBE, ID).get('concluded')
+    clock.now += app.CONCLUDE_GRACE_SECONDS
+    app.lambda_handler({'detail-type': 'Scheduled Event'}, None)
+    assert app.STORE.get(PROBE, ID)['concluded']
+    assert not aws.events.forwarded(BUCKET)
+    assert [execution['verdict'] for execution in started(aws)] == ['elb']
+
+
+def test_deleted_bucket_loses_its_rule(aws, clock):
+    probe(aws)
+    put_objects(app.lambda_handler, ACCOUNT_ID, REGION, BUCKET, ['index.html'])
+    lifecycle.lambda_handler(lifecycle_event('DeleteBucket', ACCOUNT_ID, REGION, BUCKET), None)
+    assert aws.events.rules == {}
+    assert app.STORE.get(PROBE, ID) is None
+
+
+def failing(*_args):
+    raise RuntimeError("DetachProbe failed")
@@ -0,0 +1,77 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from tools import package_functions
+
+
+HANDLERS = package_functions.handlers()
+
+
+def relative(files):
+    return {os.path.relpath(path, package_functions.FUNCTIONS) for path in files}
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    monkeypatch.setattr(package_functions, 'BUILD', str(tmp_path / '.build'))
+    monkeypatch.setattr(package_functions, 'MINIMAL_TEMPLATE', str(tmp_path / 'template.minimal.yaml'))
+    return tmp_path
+
+
+def test_closure_holds_the_common_modules_imported():
+    files = relative(package_functions.closure('lifecycle_event', package_functions.local_packages()))
+    assert {
+        'lifecycle_event/__init__.py',
+        'lifecycle_event/app.py',
+        'common/__init__.py',
+        'common/clients.py',
+        'common/credentials.py',
+        'common/metrics.py',
+        'common/monitoring.py',
+        'common/probe.py',
+        'common/store.py',
+        'common/verdicts.py',
+    } <= files
+
+
+def test_closure_holds_no_other_handler():
+    files = relative(package_functions.closure('object_created', package_functions.local_packages()))
+    # Only the classifier of analyse_and_decrement, with its package
+    assert {'analyse_and_decrement/__init__.py', 'analyse_and_decrement/classifier.py'} <= files
+    assert [path for path in files if path.endswith('/app.py')] == ['object_created/app.py']
+
+
+@pytest.mark.parametrize('function', HANDLERS)
+def test_artifact_imports_on_its_own(build, function):
+    # As at a cold start in Lambda, with nothing but the artifact on the path
+    package_functions.package(function, package_functions.local_packages())
+    artifact = build / '.build' / 'functions' / function
+    env = dict(os.environ, PYTHONPATH=str(artifact))
+    subprocess.run([sys.executable, '-c', f"import {function}.app"], cwd=artifact, env=env, check=True, capture_output=True)
+
+
+def test_template_points_every_function_at_its_artifact(build):
+    packages = package_functions.local_packages()
+    for function in HANDLERS:
+        package_functions.package(function, packages)
+    package_functions.write_template(HANDLERS)
+
+    template = (build / 'template.minimal.yaml').read_text()
+    code_uris = re.findall(r'^\s+CodeUri: (\S+)$', template, re.MULTILINE)
+    # The one in Globals, and one per function
+    assert code_uris[0] == 'functions'
+    assert len(code_uris) == len(HANDLERS) + 1
+    for code_uri in code_uris[1:]:
+        assert os.path.isdir(os.path.join(package_functions.ROOT, code_uri))
+        assert os.path.basename(code_uri) in HANDLERS
+
+
+def test_provided_requirements_are_left_out(tmp_path, monkeypatch):
+    (tmp_path / 'handler').mkdir()
+    (tmp_path / 'handler' / 'requirements.txt').write_text('# pinned\nboto3==1.34.0\nbotocore>=1.34\nrequests[socks]>=2\n')
+    monkeypatch.setattr(package_functions, 'FUNCTIONS', str(tmp_path))
+    assert package_functions.requirements('handler') == ['requests[socks]>=2']
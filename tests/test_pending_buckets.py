@@ -0,0 +1,185 @@
+import os
+from types import SimpleNamespace
+
+import yaml
+import pytest
+
+from common.pending import register as register_bucket
+from common.store import bucket_id, PENDING
+from conftest import ACCOUNT_ID, REGION
+from pending_buckets import app
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+DEFINITION = os.path.join(ROOT, 'statemachine', 'monitor_pending_buckets.asl.yaml')
+
+
+@pytest.fixture(autouse=True)
+def function(store, clock, monkeypatch):
+    monkeypatch.setattr(app, 'time', SimpleNamespace(time=clock))
+    monkeypatch.setattr(app, 'STORE', store)
+
+
+def register(*names):
+    for name in names:
+        register_bucket(app.STORE, REGION, ACCOUNT_ID, name)
+    return [bucket_id(ACCOUNT_ID, REGION, name) for name in names]
+
+
+def processed(bucket, verdict='undecided', wait_seconds=60):
+    # The bucket as get_latest_files and analyse_and_decrement return it
+    return dict(bucket, verdict=verdict, counter=bucket['counter'] - 1, wait_seconds=wait_seconds)
+
+
+def test_collect_leases_the_buckets(clock):
+    ids = register('a', 'b', 'c')
+    batches = app.collect()['batches']
+    assert [batch['ids'] for batch in batches] == [ids]
+    # An overlapping run gets nothing
+    assert app.collect()['batches'] == []
+    # Until the lease runs out
+    clock.now += app.LEASE_SECONDS + 1
+    assert [batch['ids'] for batch in app.collect()['batches']] == [ids]
+
+
+def test_collect_splits_into_batches(clock, monkeypatch):
+    monkeypatch.setattr(app, 'MONITORING_BATCH_SIZE', 2)
+    register('a', 'b', 'c')
+    batches = app.collect()['batches']
+    assert [len(batch['ids']) for batch in batches] == [2, 1]
+    assert len({batch['lease'] for batch in batches}) == 1
+
+
+def test_load_skips_buckets_leased_by_another_run(clock):
+    ids = register('a', 'b')
+    old = app.collect()['batches'][0]
+    clock.now += app.LEASE_SECONDS + 1
+    new = app.collect()['batches'][0]
+    assert app.load(old['ids'], old['lease']) == {'buckets': []}
+    assert [bucket['bucket_name'] for bucket in app.load(ids, new['lease'])['buckets']] == ['a', 'b']
+
+
+def test_settle_follows_the_polling_schedule(clock):
+    register('a', 'b')
+    batch = app.collect()['batches'][0]
+    a, b = app.load(batch['ids'], batch['lease'])['buckets']
+    result = app.settle(
+        [processed(a, wait_seconds=120), processed(b, verdict='elb')],
+        [{'outcome': 'none'}, {'outcome': 'replicated'}]
+    )
+    assert result == {'failed': []}
+    [(id, bucket)] = app.STORE.items(PENDING)
+    assert bucket['bucket_name'] == 'a'
+    assert 'lease' not in bucket
+    assert bucket['next_poll_at'] == clock.now + 120
+
+
+def test_settle_leaves_buckets_whose_lease_was_lost(clock):
+    register('a')
+    old = app.collect()['batches'][0]
+    [bucket] = app.load(old['ids'], old['lease'])['buckets']
+    clock.now += app.LEASE_SECONDS + 1
+    new = app.collect()['batches'][0]
+
+    app.settle([processed(bucket, verdict='elb')], [{'outcome': 'replicated'}])
+    [(_id, current)] = app.STORE.items(PENDING)
+    assert current['lease'] == new['lease']
+
+
+def test_settle_reports_failures_instead_of_raising(clock):
+    register('a', 'b')
+    batch = app.collect()['batches'][0]
+    a, b = app.load(batch['ids'], batch['lease'])['buckets']
+    a['replication_attempts'] = app.MAX_REPLICATION_ATTEMPTS - 1
+    result = app.settle(
+        [processed(a, verdict='elb'), processed(b, verdict='cloudfront')],
+        [{'outcome': 'replication_failed'}, {'outcome': 'incident_failed'}]
+    )
+    assert result == {'failed': ['replication of a', 'incident for b']}
+    assert list(app.STORE.items(PENDING)) == []
+
+
+def test_settle_reports_failed_incidents(clock):
+    register('a', 'b', 'c')
+    batch = app.collect()['batches'][0]
+    buckets = app.load(batch['ids'], batch['lease'])['buckets']
+    outcomes = [dict(bucket, outcome='replicated') for bucket in buckets]
+    # As create_incident returns them, for all the buckets replicated at once
+    incidents = {'buckets': [dict(outcomes[0], finding_id='1'), dict(outcomes[1], finding_id='2', incident_error='Throttled')]}
+    result = app.settle([processed(bucket, verdict='elb') for bucket in buckets], outcomes[:2] + [{'outcome': 'none'}], incidents)
+    assert result == {'failed': ['incident for b']}
+
+
+def test_settle_reports_all_incidents_failed_when_the_call_failed(clock):
+    register('a', 'b')
+    batch = app.collect()['batches'][0]
+    a, b = app.load(batch['ids'], batch['lease'])['buckets']
+    result = app.settle(
+        [processed(a, verdict='elb'), processed(b)],
+        [dict(a, outcome='replicated'), {'outcome': 'none'}],
+        {'Error': 'Lambda.Unknown', 'Cause': 'Timed out'}
+    )
+    assert result == {'failed': ['incident for a']}
+
+
+def test_failed_replication_is_retried(clock):
+    register('a')
+    batch = app.collect()['batches'][0]
+    [a] = app.load(batch['ids'], batch['lease'])['buckets']
+    assert app.settle([processed(a, verdict='elb')], [{'outcome': 'replication_failed'}]) == {'failed': []}
+    [(_id, bucket)] = app.STORE.items(PENDING)
+    assert bucket['replication_attempts'] == 1
+    assert [batch['ids'] for batch in app.collect()['batches']] == [[_id]]
+
+
+def test_release_makes_the_batch_due_on_the_next_run(clock):
+    ids = register('a', 'b')
+    batch = app.collect()['batches'][0]
+    result = app.release(batch['ids'], batch['lease'], {'Error': 'Lambda.Unknown', 'Cause': 'Timed out'})
+    assert result == {'failed': ['batch of 2 buckets (Lambda.Unknown)']}
+    assert all('lease' not in bucket for _id, bucket in app.STORE.items(PENDING))
+    assert [batch['ids'] for batch in app.collect()['batches']] == [ids]
+
+
+def test_release_leaves_buckets_leased_by_another_run(clock):
+    register('a')
+    old = app.collect()['batches'][0]
+    clock.now += app.LEASE_SECONDS + 1
+    new = app.collect()['batches'][0]
+    app.release(old['ids'], old['lease'], {'Error': 'States.Timeout'})
+    [(_id, bucket)] = app.STORE.items(PENDING)
+    assert bucket['lease'] == new['lease']
+
+
+def test_report():
+    assert app.report([{'failed': []}, {'failed': []}]) is True
+    with pytest.raises(RuntimeError, match='replication of a, batch of 25 buckets'):
+        app.report([{'failed': ['replication of a']}, {'failed': []}, {'failed': ['batch of 25 buckets (States.ALL)']}])
+
+
+def test_every_step_of_a_batch_releases_it_on_failure():
+    with open(DEFINITION) as file:
+        definition = yaml.safe_load(file)
+    monitor = definition['States']['Monitor Batches']
+    assert monitor['ResultPath'] == '$.results'
+    for name, state in monitor['Iterator']['States'].items():
+        if state['Type'] in ('Task', 'Map') and name not in ('Release Batch', 'Create Incidents'):
+            assert [catch['Next'] for catch in state['Catch']] == ['Release Batch'], name
+            # The batch's ids and lease stay in the state for the release
+            assert state['Catch'][0]['ResultPath'] == '$.error'
+            assert state.get('ResultPath', '$') in ('$', '$.batch', '$.outcomes'), name
+
+
+def test_incidents_are_created_once_per_batch():
+    with open(DEFINITION) as file:
+        definition = yaml.safe_load(file)
+    states = definition['States']['Monitor Batches']['Iterator']['States']
+    replicate = states['Replicate Log Buckets']
+    assert replicate['Next'] == 'Create Incidents'
+    assert 'Create Incident' not in replicate['Iterator']['States']
+    incidents = states['Create Incidents']
+    assert incidents['Parameters'] == {'buckets.$': "$.outcomes[?(@.outcome == 'replicated')]"}
+    # A failed call still settles the batch, with the error in place of the result
+    assert incidents['ResultPath'] == '$.incidents'
+    assert [(catch['ResultPath'], catch['Next']) for catch in incidents['Catch']] == [('$.incidents', 'Settle Batch')]
+    assert states['Settle Batch']['Parameters']['incidents.$'] == '$.incidents'
@@ -0,0 +1,158 @@
+import importlib
+
+import pytest
+
+from local import simulator
+from local.simulator import Engine, StatesError, VirtualClock
+
+
+FUNCTIONS = ('get_latest_files', 'analyse_and_decrement', 'activate_replication', 'create_incident', 'lifecycle_event')
+
+
+def engine(states, resources=None, clock=None, **kwargs):
+    definition = {'StartAt': next(iter(states)), 'States': states}
+    return Engine(definition, resources or {}, clock or VirtualClock(0), **kwargs)
+
+
+def task(name, function):
+    return {'arn:' + name: (name, function)}
+
+
+def failing(errors, result=None):
+    # Fails with each of the errors in turn, then returns the result
+    errors = list(errors)
+
+    def function(_data, _context):
+        if errors:
+            raise StatesError(errors.pop(0), 'injected')
+        return result
+    return function
+
+
+def test_clock_runs_actions_in_order():
+    clock = VirtualClock(100)
+    ran = []
+    clock.schedule(130, lambda: ran.append(('b', clock.now)))
+    clock.schedule(110, lambda: ran.append(('a', clock.now)))
+    clock.schedule(500, lambda: ran.append(('c', clock.now)))
+    clock.advance(50)
+    assert ran == [('a', 110), ('b', 130)]
+    assert clock() == 150
+
+
+def test_paths_parameters_and_choices():
+    run = engine({
+        'Shape': {'Type': 'Pass', 'Parameters': {'n.$': '$.input.n', 'fixed': 1}, 'ResultPath': '$.shaped', 'Next': 'Big?'},
+        'Big?': {'Type': 'Choice', 'Choices': [{'Variable': '$.shaped.n', 'NumericGreaterThan': 10, 'Next': 'Big'}], 'Default': 'Small'},
+        'Big': {'Type': 'Pass', 'Result': 'big', 'ResultPath': '$.size', 'End': True},
+        'Small': {'Type': 'Pass', 'Result': 'small', 'ResultPath': '$.size', 'End': True},
+    })
+    execution = run.run({'input': {'n': 11}})
+    assert execution['status'] == 'SUCCEEDED'
+    assert execution['output'] == {'input': {'n': 11}, 'shaped': {'n': 11, 'fixed': 1}, 'size': 'big'}
+    assert execution['transitions'] == 3
+    assert run.run({'input': {'n': 3}})['output']['size'] == 'small'
+
+
+def test_waits_advance_the_clock():
+    clock = VirtualClock(0)
+    run = engine({
+        'Wait': {'Type': 'Wait', 'SecondsPath': '$.seconds', 'Next': 'Done'},
+        'Done': {'Type': 'Succeed'},
+    }, clock=clock)
+    execution = run.run({'seconds': 600})
+    assert execution['seconds'] == 600
+    assert clock() == 600
+
+
+def test_retries_count_as_transitions_and_back_off():
+    clock = VirtualClock(0)
+    run = engine({
+        'Call': {
+            'Type': 'Task', 'Resource': 'arn:call', 'ResultPath': '$.result', 'End': True,
+            'Retry': [{'ErrorEquals': ['Lambda.ServiceException'], 'IntervalSeconds': 2, 'BackoffRate': 2.0, 'MaxAttempts': 3}],
+        },
+    }, task('call', failing(['Lambda.ServiceException'] * 2, 'ok')), clock)
+    execution = run.run({})
+    assert execution['output'] == {'result': 'ok'}
+    assert execution['invocations'] == {'call': 3}
+    assert execution['transitions'] == 3
+    assert clock() == 2 + 4
+
+
+def test_catch_puts_the_error_at_its_result_path():
+    run = engine({
+        'Call': {
+            'Type': 'Task', 'Resource': 'arn:call', 'End': True,
+            'Catch': [{'ErrorEquals': ['States.ALL'], 'ResultPath': '$.error', 'Next': 'Handled'}],
+        },
+        'Handled': {'Type': 'Succeed'},
+    }, task('call', lambda _data, _context: {}['missing']))
+    execution = run.run({'a': 1})
+    assert execution['output'] == {'a': 1, 'error': {'Error': 'KeyError', 'Cause': "'missing'"}}
+
+
+def test_failures_stops_and_runaways():
+    assert engine({'Fail': {'Type': 'Fail', 'Error': 'Nope'}}).run({})['error'] == 'Nope'
+    uncaught = engine({'Call': {'Type': 'Task', 'Resource': 'arn:call', 'End': True}}, task('call', failing(['Boom'])))
+    assert uncaught.run({})['status'] == 'FAILED'
+    loop = {'Loop': {'Type': 'Pass', 'Next': 'Loop'}}
+    assert engine(loop).run({}, stopped=lambda: True)['status'] == 'ABORTED'
+    assert engine(loop, max_transitions=50).run({})['error'] == 'States.Runtime'
+
+
+def test_unsupported_paths_are_refused():
+    with pytest.raises(NotImplementedError):
+        engine({'P': {'Type': 'Pass', 'InputPath': '$.items[0]', 'End': True}}).run({'items': [1]})
+
+
+@pytest.fixture
+def sim(aws, monkeypatch):
+    # The simulator installs stand-ins of its own and shares one state table
+    # between the functions; both are undone after the test
+    for function in FUNCTIONS:
+        module = importlib.import_module(f'{function}.app')
+        if hasattr(module, 'STORE'):
+            monkeypatch.setattr(module, 'STORE', module.STORE)
+    monkeypatch.setattr(importlib.import_module('lifecycle_event.app'), 'MONITORING_MODE', 'execution')
+    monkeypatch.setattr(importlib.import_module('lifecycle_event.app'), 'DETECTION_MODE', 'polling')
+    return simulator.Simulator()
+
+
+def test_alb_bucket_is_replicated(sim):
+    report = sim.run(simulator.scenario('alb', 0, seed=1, start=sim.clock.now))
+    assert report['status'] == 'SUCCEEDED'
+    assert report['verdict'] == 'elb'
+    assert report['executions'] == 1
+    assert report['api_calls']['s3.put_bucket_replication'] == 1
+    assert report['invocations']['create_incident'] == 1
+    assert report['cost_usd'] > 0
+
+
+def test_empty_bucket_runs_to_the_horizon(sim):
+    report = sim.run(simulator.scenario('empty', 0, seed=1, start=sim.clock.now))
+    assert report['verdict'] == 'undecided'
+    assert report['transitions'] > 100
+    assert 's3.put_bucket_replication' not in report['api_calls']
+
+
+def test_deleted_bucket_stops_its_execution(sim):
+    report = sim.run(simulator.scenario('deleted', 0, seed=1, start=sim.clock.now))
+    assert report['status'] == 'ABORTED'
+    assert report['invocations']['lifecycle_event'] == 2
+
+
+def test_injected_faults_are_retried(sim):
+    clean = sim.run(simulator.scenario('alb', 0, seed=1, start=sim.clock.now))
+    faulty = dict(simulator.scenario('alb', 1, seed=1, start=sim.clock.now), faults={'get_latest_files': ['Lambda.ServiceException']})
+    report = sim.run(faulty)
+    assert report['verdict'] == 'elb'
+    assert report['invocations']['get_latest_files'] == clean['invocations']['get_latest_files'] + 1
+
+
+def test_scenarios_are_reproducible(sim):
+    first = simulator.scenario('data', 0, seed=7, start=0)
+    second = simulator.scenario('data', 0, seed=7, start=0)
+    assert list(first['objects']) == list(second['objects'])
+    with pytest.raises(ValueError):
+        simulator.scenario('unknown', 0, seed=7, start=0)
@@ -0,0 +1,101 @@
+import json
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from common.store import DynamoDBStore, INFLIGHT, PENDING
+
+
+TABLE = 'state'
+NOW = 1_700_000_000
+ID = '333333333333#eu-north-1#new-bucket'
+
+
+@pytest.fixture
+def dynamodb():
+    client = boto3.client('dynamodb', region_name='eu-north-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+    with Stubber(client) as stubber:
+        yield DynamoDBStore(TABLE, client=client, clock=lambda: NOW), stubber
+        stubber.assert_no_pending_responses()
+
+
+def item(id, data, expires_at=None, kind=INFLIGHT):
+    item = {'kind': {'S': kind}, 'id': {'S': id}, 'data': {'S': json.dumps(data, sort_keys=True)}}
+    if expires_at is not None:
+        item['expires_at'] = {'N': str(expires_at)}
+    return item
+
+
+def test_put_if_absent_takes_absent_or_expired_items(dynamodb):
+    store, stubber = dynamodb
+    stubber.add_response('put_item', {}, {
+        'TableName': TABLE,
+        'Item': item(ID, {'execution_arn': 'arn'}, NOW + 60),
+        'ConditionExpression': 'attribute_not_exists(#kind) OR expires_at < :now',
+        'ExpressionAttributeNames': {'#kind': 'kind'},
+        'ExpressionAttributeValues': {':now': {'N': str(NOW)}},
+    })
+    assert store.put_if_absent(INFLIGHT, ID, {'execution_arn': 'arn'}, ttl=60)
+
+
+def test_failed_conditions_return_false(dynamodb):
+    store, stubber = dynamodb
+    stubber.add_client_error('put_item', 'ConditionalCheckFailedException')
+    assert not store.put_if_absent(INFLIGHT, ID, {'execution_arn': 'arn'})
+    stubber.add_client_error('put_item', 'ConditionalCheckFailedException')
+    assert not store.replace(INFLIGHT, ID, {'execution_arn': 'new'}, {'execution_arn': 'old'})
+
+
+def test_other_errors_are_raised(dynamodb):
+    store, stubber = dynamodb
+    stubber.add_client_error('put_item', 'ProvisionedThroughputExceededException')
+    with pytest.raises(store.client.exceptions.ProvisionedThroughputExceededException):
+        store.put_if_absent(INFLIGHT, ID, {})
+
+
+def test_replace_expects_the_json_last_read(dynamodb):
+    store, stubber = dynamodb
+    # Compared as stored: keys sorted, whatever order the caller built them in
+    stubber.add_response('put_item', {}, {
+        'TableName': TABLE,
+        'Item': item(ID, {'execution_arn': 'new', 'started_at': 'later'}),
+        'ConditionExpression': '#data = :expected',
+        'ExpressionAttributeNames': {'#data': 'data'},
+        'ExpressionAttributeValues': {':expected': {'S': '{"execution_arn": "old", "started_at": "earlier"}'}},
+    })
+    assert store.replace(INFLIGHT, ID, {'started_at': 'later', 'execution_arn': 'new'}, {'started_at': 'earlier', 'execution_arn': 'old'})
+
+
+@pytest.mark.parametrize('expires_at, found', [(None, True), (NOW, True), (NOW - 1, False)])
+def test_get_treats_expired_items_as_absent(dynamodb, expires_at, found):
+    store, stubber = dynamodb
+    stubber.add_response('get_item', {'Item': item(ID, {'a': 1}, expires_at)}, {
+        'TableName': TABLE,
+        'Key': {'kind': {'S': INFLIGHT}, 'id': {'S': ID}},
+        'ConsistentRead': True,
+    })
+    assert store.get(INFLIGHT, ID) == ({'a': 1} if found else None)
+
+
+def test_get_of_a_missing_item(dynamodb):
+    store, stubber = dynamodb
+    stubber.add_response('get_item', {})
+    assert store.get(INFLIGHT, ID) is None
+
+
+def test_items_follow_the_pages_and_skip_expired_items(dynamodb):
+    store, stubber = dynamodb
+    query = {
+        'TableName': TABLE,
+        'KeyConditionExpression': '#kind = :kind',
+        'ExpressionAttributeNames': {'#kind': 'kind'},
+        'ExpressionAttributeValues': {':kind': {'S': PENDING}},
+    }
+    last_key = {'kind': {'S': PENDING}, 'id': {'S': 'b'}}
+    stubber.add_response('query', {
+        'Items': [item('a', {'n': 1}, kind=PENDING), item('b', {'n': 2}, NOW - 1, kind=PENDING)],
+        'LastEvaluatedKey': last_key,
+    }, query)
+    stubber.add_response('query', {'Items': [item('c', {'n': 3}, NOW + 1, kind=PENDING)]}, {**query, 'ExclusiveStartKey': last_key})
+    assert list(store.items(PENDING)) == [('a', {'n': 1}), ('c', {'n': 3})]
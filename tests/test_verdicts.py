@@ -0,0 +1,93 @@
+import pytest
+
+from activate_replication import app as activation
+from common import metrics, verdicts
+from common.store import bucket_id, VERDICT
+from conftest import ACCOUNT_ID, REGION, started
+from lifecycle_event import app as lifecycle
+from local.events import lifecycle_event
+
+
+BUCKET = 'log-bucket'
+ID = bucket_id(ACCOUNT_ID, REGION, BUCKET)
+
+
+def bucket(verdict='elb', **counts):
+    return {'account_id': ACCOUNT_ID, 'region': REGION, 'bucket_name': BUCKET, 'verdict': verdict, **counts}
+
+
+@pytest.fixture(autouse=True)
+def functions(aws, store, monkeypatch):
+    # Both functions share the state table
+    for module in (lifecycle, activation):
+        monkeypatch.setattr(module, 'STORE', store)
+    monkeypatch.setattr(lifecycle, 'MONITORING_MODE', 'execution')
+    monkeypatch.setattr(lifecycle, 'DETECTION_MODE', 'polling')
+    aws.s3.create_bucket(Bucket=BUCKET)
+
+
+def create_bucket():
+    lifecycle.lambda_handler(lifecycle_event('CreateBucket', ACCOUNT_ID, REGION, BUCKET), None)
+
+
+def test_decided_bucket_is_not_monitored_again(aws, clock):
+    verdicts.record(lifecycle.STORE, bucket('unusable', other_files=12))
+    create_bucket()
+    assert started(aws) == []
+    assert aws.stepfunctions.calls == []
+
+
+def test_log_bucket_not_yet_configured_goes_to_replication(aws, clock):
+    verdicts.record(lifecycle.STORE, bucket('elb'))
+    create_bucket()
+    [execution] = started(aws)
+    assert execution['verdict'] == 'elb'
+
+
+def test_configured_log_bucket_is_skipped(aws, clock):
+    activation.activate(bucket('elb'))
+    create_bucket()
+    assert started(aws) == []
+
+
+def test_verdicts_expire(aws, clock):
+    verdicts.record(lifecycle.STORE, bucket('unusable'))
+    clock.now += verdicts.VERDICT_TTL
+    create_bucket()
+    assert started(aws) == []
+
+    # Seen afresh once the record has expired
+    clock.now += 1
+    assert verdicts.lookup(lifecycle.STORE, ACCOUNT_ID, REGION, BUCKET) is None
+    create_bucket()
+    [execution] = started(aws)
+    assert 'verdict' not in execution
+
+
+def test_configuration_is_not_written_again(aws, clock):
+    assert activation.activate(bucket())['changed']
+    assert lifecycle.STORE.get(VERDICT, ID)['configuration_hash']
+    aws.s3.calls.clear()
+
+    with metrics.capture() as sink:
+        assert activation.activate(bucket()) == {'bucket_name': BUCKET, 'changed': []}
+    assert aws.s3.calls == []
+    assert sink.values('ActivationsSkipped') == [1]
+
+
+def test_changed_configuration_is_written_again(aws, clock, monkeypatch):
+    activation.activate(bucket())
+    # Another destination changes the configuration hash
+    monkeypatch.setattr(activation, 'LOAD_BALANCER_LOGS_BUCKET_NAME', 'other-logs')
+    assert 'replication' in activation.activate(bucket())['changed']
+    assert aws.s3.configuration(BUCKET, 'replication')['Rules'][0]['Destination']['Bucket'].endswith('other-logs')
+    assert lifecycle.STORE.get(VERDICT, ID)['configuration_hash'] == activation.desired_hash(*activation.target(bucket()))
+
+
+def test_configuration_hash_is_kept_for_the_same_verdict(clock):
+    activation.activate(bucket())
+    configured = lifecycle.STORE.get(VERDICT, ID)['configuration_hash']
+    assert verdicts.record(lifecycle.STORE, bucket('elb', elb_logs=3))['configuration_hash'] == configured
+    # A different verdict needs configuring afresh
+    assert verdicts.record(lifecycle.STORE, bucket('cloudfront'))['configuration_hash'] is None
+    assert not activation.configured_before(bucket('cloudfront'))
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+#
+# Backfills the buckets which existed before deployment, which the pipeline
+# never sees as it only acts on CreateBucket events. Enumerates the accounts of
+# the organisation and their buckets, samples the keys of each bucket through
+# the cross-account role, classifies them the way analyse_and_decrement does,
+# and feeds the log buckets to the deployed ActivateReplication function in
+# batches. Run it with credentials for the organisation's management account.
+#
+# Every bucket's outcome is checkpointed in a local SQLite file as it is
+# reached, so an interrupted run picks up where it stopped when started again
+# with the same file. All S3 calls, in all accounts, share one rate limit.
+#
+#   python3 tools/backfill.py --checkpoint backfill.db --exclude 111111111111
+#   python3 tools/backfill.py --checkpoint backfill.db --exclude 111111111111 \
+#       --function arn:aws:lambda:eu-north-1:222222222222:function:ActivateReplication
+#
+# Without --function, buckets are only classified, which makes a dry run.
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'functions'))
+
+from analyse_and_decrement.classifier import REGISTRY
+from common import clients, metrics, verdicts
+from common.credentials import CredentialCache
+from common.store import SQLiteStore, bucket_id
+from get_latest_files.listing import list_pages, select_latest
+
+
+# Kinds of checkpoint kept in the store
+BUCKET = 'backfill_bucket'
+ACCOUNT = 'backfill_account'
+
+# Buckets whose region S3 doesn't report were created before regions had names
+DEFAULT_REGION = 'us-east-1'
+LEGACY_REGIONS = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}
+
+# ActivateReplication runs for up to five minutes on a full batch
+ACTIVATION_TIMEOUT = 330
+
+
+class RateLimiter:
+    # A token bucket shared by all threads: at most rate calls per second on
+    # average, in bursts of up to burst calls
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+def limited(pages, limiter):
+    # The paginator fetches each page when the next one is asked for, so the
+    # limit is applied right before that
+    pages = iter(pages)
+    while True:
+        limiter.acquire()
+        page = next(pages, None)
+        if page is None:
+            return
+        yield page
+
+
+class Backfill:
+
+    def __init__(self, args, store, limiter, cache):
+        self.args = args
+        self.store = store
+        self.limiter = limiter
+        self.cache = cache
+        self.counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._lambda = None
+
+    def accounts(self):
+        if self.args.accounts:
+            accounts = self.args.accounts
+        else:
+            pages = clients.client('organizations').get_paginator('list_accounts').paginate()
+            accounts = [account['Id'] for page in pages for account in page['Accounts'] if account['Status'] == 'ACTIVE']
+        return sorted(set(accounts) - set(self.args.exclude or []))
+
+    def run(self):
+        accounts = self.accounts()
+        done = {id for id, _checkpoint in self.store.items(ACCOUNT)}
+        pending = [account_id for account_id in accounts if account_id not in done]
+        # The checkpoints of the buckets reached in earlier runs, per account
+        self.earlier = {}
+        for id, checkpoint in self.store.items(BUCKET):
+            self.earlier.setdefault(checkpoint['account_id'], {})[id] = checkpoint
+        print(f"{len(accounts)} accounts, {len(accounts) - len(pending)} done in an earlier run.")
+        with ThreadPoolExecutor(max_workers=self.args.account_concurrency) as executor:
+            for account_id, outcome in zip(pending, executor.map(self.scan_account, pending)):
+                self.count('accounts')
+                print(f"[{self.counts['accounts']}/{len(pending)}] {account_id}: {outcome}. {self.progress()}")
+        return self.counts
+
+    def scan_account(self, account_id):
+        try:
+            buckets = self.list_buckets(account_id)
+        except Exception as e:
+            # Not checkpointed, so that the account is tried again next run
+            self.count('account_errors')
+            return f"failed to list buckets: {e}"
+
+        # Buckets which couldn't be sampled last time are sampled again, and
+        # log buckets not activated yet are activated
+        earlier = self.earlier.get(account_id, {})
+        todo = [bucket for bucket in buckets if earlier.get(bucket_id(*bucket), {}).get('status', 'classification_failed') == 'classification_failed']
+        with ThreadPoolExecutor(max_workers=self.args.bucket_concurrency) as executor:
+            checkpoints = list(executor.map(lambda bucket: self.classify(*bucket), todo))
+        checkpoints += [checkpoint for checkpoint in earlier.values() if checkpoint['status'] in ('classified', 'activation_failed')]
+
+        to_activate = [checkpoint for checkpoint in checkpoints if checkpoint['status'] in ('classified', 'activation_failed')]
+        if not self.args.function:
+            # A dry run; the account is done once its log buckets are activated
+            return f"{len(buckets)} buckets, {len(to_activate)} log buckets to activate"
+        if to_activate:
+            self.activate(to_activate)
+
+        failed = sum(1 for checkpoint in checkpoints if checkpoint['status'].endswith('failed'))
+        if failed:
+            return f"{len(buckets)} buckets, {failed} failed, to be retried next run"
+        self.store.put(ACCOUNT, account_id, {'buckets': len(buckets), 'finished_at': time.time()})
+        return f"{len(buckets)} buckets, {len(to_activate)} log buckets activated"
+
+    def list_buckets(self, account_id):
+        client = self.client(account_id, DEFAULT_REGION)
+        buckets = []
+        for page in limited(client.get_paginator('list_buckets').paginate(), self.limiter):
+            for bucket in page['Buckets']:
+                if 'BucketRegion' in bucket:
+                    region = bucket['BucketRegion']
+                else:
+                    self.limiter.acquire()
+                    location = client.get_bucket_location(Bucket=bucket['Name'])['LocationConstraint']
+                    region = LEGACY_REGIONS.get(location, location)
+                if not self.args.regions or region in self.args.regions:
+                    buckets.append((account_id, region, bucket['Name']))
+        return buckets
+
+    def classify(self, account_id, region, bucket_name):
+        # Samples the bucket the way the 'sample' listing mode does, and
+        # classifies the newest keys of the sample
+        checkpoint = {'account_id': account_id, 'region': region, 'bucket_name': bucket_name}
+        try:
+            client = self.client(account_id, region)
+            latest, stats = select_latest(
+                limited(list_pages(client, bucket_name), self.limiter),
+                self.args.files,
+                max_keys=self.args.sample_keys,
+                max_pages=self.args.sample_pages
+            )
+            summary = REGISTRY.summarise([key for _last_modified, key in latest])
+        except Exception as e:
+            checkpoint.update(status='classification_failed', error=str(e))
+        else:
+            verdict = summary['verdict']
+            checkpoint.update(
+                status='classified' if verdict in verdicts.LOGS else 'skipped',
+                verdict=verdict,
+                format_counts=summary['format_counts'],
+                keys_sampled=stats['keys_listed'],
+            )
+            self.count(f"verdict {verdict}")
+        self.checkpoint(checkpoint)
+        self.count('buckets')
+        return checkpoint
+
+    def activate(self, checkpoints):
+        size = self.args.activation_batch
+        for start in range(0, len(checkpoints), size):
+            batch = checkpoints[start:start + size]
+            fields = [[c['account_id'], c['region'], c['bucket_name'], c['verdict']] for c in batch]
+            try:
+                results = self.invoke({'buckets': fields})['buckets']
+            except Exception as e:
+                results = [{'replication_error': str(e)}] * len(batch)
+            for checkpoint, result in zip(batch, results):
+                if result.get('replication_error'):
+                    checkpoint.update(status='activation_failed', error=result['replication_error'])
+                    self.count('activation_errors')
+                else:
+                    checkpoint.update(status='activated', changed=result.get('changed'))
+                    self.count('activated')
+                self.checkpoint(checkpoint)
+
+    def invoke(self, payload):
+        if self._lambda is None:
+            from botocore.config import Config
+            function = self.args.function
+            region = function.split(':')[3] if function.startswith('arn:') else None
+            self._lambda = clients.new_session().client(
+                'lambda', region_name=region,
+                config=clients.config().merge(Config(read_timeout=ACTIVATION_TIMEOUT))
+            )
+        response = self._lambda.invoke(FunctionName=self.args.function, Payload=json.dumps(payload).encode())
+        result = json.loads(response['Payload'].read())
+        if 'FunctionError' in response:
+            raise RuntimeError(f"{result.get('errorType')}: {result.get('errorMessage')}")
+        return result
+
+    def client(self, account_id, region):
+        return self.cache.client('s3', account_id, self.args.role, region, session_name=f"backfill_{account_id}")
+
+    def checkpoint(self, checkpoint):
+        self.store.put(BUCKET, bucket_id(checkpoint['account_id'], checkpoint['region'], checkpoint['bucket_name']), checkpoint)
+
+    def count(self, name):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def progress(self):
+        with self._counts_lock:
+            found = ', '.join(f"{name[8:]} {count}" for name, count in sorted(self.counts.items()) if name.startswith('verdict '))
+            return f"{self.counts['buckets']} buckets classified ({found or 'none yet'}), {self.counts['activated']} activated"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True, help='SQLite file holding the progress, to resume from')
+    parser.add_argument('--function', help='Name or ARN of the ActivateReplication function; without it, only classify')
+    parser.add_argument('--role', default='AWSControlTowerExecution', help='The role to assume in each account')
+    parser.add_argument('--accounts', nargs='+', help='Only these accounts (default: all active accounts)')
+    parser.add_argument('--exclude', nargs='+', help='Accounts to leave out, such as the Log Archive')
+    parser.add_argument('--regions', nargs='+', help='Only buckets in these regions (default: all)')
+    parser.add_argument('--rate', type=float, default=50, help='S3 calls per second, over all accounts')
+    parser.add_argument('--account-concurrency', type=int, default=16, help='Accounts scanned at a time')
+    parser.add_argument('--bucket-concurrency', type=int, default=8, help='Buckets sampled at a time per account')
+    parser.add_argument('--files', type=int, default=10, help='The newest keys of the sample to classify')
+    parser.add_argument('--sample-keys', type=int, default=1000, help='Stop sampling a bucket after this many keys')
+    parser.add_argument('--sample-pages', type=int, default=1, help='Stop sampling a bucket after this many pages')
+    parser.add_argument('--activation-batch', type=int, default=25, help='Buckets per ActivateReplication invocation')
+    args = parser.parse_args()
+
+    store = SQLiteStore(args.checkpoint)
+    backfill = Backfill(args, store, RateLimiter(args.rate), CredentialCache())
+    started = time.monotonic()
+    # The AssumeRole metrics of the credential cache would drown the output
+    with metrics.disabled():
+        counts = backfill.run()
+    print(f"\nDone in {(time.monotonic() - started) / 60:.1f} minutes. {backfill.progress()}.")
+    errors = counts['account_errors'] + counts['activation_errors']
+    failed = sum(1 for _id, checkpoint in store.items(BUCKET) if checkpoint['status'].endswith('failed'))
+    if errors or failed:
+        print(f"{counts['account_errors']} accounts couldn't be listed and {failed} buckets failed; run again to retry them.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Builds one minimal artifact per function instead of the shared CodeUri. Each
+# artifact holds the function's own package and only those modules under
+# functions/ that it imports, directly or not, lazily or not. boto3 is left
+# out, as the Lambda runtime provides it. Writes the artifacts under .build/,
+# a copy of template.yaml giving each function its own CodeUri, and a report
+# of the artifact sizes against the shared package.
+#
+#   python3 tools/package_functions.py
+#   sam build --template template.minimal.yaml --parallel --cached
+#
+
+import os
+import re
+import ast
+import sys
+import glob
+import shutil
+import zipfile
+import argparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+FUNCTIONS = os.path.join(ROOT, 'functions')
+BUILD = os.path.join(ROOT, '.build')
+TEMPLATE = os.path.join(ROOT, 'template.yaml')
+MINIMAL_TEMPLATE = os.path.join(ROOT, 'template.minimal.yaml')
+
+# Requirements the Lambda runtime already satisfies
+PROVIDED = {'boto3', 'botocore'}
+
+# Fixed timestamp for zip entries, so that unchanged code gives identical zips
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def local_packages():
+    return {name for name in os.listdir(FUNCTIONS) if os.path.isfile(os.path.join(FUNCTIONS, name, '__init__.py'))}
+
+
+def handlers():
+    return sorted(os.path.basename(os.path.dirname(path)) for path in glob.glob(os.path.join(FUNCTIONS, '*', 'app.py')))
+
+
+def module_path(module):
+    # The file of a module under functions/, or None if there is none
+    base = os.path.join(FUNCTIONS, *module.split('.'))
+    for path in (base + '.py', os.path.join(base, '__init__.py')):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def imported_modules(path, packages):
+    # The modules under functions/ that a file imports anywhere in its body
+    found = set()
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            # The imported names may be submodules themselves
+            names = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+        else:
+            continue
+        for name in names:
+            if name.split('.')[0] in packages and module_path(name):
+                found.add(name)
+    return found
+
+
+def closure(function, packages):
+    # All files under functions/ the function needs, including the __init__.py
+    # of every package on the way
+    files = set()
+    pending = [f"{function}.app"]
+    seen = set()
+    while pending:
+        module = pending.pop()
+        if module in seen:
+            continue
+        seen.add(module)
+        parts = module.split('.')
+        for depth in range(1, len(parts)):
+            init = module_path('.'.join(parts[:depth]))
+            if init:
+                files.add(init)
+        path = module_path(module)
+        files.add(path)
+        pending.extend(imported_modules(path, packages))
+    return sorted(files)
+
+
+def requirements(function):
+    path = os.path.join(FUNCTIONS, function, 'requirements.txt')
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [line for line in lines if re.split(r'[<>=!~\[ ;]', line)[0].lower() not in PROVIDED]
+
+
+def write_zip(path, entries):
+    # entries: (name in the archive, file on disk), written in sorted order
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, source in sorted(entries):
+            info = zipfile.ZipInfo(name, ZIP_DATE)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with open(source, 'rb') as f:
+                archive.writestr(info, f.read())
+    return os.path.getsize(path)
+
+
+def package(function, packages):
+    # Copies the function's files to .build/functions/<function>, keeping the
+    # layout under functions/ so that the Handler setting stays the same
+    target = os.path.join(BUILD, 'functions', function)
+    shutil.rmtree(target, ignore_errors=True)
+    files = closure(function, packages)
+    for source in files:
+        destination = os.path.join(target, os.path.relpath(source, FUNCTIONS))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+
+    extra = requirements(function)
+    if extra:
+        with open(os.path.join(target, 'requirements.txt'), 'w') as f:
+            f.write('\n'.join(extra) + '\n')
+
+    entries = [(os.path.relpath(path, target), path) for path in glob.glob(os.path.join(target, '**', '*'), recursive=True) if os.path.isfile(path)]
+    return {
+        'files': len(entries),
+        'bytes': sum(os.path.getsize(path) for _name, path in entries),
+        'zip_bytes': write_zip(os.path.join(BUILD, f'{function}.zip'), entries),
+        'requirements': extra,
+    }
+
+
+def shared_package():
+    # What every function ships today: all of functions/. sam build installs
+    # the requirements.txt at the root of the CodeUri only, on top of this.
+    entries = [
+        (os.path.relpath(path, FUNCTIONS), path)
+        for path in glob.glob(os.path.join(FUNCTIONS, '**', '*'), recursive=True)
+        if os.path.isfile(path) and '__pycache__' not in path
+    ]
+    with open(os.path.join(FUNCTIONS, 'requirements.txt')) as f:
+        pinned = [line.strip() for line in f if line.strip()]
+    return {
+        'files': len(entries),
+        'bytes': sum(os.path.getsize(path) for _name, path in entries),
+        'zip_bytes': write_zip(os.path.join(BUILD, 'shared.zip'), entries),
+        'requirements': pinned,
+    }
+
+
+def write_template(functions):
+    # Gives each function whose handler is in the template its own CodeUri,
+    # which overrides the one in Globals
+    with open(TEMPLATE) as f:
+        lines = f.read().splitlines(keepends=True)
+    output = []
+    for line in lines:
+        output.append(line)
+        match = re.match(r'^(\s+)Handler: (\w+)/app\.lambda_handler\s*$', line)
+        if match and match.group(2) in functions:
+            code_uri = os.path.relpath(os.path.join(BUILD, 'functions', match.group(2)), ROOT)
+            output.append(f"{match.group(1)}CodeUri: {code_uri}\n")
+    with open(MINIMAL_TEMPLATE, 'w') as f:
+        f.writelines(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('functions', nargs='*', help='The functions to package (default: all)')
+    args = parser.parse_args()
+
+    packages = local_packages()
+    unknown = set(args.functions) - set(handlers())
+    if unknown:
+        sys.exit(f"Unknown functions: {', '.join(sorted(unknown))}")
+    functions = args.functions or handlers()
+
+    os.makedirs(BUILD, exist_ok=True)
+    shared = shared_package()
+    print(f"{'function':<24}{'files':>7}{'bytes':>10}{'zipped':>10}{'of shared':>11}   requirements")
+    print(f"{'(shared CodeUri)':<24}{shared['files']:>7}{shared['bytes']:>10,}{shared['zip_bytes']:>10,}{'100%':>11}   {', '.join(shared['requirements']) or '-'}")
+    for function in functions:
+        result = package(function, packages)
+        share = f"{result['zip_bytes'] / shared['zip_bytes']:.0%}"
+        print(f"{function:<24}{result['files']:>7}{result['bytes']:>10,}{result['zip_bytes']:>10,}{share:>11}   {', '.join(result['requirements']) or '-'}")
+
+    write_template(functions)
+    print(f"\nArtifacts in {os.path.relpath(BUILD, ROOT)}/, template in {os.path.relpath(MINIMAL_TEMPLATE, ROOT)}")
+
+
+if __name__ == '__main__':
+    main()